@@ -25,8 +25,8 @@ class ProgressAdmin(admin.ModelAdmin):
 
 @admin.register(LeaderboardSnapshot)
 class LeaderboardSnapshotAdmin(admin.ModelAdmin):
-    list_display = ['session', 'created_at']
-    list_filter = ['created_at']
+    list_display = ['session', 'is_keyframe', 'created_at']
+    list_filter = ['is_keyframe', 'created_at']
     search_fields = ['session__code']
 
 
@@ -0,0 +1,186 @@
+"""
+Контроль нагрузки на изменяющие эндпоинты.
+
+Когда ТВ показывает QR-код, десятки телефонов заходят в join_session за
+секунды. Чтобы запросы не копились в пуле потоков, лишние отклоняются
+сразу ответом 429 с Retry-After:
+
+- ограничитель скорости (token bucket) на устройство — device_uuid из
+  запроса или устройство игрока по его токену, иначе IP;
+- ограничение числа одновременных входов в одну сессию (join_gate).
+
+Счётчики отклонённых запросов — admission_stats, отдаются в админке.
+"""
+import functools
+import math
+import threading
+import time
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.response import Response
+
+from .state import state_engine
+
+
+# (ёмкость, пополнение в секунду) для каждого scope
+RATE_LIMITS = getattr(settings, 'ADMISSION_RATE_LIMITS', {
+    'join': (3, 0.5),
+    'action': (20, 10.0),
+})
+# Сколько входов в одну сессию обрабатывается одновременно
+JOIN_CONCURRENCY = getattr(settings, 'ADMISSION_JOIN_CONCURRENCY', 8)
+JOIN_RETRY_AFTER = 1  # секунд
+
+MAX_BUCKETS = 10000  # выше — выкидываем давно полные «вёдра»
+
+
+class AdmissionStats:
+    """Счётчики отклонённых запросов"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rate_limited = {}
+        self.join_gate_rejected = {}
+        self.admitted = {}
+
+    def count(self, counter, scope):
+        with self._lock:
+            counter[scope] = counter.get(scope, 0) + 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'admitted': dict(self.admitted),
+                'rate_limited': dict(self.rate_limited),
+                'join_gate_rejected': dict(self.join_gate_rejected),
+                'joins_in_flight': join_gate.in_flight(),
+            }
+
+
+admission_stats = AdmissionStats()
+
+
+class TokenBucketLimiter:
+    """Token bucket на ключ: capacity запросов подряд, дальше rate в секунду"""
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._buckets = {}  # ключ -> [токены, время последнего пополнения]
+
+    def acquire(self, key):
+        """0, если запрос пропущен, иначе через сколько секунд будет токен"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= MAX_BUCKETS:
+                    self._prune(now)
+                bucket = self._buckets[key] = [self.capacity, now]
+            tokens = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0
+            bucket[0] = tokens
+            return (1 - tokens) / self.rate
+
+    def _prune(self, now):
+        full_after = self.capacity / self.rate
+        for key, (_, updated) in list(self._buckets.items()):
+            if now - updated >= full_after:
+                del self._buckets[key]
+
+
+limiters = {scope: TokenBucketLimiter(capacity, rate) for scope, (capacity, rate) in RATE_LIMITS.items()}
+
+
+def device_key(data, ip=None):
+    """Ключ устройства: device_uuid, иначе устройство игрока по токену, иначе IP"""
+    device_uuid = data.get('device_uuid')
+    if device_uuid:
+        return f'device:{device_uuid}'
+    token = data.get('token') or data.get('player_token')
+    if token:
+        _, player = state_engine.by_token(token)
+        if player is not None:
+            return f'device:{player.device_uuid}'
+    return f'ip:{ip}'
+
+
+def check_rate(scope, key):
+    """0 — пропустить, иначе Retry-After в секундах"""
+    wait = limiters[scope].acquire(key)
+    admission_stats.count(admission_stats.rate_limited if wait else admission_stats.admitted, scope)
+    return wait
+
+
+def rate_limited(scope):
+    """Декоратор вьюхи: token bucket по устройству, при исчерпании — сразу 429"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            from .views import get_client_ip
+            data = request.data if hasattr(request.data, 'get') else {}
+            wait = check_rate(scope, device_key(data, get_client_ip(request)))
+            if wait:
+                return too_many_requests('Слишком много запросов, повторите позже', wait)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class JoinGate:
+    """Не больше limit одновременных входов в одну сессию"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def try_enter(self, code):
+        with self._lock:
+            current = self._in_flight.get(code, 0)
+            if current >= self.limit:
+                return False
+            self._in_flight[code] = current + 1
+            return True
+
+    def leave(self, code):
+        with self._lock:
+            current = self._in_flight.get(code, 1) - 1
+            if current:
+                self._in_flight[code] = current
+            else:
+                self._in_flight.pop(code, None)
+
+    def in_flight(self):
+        with self._lock:
+            return dict(self._in_flight)
+
+
+join_gate = JoinGate(JOIN_CONCURRENCY)
+
+
+def gated_join(view):
+    """Декоратор для join_session: при переполнении сессии — сразу 429"""
+    @functools.wraps(view)
+    def wrapper(request, code, *args, **kwargs):
+        if not join_gate.try_enter(code):
+            admission_stats.count(admission_stats.join_gate_rejected, code)
+            return too_many_requests('Слишком много подключений, повторите через секунду', JOIN_RETRY_AFTER)
+        try:
+            return view(request, code, *args, **kwargs)
+        finally:
+            join_gate.leave(code)
+    return wrapper
+
+
+def too_many_requests(message, retry_after):
+    return Response(
+        {'error': message},
+        status=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={'Retry-After': str(max(1, math.ceil(retry_after)))},
+    )
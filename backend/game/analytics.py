@@ -0,0 +1,211 @@
+"""
+Потоковая аналитика уровней и мини-игр.
+
+На каждый submit_progress обновляются агрегаты по уровню и по игре
+уровня (details['game'], для бонусных — details['game_type']):
+число попыток и провалов, распределение очков и квантили времени
+прохождения. Квантили считает QuantileSketch — логарифмические корзины
+с относительной ошибкой ALPHA; скетчи (и агрегаты целиком) сливаются,
+поэтому сводка по нескольким сессиям — это merge посессионных.
+
+Агрегаты сессии живут в её состоянии в памяти (state.analytics) и при
+загрузке сессии восстанавливаются по журналу событий, таблица Progress
+не сканируется.
+"""
+import math
+import threading
+from collections import Counter
+
+from .models import GameEvent
+
+
+ALPHA = 0.01  # относительная ошибка квантилей
+QUANTILES = (0.5, 0.9, 0.99)
+LEVELS = ('green', 'yellow', 'red')  # остальное (мини-игры, казино) — уровень bonus
+MAX_CACHED_SESSIONS = 1000  # агрегаты завершённых сессий для сводки в админке
+
+
+class QuantileSketch:
+    """Мергируемый скетч квантилей для положительных значений (DDSketch)"""
+
+    def __init__(self, alpha=ALPHA):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = Counter()  # индекс корзины -> количество
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value <= 0:
+            self.zero_count += 1
+        else:
+            self.bins[math.ceil(math.log(value) / self._log_gamma)] += 1
+
+    def merge(self, other):
+        if other.alpha != self.alpha:
+            raise ValueError('Скетчи с разной точностью не сливаются')
+        self.bins.update(other.bins)
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if rank < seen:
+                # Середина корзины (gamma^(i-1), gamma^i] с относительной ошибкой alpha
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+
+class GameStats:
+    """Агрегат попыток одной игры (или уровня целиком)"""
+
+    def __init__(self):
+        self.attempts = 0
+        self.failures = 0
+        self.score_sum = 0
+        self.scores = Counter()
+        self.time_sum = 0
+        self.times = QuantileSketch()
+
+    def add(self, score, time_spent_ms, failed):
+        self.attempts += 1
+        self.failures += failed
+        self.score_sum += score
+        self.scores[score] += 1
+        # Многие игры не меряют время и шлют 0 — такие попытки в квантили не попадают
+        if time_spent_ms > 0:
+            self.time_sum += time_spent_ms
+            self.times.add(time_spent_ms)
+
+    def merge(self, other):
+        self.attempts += other.attempts
+        self.failures += other.failures
+        self.score_sum += other.score_sum
+        self.scores.update(other.scores)
+        self.time_sum += other.time_sum
+        self.times.merge(other.times)
+
+    def as_dict(self):
+        samples = self.times.count
+        return {
+            'attempts': self.attempts,
+            'failures': self.failures,
+            'failure_rate': round(self.failures / self.attempts, 4) if self.attempts else None,
+            'score': {
+                'mean': round(self.score_sum / self.attempts, 2) if self.attempts else None,
+                'min': min(self.scores) if self.scores else None,
+                'max': max(self.scores) if self.scores else None,
+                'distribution': {str(score): count for score, count in sorted(self.scores.items())},
+            },
+            'time_ms': {
+                'samples': samples,
+                'mean': round(self.time_sum / samples) if samples else None,
+                **{f'p{round(q * 100)}': _round(self.times.quantile(q)) for q in QUANTILES},
+            },
+        }
+
+
+def _round(value):
+    return None if value is None else round(value)
+
+
+def game_key(level, details):
+    """Игра уровня: номер игры для green/yellow/red, тип мини-игры для бонусных"""
+    details = details if isinstance(details, dict) else {}
+    game = details.get('game_type') or details.get('game')
+    return str(game) if game not in (None, '') else 'unknown'
+
+
+def is_failure(score, details):
+    """Провал — ноль очков или явный failed в details"""
+    return score <= 0 or bool(isinstance(details, dict) and details.get('failed'))
+
+
+class SessionAnalytics:
+    """Агрегаты сессии: level -> GameStats и (level, game) -> GameStats"""
+
+    def __init__(self):
+        self.submissions = 0
+        self.levels = {}
+        self.games = {}
+
+    def record(self, level, score, time_spent_ms, details):
+        if level not in LEVELS:
+            level = 'bonus'
+        try:
+            score = int(score or 0)
+            time_spent_ms = int(time_spent_ms or 0)
+        except (TypeError, ValueError):
+            return
+        failed = is_failure(score, details)
+        self.submissions += 1
+        self.levels.setdefault(level, GameStats()).add(score, time_spent_ms, failed)
+        self.games.setdefault((level, game_key(level, details)), GameStats()).add(score, time_spent_ms, failed)
+
+    def merge(self, other):
+        self.submissions += other.submissions
+        for level, stats in other.levels.items():
+            self.levels.setdefault(level, GameStats()).merge(stats)
+        for key, stats in other.games.items():
+            self.games.setdefault(key, GameStats()).merge(stats)
+
+    def as_dict(self):
+        levels = {}
+        for level, stats in sorted(self.levels.items()):
+            levels[level] = stats.as_dict()
+            levels[level]['games'] = {
+                game: game_stats.as_dict()
+                for (game_level, game), game_stats in sorted(self.games.items())
+                if game_level == level
+            }
+        return {'submissions': self.submissions, 'levels': levels}
+
+    @classmethod
+    def from_events(cls, session_id):
+        """Агрегаты по журналу событий сессии"""
+        analytics = cls()
+        events = GameEvent.objects.filter(
+            session_id=session_id, kind__in=('progress.submitted', 'bonus.added'),
+        ).order_by('id').values_list('kind', 'data')
+        for kind, data in events.iterator():
+            if kind == 'progress.submitted':
+                analytics.record(data['level'], data.get('raw_score', 0), data.get('time_spent_ms', 0),
+                                 data.get('details'))
+            else:
+                analytics.record(data.get('level'), data.get('amount', 0), data.get('time_spent_ms', 0),
+                                 data.get('details'))
+        return analytics
+
+
+class AnalyticsCache:
+    """Агрегаты завершённых сессий, которые не загружены в память, — для сводки"""
+
+    def __init__(self, limit=MAX_CACHED_SESSIONS):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._finished = {}  # session_id -> SessionAnalytics
+
+    def get(self, session_id, finished):
+        with self._lock:
+            analytics = self._finished.get(session_id)
+        if analytics is not None:
+            return analytics
+        analytics = SessionAnalytics.from_events(session_id)
+        if finished:
+            with self._lock:
+                if len(self._finished) >= self.limit:
+                    self._finished.pop(next(iter(self._finished)))
+                self._finished[session_id] = analytics
+        return analytics
+
+
+analytics_cache = AnalyticsCache()
@@ -5,4 +5,7 @@ class GameConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'game'
 
-
+    def ready(self):
+        # Логи game.* — через очередь и фоновый поток (game/logs.py)
+        from .logs import configure
+        configure()
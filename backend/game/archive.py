@@ -0,0 +1,173 @@
+"""
+Архивация завершённых сессий.
+
+Сессия выгружается в один сжатый NDJSON-файл (<code>_<дата>.ndjson.gz):
+первая строка — манифест, дальше по строке на объект в формате
+сериализатора Django ("python"). Селфи в архиве хранятся ссылкой на путь
+файла, сами изображения остаются в MEDIA_ROOT.
+
+После выгрузки «горячие» строки удаляются пачками, чтобы не держать
+длинную блокировку SQLite, и база сжимается через VACUUM.
+"""
+import gzip
+import json
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core import serializers
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import (
+    AdminToken,
+    AdminUser,
+    CrashBet,
+    CrashGame,
+    CrashSeedChain,
+    GameEvent,
+    LeaderboardSnapshot,
+    Player,
+    PointsTransaction,
+    Progress,
+    RigOverride,
+    Selfie,
+    Session,
+)
+
+
+ARCHIVE_FORMAT = 1
+DEFAULT_CHUNK_SIZE = 500
+
+# Порядок выгрузки/загрузки: родители раньше детей
+ARCHIVE_MODELS = [
+    (Session, 'id'),
+    (Player, 'session_id'),
+    (Progress, 'player__session_id'),
+    (Selfie, 'session_id'),
+    (CrashSeedChain, 'session_id'),
+    (CrashGame, 'session_id'),
+    (CrashBet, 'crash_game__session_id'),
+    (RigOverride, 'session_id'),
+    (PointsTransaction, 'session_id'),
+    (LeaderboardSnapshot, 'session_id'),
+    (GameEvent, 'session_id'),
+]
+
+
+def default_archive_dir():
+    return Path(getattr(settings, 'ARCHIVE_ROOT', settings.BASE_DIR / 'archives'))
+
+
+def finished_sessions(older_than_days=0):
+    qs = Session.objects.filter(status='finished')
+    if older_than_days:
+        qs = qs.filter(ended_at__lt=timezone.now() - timedelta(days=older_than_days))
+    return qs.order_by('ended_at')
+
+
+def _session_rows(model, lookup, session_id):
+    return model.objects.filter(**{lookup: session_id}).order_by('pk')
+
+
+def export_session(session, archive_dir, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Выгрузка сессии в .ndjson.gz. Возвращает (путь, {модель: количество})."""
+    archive_dir = Path(archive_dir)
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    stamp = (session.ended_at or timezone.now()).strftime('%Y%m%d_%H%M%S')
+    path = archive_dir / f'{session.code}_{stamp}.ndjson.gz'
+    tmp_path = path.with_suffix('.tmp')
+
+    counts = {model._meta.label_lower: _session_rows(model, lookup, session.id).count()
+              for model, lookup in ARCHIVE_MODELS}
+    manifest = {
+        'model': 'archive.manifest',
+        'format': ARCHIVE_FORMAT,
+        'session': session.code,
+        'session_id': str(session.id),
+        'archived_at': timezone.now().isoformat(),
+        'counts': counts,
+    }
+
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as fh:
+        fh.write(json.dumps(manifest, ensure_ascii=False) + '\n')
+        for model, lookup in ARCHIVE_MODELS:
+            rows = _session_rows(model, lookup, session.id).iterator(chunk_size=chunk_size)
+            for obj in serializers.serialize('python', rows):
+                fh.write(json.dumps(obj, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+    tmp_path.replace(path)
+    return path, counts
+
+
+def delete_session_rows(session, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Удаление строк сессии пачками, от детей к родителям"""
+    deleted = {}
+    for model, lookup in reversed(ARCHIVE_MODELS):
+        total = 0
+        while True:
+            pks = list(_session_rows(model, lookup, session.id).values_list('pk', flat=True)[:chunk_size])
+            if not pks:
+                break
+            with transaction.atomic():
+                model.objects.filter(pk__in=pks).delete()
+            total += len(pks)
+        deleted[model._meta.label_lower] = total
+    return deleted
+
+
+def purge_expired_admin_tokens(chunk_size=DEFAULT_CHUNK_SIZE):
+    total = 0
+    while True:
+        pks = list(AdminToken.objects.filter(expires_at__lt=timezone.now()).values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return total
+        AdminToken.objects.filter(pk__in=pks).delete()
+        total += len(pks)
+
+
+def vacuum():
+    """Возвращаем место на диске и пересобираем индексы"""
+    if connection.vendor in ('sqlite', 'postgresql'):
+        with connection.cursor() as cursor:
+            cursor.execute('VACUUM')
+
+
+def read_archive(path):
+    """(манифест, итератор объектов) из архива"""
+    fh = gzip.open(path, 'rt', encoding='utf-8')
+    manifest = json.loads(fh.readline())
+    if manifest.get('model') != 'archive.manifest':
+        fh.close()
+        raise ValueError(f'{path}: это не архив сессии')
+
+    def objects():
+        with fh:
+            for line in fh:
+                if line.strip():
+                    yield json.loads(line)
+    return manifest, objects()
+
+
+def import_archive(path, replace=False):
+    """Восстановление сессии из архива (для просмотра). Возвращает код сессии и количества."""
+    manifest, objects = read_archive(path)
+    code = manifest['session']
+    existing = Session.objects.filter(code=code).first()
+    if existing and not replace:
+        raise ValueError(f'Сессия {code} уже есть в базе (используйте --replace)')
+
+    admin_ids = {str(pk) for pk in AdminUser.objects.values_list('id', flat=True)}
+    counts = {}
+    with transaction.atomic():
+        if existing:
+            existing.delete()
+        for obj in serializers.deserialize('python', objects, ignorenonexistent=True):
+            instance = obj.object
+            # Админа из архива может не быть в этой базе
+            if getattr(instance, 'admin_id', None) and str(instance.admin_id) not in admin_ids:
+                instance.admin_id = None
+            obj.save()
+            label = instance._meta.label_lower
+            counts[label] = counts.get(label, 0) + 1
+    return code, counts
@@ -1,8 +1,30 @@
-import json
+import logging
+
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
-from .models import Session, Player
+from django.http import Http404
+from django.utils import timezone
+from . import views
+from .admission import check_rate, device_key
+from .encoding import DECODE_ERRORS, negotiate
+from .idempotency import IN_FLIGHT_RETRY_AFTER, data_fingerprint, idempotency_store, replay
+from .logs import log, log_error
+from .serializers import player_public_data
+from .serving import current_worker, forwarded_client_ip
+from .state import MisdirectedSession, state_engine
+
+
+# Игровые команды по уже открытому сокету: тип сообщения -> (действие, поле с токеном игрока,
+# эндпоинт Idempotency-Key как у REST-вьюхи или None). Выполняются той же логикой, что и
+# REST-вьюхи; ответ — action.ack / action.error с request_id.
+ACTIONS = {
+    'crash.bet': (views.perform_place_crash_bet, 'token', 'place_crash_bet'),
+    'crash.cashout': (views.perform_cashout_crash_bet, 'token', 'cashout_crash_bet'),
+    'progress.submit': (views.perform_submit_progress, 'token', 'submit_progress'),
+    'progress.batch': (views.perform_submit_progress_batch, 'token', 'submit_progress_batch'),
+    'player.progress': (views.perform_update_player_progress, 'player_token', None),
+}
 
 
 class SessionConsumer(AsyncWebsocketConsumer):
@@ -11,20 +33,22 @@ class SessionConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.session_code = self.scope['url_route']['kwargs']['session_code']
         self.room_group_name = f'session_{self.session_code}'
-        
-        print(f"WebSocket connection attempt for session: {self.session_code}")
+        # Формат сообщений выбирает клиент (JSON по умолчанию)
+        self.codec, subprotocol = negotiate(self.scope)
+        # Токен игрока после сообщения auth — для игровых команд
+        self.player_token = None
+        self.player_id = None
         
         try:
             # Проверяем существование сессии ПЕРЕД принятием соединения
             session = await self.get_session()
             if not session:
-                print(f"Session {self.session_code} not found")
+                self.log('connect', 'ws.rejected', level=logging.WARNING, reason='session_not_found')
                 await self.close(code=4001)
                 return
             
             # Принимаем соединение
-            await self.accept()
-            print(f"WebSocket accepted for session: {self.session_code}")
+            await self.accept(subprotocol=subprotocol)
             
             # Присоединяемся к группе
             try:
@@ -32,25 +56,17 @@ class SessionConsumer(AsyncWebsocketConsumer):
                     self.room_group_name,
                     self.channel_name
                 )
-                print(f"Added to group: {self.room_group_name}")
-            except Exception as e:
-                print(f"Error adding to group: {e}")
-                import traceback
-                traceback.print_exc()
+            except Exception:
+                log_error('connect', 'ws.group_add_failed', session=self.session_code)
                 # Продолжаем даже если не удалось добавить в группу
             
             # Отправляем текущее состояние при подключении
             await self.send_initial_state()
-            print(f"Initial state sent for session: {self.session_code}")
-        except Exception as e:
-            print(f"Error in connect: {e}")
-            import traceback
-            traceback.print_exc()
+            self.log('connect', 'ws.connected', codec=self.codec.name)
+        except Exception:
+            log_error('connect', 'ws.connect_failed', session=self.session_code)
             try:
-                await self.send(text_data=json.dumps({
-                    'type': 'error',
-                    'payload': {'message': 'Ошибка подключения'}
-                }))
+                await self.send_message('error', {'message': 'Ошибка подключения'})
             except:
                 pass
             try:
@@ -64,16 +80,33 @@ class SessionConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             self.channel_name
         )
+        self.log('disconnect', 'ws.disconnected', close_code=close_code)
     
-    async def receive(self, text_data):
+    def log(self, category, event, level=logging.INFO, **fields):
+        """Событие сокета с кодом сессии и игроком (после auth)"""
+        log(category, event, session=self.session_code, player=self.player_id, level=level, **fields)
+    
+    async def receive(self, text_data=None, bytes_data=None):
         """Обработка входящих сообщений от клиента"""
+        # Время прихода — по нему сервер считает множитель при кэшауте
+        received_at = timezone.now()
+        try:
+            data = self.codec.decode(text_data=text_data, bytes_data=bytes_data)
+        except DECODE_ERRORS:
+            # Битый JSON/msgpack/deflate-фрейм — игнорируем
+            return
+        if not isinstance(data, dict):
+            return
         try:
-            data = json.loads(text_data)
             message_type = data.get('type')
             payload = data.get('payload', {})
             
             if message_type == 'ping':
-                await self.send(text_data=json.dumps({'type': 'pong'}))
+                await self.send_message('pong')
+            elif message_type == 'auth':
+                await self.authenticate(payload)
+            elif message_type in ACTIONS:
+                await self.run_action(message_type, payload, received_at)
             elif message_type == 'blackjack.ready':
                 # Рассылаем сообщение о готовности всем клиентам в группе
                 try:
@@ -84,9 +117,9 @@ class SessionConsumer(AsyncWebsocketConsumer):
                             'payload': payload
                         }
                     )
-                    print(f"Broadcasting blackjack.ready for player {payload.get('player_id')}")
-                except Exception as e:
-                    print(f"Error broadcasting blackjack.ready: {e}")
+                    self.log('broadcast', 'blackjack.ready', target=payload.get('player_id'))
+                except Exception:
+                    log_error('broadcast', 'blackjack.ready', session=self.session_code, player=self.player_id)
             elif message_type == 'blackjack.start':
                 # Рассылаем сообщение о начале игры всем клиентам
                 try:
@@ -97,9 +130,9 @@ class SessionConsumer(AsyncWebsocketConsumer):
                             'payload': payload
                         }
                     )
-                    print(f"Broadcasting blackjack.start for session {self.session_code}")
-                except Exception as e:
-                    print(f"Error broadcasting blackjack.start: {e}")
+                    self.log('broadcast', 'blackjack.start')
+                except Exception:
+                    log_error('broadcast', 'blackjack.start', session=self.session_code, player=self.player_id)
             elif message_type == 'blackjack.action':
                 # Рассылаем игровое действие всем клиентам
                 try:
@@ -110,99 +143,206 @@ class SessionConsumer(AsyncWebsocketConsumer):
                             'payload': payload
                         }
                     )
-                except Exception as e:
-                    print(f"Error broadcasting blackjack.action: {e}")
+                    self.log('broadcast', 'blackjack.action')
+                except Exception:
+                    log_error('broadcast', 'blackjack.action', session=self.session_code, player=self.player_id)
             
-        except json.JSONDecodeError:
-            pass
+        except Exception:
+            log_error('receive', 'ws.receive_failed', session=self.session_code, player=self.player_id)
+    
+    async def authenticate(self, payload):
+        """Привязка сокета к игроку этой сессии по токену"""
+        request_id = payload.get('request_id')
+        token = payload.get('token')
+        player_id = await self.get_player_id(token) if token else None
+        if player_id is None:
+            await self.send_message('action.error', {
+                'request_id': request_id,
+                'action': 'auth',
+                'status': 401,
+                'message': 'Неверный токен игрока',
+            })
+            return
+        self.player_token = token
+        self.player_id = player_id
+        await self.send_message('action.ack', {
+            'request_id': request_id,
+            'action': 'auth',
+            'result': {'player_id': player_id},
+        })
+    
+    async def run_action(self, action, payload, received_at):
+        """Игровая команда: та же логика, что у REST, ответ с тем же request_id"""
+        request_id = payload.get('request_id')
+        if self.player_token is None:
+            await self.send_message('action.error', {
+                'request_id': request_id,
+                'action': action,
+                'status': 401,
+                'message': 'Сначала нужно отправить auth',
+            })
+            return
+        
+        perform, token_field, endpoint = ACTIONS[action]
+        data = {key: value for key, value in payload.items() if key not in ('request_id', 'idempotency_key')}
+        data[token_field] = self.player_token
+        idempotency_key = payload.get('idempotency_key') if endpoint else None
+        wait = await self.check_rate(data)
+        if wait:
+            await self.send_message('action.error', {
+                'request_id': request_id,
+                'action': action,
+                'status': 429,
+                'message': 'Слишком много запросов, повторите позже',
+                'retry_after': wait,
+            })
+            return
+        try:
+            result, replayed = await self.perform_action(perform, data, received_at, endpoint, idempotency_key)
+        except views.ActionError as e:
+            error = {'status': e.status_code, 'message': e.message, **e.extra}
+        except Http404:
+            error = {'status': 404, 'message': 'Не найдено'}
         except Exception as e:
-            print(f"Error in receive: {e}")
-            import traceback
-            traceback.print_exc()
+            log_error('action', action, session=self.session_code, player=self.player_id)
+            error = {'status': 500, 'message': str(e)}
+        else:
+            ack = {'request_id': request_id, 'action': action, 'result': result}
+            if replayed:
+                ack['replayed'] = True
+            await self.send_message('action.ack', ack)
+            return
+        await self.send_message('action.error', dict(request_id=request_id, action=action, **error))
+    
+    @database_sync_to_async
+    def perform_action(self, perform, data, received_at, endpoint, idempotency_key):
+        """(результат, replayed); с idempotency_key — через то же хранилище, что и REST"""
+        if not idempotency_key:
+            return self.call_action(perform, data, received_at), False
+        if not isinstance(idempotency_key, str):
+            raise views.ActionError('idempotency_key должен быть строкой')
+        fingerprint = data_fingerprint(data)
+        outcome = replay(endpoint, idempotency_key, fingerprint)
+        if outcome is not None:
+            status_code, body, replayed = outcome
+            if replayed:
+                return body, True
+            extra = {'retry_after': IN_FLIGHT_RETRY_AFTER} if status_code == 409 else {}
+            raise views.ActionError(body['error'], status_code, **extra)
+        try:
+            result = self.call_action(perform, data, received_at)
+        except BaseException:
+            idempotency_store.abort(endpoint, idempotency_key)
+            raise
+        idempotency_store.finish(endpoint, idempotency_key, fingerprint, 200, result)
+        return result, False
+    
+    def call_action(self, perform, data, received_at):
+        if perform is views.perform_cashout_crash_bet:
+            return perform(data, received_at=received_at)
+        return perform(data)
+    
+    @database_sync_to_async
+    def check_rate(self, data):
+        return check_rate('action', device_key(data, self.client_ip()))
+    
+    def client_ip(self):
+        """Адрес клиента; за роутером manage.py serve — последний элемент X-Forwarded-For"""
+        forwarded = dict(self.scope.get('headers', [])).get(b'x-forwarded-for')
+        if forwarded and current_worker() is not None:
+            return forwarded_client_ip(forwarded.decode('latin-1'))
+        return self.scope.get('client', [None])[0]
+    
+    @database_sync_to_async
+    def get_player_id(self, token):
+        try:
+            state, player = state_engine.by_token(token)
+        except MisdirectedSession:
+            # Токен игрока другой сессии (её держит другой воркер)
+            return None
+        if player is None or state.session.code != self.session_code:
+            return None
+        return str(player.id)
     
     # Обработчики групповых сообщений (broadcast)
     
     async def session_state(self, event):
         """Отправка состояния сессии"""
-        await self.send(text_data=json.dumps({
-            'type': 'session.state',
-            'payload': event['payload']
-        }))
+        await self.send_message('session.state', event['payload'])
     
     async def players_list(self, event):
         """Отправка списка игроков"""
-        await self.send(text_data=json.dumps({
-            'type': 'players.list',
-            'payload': event['payload']
-        }))
+        await self.send_message('players.list', event['payload'])
     
     async def player_update(self, event):
         """Отправка обновления игрока"""
-        await self.send(text_data=json.dumps({
-            'type': 'player.update',
-            'payload': event['payload']
-        }))
+        await self.send_message('player.update', event['payload'])
 
     async def player_balance_update(self, event):
         """Уведомление игрока об изменении баланса"""
-        await self.send(text_data=json.dumps({
-            'type': 'player.balance_update',
-            'payload': event['payload']
-        }))
+        await self.send_message('player.balance_update', event['payload'])
+    
+    async def player_balance_bulk_update(self, event):
+        """Массовое изменение балансов одним сообщением"""
+        await self.send_message('player.balance_bulk_update', event['payload'])
     
     async def leaderboard_update(self, event):
         """Отправка обновления лидерборда"""
-        await self.send(text_data=json.dumps({
-            'type': 'leaderboard.update',
-            'payload': event['payload']
-        }))
+        await self.send_message('leaderboard.update', event['payload'])
     
     async def game_event(self, event):
         """Отправка игрового события"""
-        await self.send(text_data=json.dumps({
-            'type': 'game.event',
-            'payload': event['payload']
-        }))
+        await self.send_message('game.event', event['payload'])
+    
+    async def timer_tick(self, event):
+        """Обратный отсчёт уровня по серверному таймеру"""
+        await self.send_message('timer.tick', event['payload'])
+    
+    async def crash_game_finished(self, event):
+        """Отправка результата раунда Краш"""
+        await self.send_message('game.event', {
+            'kind': 'crash.finished',
+            'data': event['payload']
+        })
     
     async def selfie_uploaded(self, event):
         """Отправка события загрузки селфи"""
-        await self.send(text_data=json.dumps({
-            'type': 'game.event',
-            'payload': {
-                'kind': 'selfie.uploaded',
-                'data': event['payload']
-            }
-        }))
+        await self.send_message('game.event', {
+            'kind': 'selfie.uploaded',
+            'data': event['payload']
+        })
     
     async def blackjack_ready(self, event):
         """Отправка сообщения о готовности игрока к блэкджеку"""
-        await self.send(text_data=json.dumps({
-            'type': 'blackjack.ready',
-            'payload': event['payload']
-        }))
+        await self.send_message('blackjack.ready', event['payload'])
     
     async def blackjack_start(self, event):
         """Отправка сообщения о начале игры в блэкджек"""
-        await self.send(text_data=json.dumps({
-            'type': 'game.event',
-            'payload': {
-                'kind': 'blackjack.start',
-                'data': event['payload']
-            }
-        }))
+        await self.send_message('game.event', {
+            'kind': 'blackjack.start',
+            'data': event['payload']
+        })
     
     async def blackjack_action(self, event):
         """Отправка игрового действия в блэкджек"""
-        await self.send(text_data=json.dumps({
-            'type': 'game.event',
-            'payload': {
-                'kind': 'blackjack.action',
-                'data': event['payload']
-            }
-        }))
+        await self.send_message('game.event', {
+            'kind': 'blackjack.action',
+            'data': event['payload']
+        })
     
     # Вспомогательные методы
     
+    async def send_message(self, message_type, payload=None):
+        """Отправка сообщения клиенту в согласованном формате"""
+        message = {'type': message_type}
+        if payload is not None:
+            message['payload'] = payload
+        frame = self.codec.encode(message)
+        if self.codec.binary:
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+    
     async def send_initial_state(self):
         """Отправка начального состояния при подключении"""
         try:
@@ -212,97 +352,53 @@ class SessionConsumer(AsyncWebsocketConsumer):
             
             # Состояние сессии
             try:
-                await self.send(text_data=json.dumps({
-                    'type': 'session.state',
-                    'payload': {
-                        'session_id': str(session.id),
-                        'code': session.code,
-                        'status': session.status,
-                    }
-                }))
-            except Exception as e:
-                print(f"Error sending session.state: {e}")
+                await self.send_message('session.state', {
+                    'session_id': str(session.id),
+                    'code': session.code,
+                    'status': session.status,
+                })
+            except Exception:
+                log_error('connect', 'ws.initial_state_failed', session=self.session_code, part='session.state')
             
             # Список игроков
             try:
                 players = await self.get_players()
-                await self.send(text_data=json.dumps({
-                    'type': 'players.list',
-                    'payload': {
-                        'session_id': str(session.id),
-                        'players': players
-                    }
-                }))
-            except Exception as e:
-                print(f"Error sending players.list: {e}")
+                await self.send_message('players.list', {
+                    'session_id': str(session.id),
+                    'players': players
+                })
+            except Exception:
+                log_error('connect', 'ws.initial_state_failed', session=self.session_code, part='players.list')
             
             # Лидерборд
             try:
                 leaderboard = await self.get_leaderboard()
-                await self.send(text_data=json.dumps({
-                    'type': 'leaderboard.update',
-                    'payload': {
-                        'session_id': str(session.id),
-                        'leaderboard': leaderboard
-                    }
-                }))
-            except Exception as e:
-                print(f"Error sending leaderboard.update: {e}")
-        except Exception as e:
-            print(f"Error in send_initial_state: {e}")
-            import traceback
-            traceback.print_exc()
+                await self.send_message('leaderboard.update', {
+                    'session_id': str(session.id),
+                    'leaderboard': leaderboard
+                })
+            except Exception:
+                log_error('connect', 'ws.initial_state_failed', session=self.session_code, part='leaderboard.update')
+        except Exception:
+            log_error('connect', 'ws.initial_state_failed', session=self.session_code)
     
     @database_sync_to_async
     def get_session(self):
-        try:
-            return Session.objects.get(code=self.session_code)
-        except Session.DoesNotExist:
-            return None
+        state = state_engine.get(self.session_code)
+        return state.session if state else None
     
     @database_sync_to_async
     def get_players(self):
-        try:
-            session = Session.objects.get(code=self.session_code)
-            players = session.players.all()
-            return [
-                {
-                    'id': str(p.id),
-                    'name': p.name,
-                    'status': p.status,
-                    'current_level': p.current_level,
-                    'total_score': p.total_score,
-                    'bonus_score': p.bonus_score,
-                    'final_score': p.final_score,
-                }
-                for p in players
-            ]
-        except Session.DoesNotExist:
+        state = state_engine.get(self.session_code)
+        if state is None:
             return []
+        with state.lock:
+            players = state.ordered_players()
+        return [player_public_data(p) for p in players]
     
     @database_sync_to_async
     def get_leaderboard(self):
-        try:
-            session = Session.objects.get(code=self.session_code)
-            # Сортируем по total_score + bonus_score (final_score - это property, не поле БД)
-            # Используем Python для сортировки по final_score, так как это вычисляемое свойство
-            players_list = list(session.players.all())
-            players_list.sort(key=lambda p: (p.total_score + p.bonus_score, p.total_score, -p.created_at.timestamp()), reverse=True)
-            players = players_list
-            return [
-                {
-                    'rank': idx + 1,
-                    'player_id': str(p.id),
-                    'name': p.name,
-                    'total_score': p.total_score,
-                    'bonus_score': p.bonus_score,
-                    'final_score': p.final_score,
-                    'current_level': p.current_level,
-                    'status': p.status,
-                }
-                for idx, p in enumerate(players)
-            ]
-        except Session.DoesNotExist:
+        state = state_engine.get(self.session_code)
+        if state is None:
             return []
-
-
+        return views._build_leaderboard(state)
@@ -0,0 +1,273 @@
+"""
+Provably Fair для игры Краш.
+
+Сиды раундов берутся из заранее сгенерированной цепочки хэшей
+(обратный SHA-256, как в bustabit): от секретного корня считаем
+h[i-1] = sha256(h[i]) и отдаём раунды с конца цепочки. Голова цепочки
+(sha256 первого сида) публикуется при создании сессии, поэтому каждый
+раскрытый сид проверяется одним хэшированием к предыдущему.
+
+Пул держит в памяти оставшиеся сиды вместе с уже посчитанными множителями,
+так что создание раунда — это pop из deque.
+"""
+import hashlib
+import secrets
+import threading
+from collections import deque
+
+from django.db import transaction
+from django.db.models import F, Max
+
+from .models import CrashGame, CrashSeedChain, RigOverride
+
+
+# Длина одной цепочки (пакета) сидов
+CHAIN_LENGTH = 1000
+
+# Взвешенные уровни множителей:
+# (верхняя граница hash_float, нижняя граница, ширина, базовый множитель, размах множителя)
+# 70% низкие (1.00-2.0), 20% средние (2.0-4.0), 7% высокие (4.0-8.0),
+# 2.5% очень высокие (8.0-15.0), 0.5% экстремальные (15.0-50.0)
+MULTIPLIER_TIERS = [
+    (0.70, 0.0, 0.70, 1.00, 1.0),
+    (0.90, 0.70, 0.20, 2.0, 2.0),
+    (0.97, 0.90, 0.07, 4.0, 4.0),
+    (0.995, 0.97, 0.025, 8.0, 7.0),
+    (1.0, 0.995, 0.005, 15.0, 35.0),
+]
+MAX_MULTIPLIER = 50.0
+
+
+def sha256_hex(value):
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def hash_to_float(server_seed, nonce):
+    """SHA-256(server_seed:nonce) -> число от 0 до 1"""
+    hmac_hash = sha256_hex(f"{server_seed}:{nonce}")
+    hash_int = int(hmac_hash[:8], 16)  # Берем первые 8 символов
+    return hash_int / (16 ** 8)
+
+
+def multiplier_from_float(hash_float):
+    """Множитель по взвешенным уровням MULTIPLIER_TIERS"""
+    for upper, lower, width, base, span in MULTIPLIER_TIERS[:-1]:
+        if hash_float < upper:
+            break
+    else:
+        upper, lower, width, base, span = MULTIPLIER_TIERS[-1]
+    multiplier = round(base + ((hash_float - lower) / width) * span, 2)
+    # Ограничиваем максимум 50.0
+    return min(multiplier, MAX_MULTIPLIER)
+
+
+def crash_multiplier(server_seed, nonce):
+    """Честный множитель раунда — то, что проверяет игрок"""
+    return multiplier_from_float(hash_to_float(server_seed, nonce))
+
+
+def multiplier_at(game, at):
+    """
+    Множитель раунда в момент at — та же кривая, что рисует CrashScreen:
+    после фазы ставок растёт с ease-out до game.multiplier за duration_seconds.
+    None, если раунд ещё не начался или уже упал.
+    """
+    if game.betting_phase_end is None or at < game.betting_phase_end:
+        return None
+    progress = (at - game.betting_phase_end).total_seconds() / game.duration_seconds
+    if progress >= 1:
+        return None
+    eased = 1 - (1 - progress) ** 2
+    return round(1 + (game.multiplier - 1) * eased, 2)
+
+
+def build_chain(root_seed, length):
+    """Сиды цепочки в порядке раундов: chain[0] играется первым"""
+    seeds = [root_seed]
+    for _ in range(length - 1):
+        seeds.append(sha256_hex(seeds[-1]))
+    seeds.reverse()
+    return seeds
+
+
+def create_chain(session, length=CHAIN_LENGTH):
+    """Новая цепочка для сессии. Нонсы продолжают предыдущие раунды."""
+    last = CrashSeedChain.objects.filter(session=session).order_by('-nonce_start').first()
+    if last:
+        nonce_start = last.nonce_start + last.length
+    else:
+        max_nonce = CrashGame.objects.filter(session=session).aggregate(m=Max('nonce'))['m']
+        nonce_start = (max_nonce or 0) + 1
+
+    root_seed = secrets.token_hex(32)
+    seeds = build_chain(root_seed, length)
+    chain = CrashSeedChain.objects.create(
+        session=session,
+        root_seed=root_seed,
+        head_hash=sha256_hex(seeds[0]),
+        length=length,
+        nonce_start=nonce_start,
+    )
+    return chain, seeds
+
+
+class CrashRound:
+    """Заранее посчитанный раунд из цепочки"""
+    __slots__ = ('chain_id', 'index', 'server_seed', 'server_seed_hash', 'nonce', 'multiplier')
+
+    def __init__(self, chain_id, index, server_seed, nonce):
+        self.chain_id = chain_id
+        self.index = index
+        self.server_seed = server_seed
+        self.server_seed_hash = sha256_hex(server_seed)
+        self.nonce = nonce
+        self.multiplier = crash_multiplier(server_seed, nonce)
+
+
+class CrashChainPool:
+    """Пул предвычисленных раундов по сессиям (в памяти процесса)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rounds = {}  # session_id -> deque[CrashRound]
+        self._pending_rigs = set()  # session_id, для которых есть неиспользованная подкрутка
+
+    def _load(self, session):
+        """Заполняет пул из текущей цепочки сессии или создаёт новую"""
+        chain = CrashSeedChain.objects.filter(
+            session=session, next_index__lt=F('length')
+        ).order_by('nonce_start').first()
+        if chain:
+            seeds = build_chain(chain.root_seed, chain.length)
+        else:
+            chain, seeds = create_chain(session)
+        if session.id not in self._rounds:
+            # Первое обращение к сессии в этом процессе — подтягиваем флаг подкрутки
+            if RigOverride.objects.filter(session=session, consumed=False).exists():
+                self._pending_rigs.add(session.id)
+        self._rounds[session.id] = deque(
+            CrashRound(chain.id, idx, seeds[idx], chain.nonce_start + idx)
+            for idx in range(chain.next_index, chain.length)
+        )
+        return chain
+
+    def ensure_chain(self, session):
+        """Готовит цепочку заранее (например, при создании сессии)"""
+        with self._lock:
+            if not self._rounds.get(session.id):
+                self._load(session)
+
+    def pop(self, session):
+        """Следующий раунд сессии за O(1)"""
+        with self._lock:
+            if not self._rounds.get(session.id):
+                self._load(session)
+            crash_round = self._rounds[session.id].popleft()
+        # Сдвигаем курсор цепочки, чтобы после рестарта сиды не повторялись
+        CrashSeedChain.objects.filter(id=crash_round.chain_id).update(next_index=crash_round.index + 1)
+        return crash_round
+
+    def mark_rig_pending(self, session_id):
+        self._pending_rigs.add(session_id)
+
+    def take_rig(self, session):
+        """Подкрутка для раунда; в БД идём только если она действительно создавалась"""
+        if session.id not in self._pending_rigs:
+            return None
+        with transaction.atomic():
+            rig = RigOverride.objects.select_for_update().filter(
+                session=session, consumed=False
+            ).order_by('-created_at').first()
+            if not rig:
+                self._pending_rigs.discard(session.id)
+                return None
+            if rig.apply_once:
+                rig.consumed = True
+                rig.save(update_fields=['consumed'])
+                if not RigOverride.objects.filter(session=session, consumed=False).exists():
+                    self._pending_rigs.discard(session.id)
+        return rig
+
+    def forget(self, session_id):
+        with self._lock:
+            self._rounds.pop(session_id, None)
+            self._pending_rigs.discard(session_id)
+
+
+chain_pool = CrashChainPool()
+
+
+def verify_session_history(session):
+    """
+    Проверка всех завершённых раундов сессии.
+
+    Для каждого раунда: хэш сида совпадает с опубликованным, сид сцеплен
+    с предыдущим (или с головой цепочки) и множитель совпадает с честным.
+    """
+    chains = {c.id: c for c in CrashSeedChain.objects.filter(session=session)}
+    games = CrashGame.objects.filter(
+        session=session, ended_at__isnull=False
+    ).order_by('nonce').only(
+        'id', 'multiplier', 'server_seed', 'server_seed_hash', 'nonce', 'chain_id', 'started_at'
+    )
+
+    rounds = []
+    prev_by_chain = {}  # chain_id -> (index, seed) последнего проверенного раунда
+    all_ok = True
+    for game in games:
+        seed = game.server_seed or ''
+        hash_ok = bool(seed) and sha256_hex(seed) == game.server_seed_hash
+        expected = crash_multiplier(seed, game.nonce) if seed else None
+        multiplier_ok = expected is not None and abs(expected - game.multiplier) < 0.005
+
+        chain = chains.get(game.chain_id)
+        link_ok = None
+        if chain:
+            index = game.nonce - chain.nonce_start
+            prev = prev_by_chain.get(chain.id)
+            if index == 0:
+                link_ok = game.server_seed_hash == chain.head_hash
+            elif prev and prev[0] == index - 1:
+                link_ok = game.server_seed_hash == prev[1]
+            elif prev:
+                # Между раундами пропущены индексы (раунд не завершён) — дохэшируем
+                expected_prev = seed
+                for _ in range(index - prev[0]):
+                    expected_prev = sha256_hex(expected_prev)
+                link_ok = expected_prev == prev[1]
+            else:
+                expected_head = seed
+                for _ in range(index + 1):
+                    expected_head = sha256_hex(expected_head)
+                link_ok = expected_head == chain.head_hash
+            prev_by_chain[chain.id] = (index, seed)
+
+        ok = hash_ok and multiplier_ok and link_ok is not False
+        all_ok = all_ok and ok
+        rounds.append({
+            'game_id': str(game.id),
+            'nonce': game.nonce,
+            'server_seed': seed or None,
+            'server_seed_hash': game.server_seed_hash,
+            'multiplier': game.multiplier,
+            'expected_multiplier': expected,
+            'hash_ok': hash_ok,
+            'chain_link_ok': link_ok,
+            'multiplier_ok': multiplier_ok,
+            'verified': ok,
+        })
+
+    return {
+        'chains': [
+            {
+                'chain_id': str(c.id),
+                'head_hash': c.head_hash,
+                'length': c.length,
+                'nonce_start': c.nonce_start,
+                'created_at': c.created_at.isoformat(),
+            }
+            for c in sorted(chains.values(), key=lambda c: c.nonce_start)
+        ],
+        'rounds': rounds,
+        'verified': all_ok,
+    }
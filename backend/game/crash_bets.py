@@ -0,0 +1,126 @@
+"""
+История ставок Краш игрока.
+
+Постраничная выдача по курсору (created_at, id), балансы до/после ставки
+из журнала PointsTransaction и агрегаты по игроку, посчитанные одним
+SQL-запросом и закэшированные до следующей ставки или расчёта игрока.
+
+В журнале у ставки до двух записей: списание ставки при размещении и выплата
+при выигрыше или кэшауте. Проигрыш ничего не пишет — баланс до ставки берётся
+из первой записи, после — из последней.
+"""
+import threading
+from datetime import datetime
+
+from django.db.models import Case, Count, F, FloatField, IntegerField, Max, OuterRef, Q, Subquery, Sum, When
+
+from .models import CrashBet, PointsTransaction
+from .pagination import paginate
+
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+SETTLED_STATUSES = ('won', 'lost', 'cashed_out')
+
+
+def record_stake(bet):
+    """Запись в журнал о списании ставки; вызывать после сохранения игрока"""
+    player = bet.player
+    if bet.bet_amount:
+        PointsTransaction.objects.create(
+            player=player,
+            session_id=player.session_id,
+            amount=-bet.bet_amount,
+            reason=f'Краш: ставка {bet.bet_amount} на {bet.multiplier}x',
+            crash_bet=bet,
+            balance_after=player.final_score,
+        )
+    player_stats_cache.invalidate(player.id)
+
+
+def record_settlement(bet, amount):
+    """Запись в журнал о расчёте ставки; вызывать после сохранения игрока"""
+    player = bet.player
+    PointsTransaction.objects.create(
+        player=player,
+        session_id=player.session_id,
+        amount=amount,
+        reason=f'Краш: ставка {bet.bet_amount} на {bet.multiplier}x ({bet.status})',
+        crash_bet=bet,
+        balance_after=player.final_score,
+    )
+    player_stats_cache.invalidate(player.id)
+
+
+def bets_page(player, cursor=None, limit=PAGE_SIZE):
+    """Страница ставок игрока, новые первыми. Возвращает (bets, next_cursor)."""
+    ledger = PointsTransaction.objects.filter(crash_bet=OuterRef('pk'))
+    first = ledger.order_by('created_at')
+    qs = CrashBet.objects.filter(player=player).select_related('crash_game').annotate(
+        balance_before=Subquery(first.annotate(before=F('balance_after') - F('amount')).values('before')[:1]),
+        balance_after=Subquery(ledger.order_by('-created_at').values('balance_after')[:1]),
+    )
+    return paginate(qs, 'created_at', cursor=cursor, limit=limit, parse=datetime.fromisoformat)
+
+
+def compute_player_stats(player):
+    """Агрегаты по ставкам игрока одним запросом"""
+    payout = Case(
+        When(status='won', then=F('win_amount')),
+        When(status='cashed_out', then=F('bet_amount') + F('win_amount')),
+        default=0,
+        output_field=IntegerField(),
+    )
+    won_multiplier = Case(
+        When(status='won', then=F('multiplier')),
+        When(status='cashed_out', then=F('cashout_multiplier')),
+        default=None,
+        output_field=FloatField(),
+    )
+    settled = Q(status__in=SETTLED_STATUSES)
+    row = CrashBet.objects.filter(player=player).aggregate(
+        bets_count=Count('id'),
+        settled_count=Count('id', filter=settled),
+        wins=Count('id', filter=Q(status__in=('won', 'cashed_out'))),
+        losses=Count('id', filter=Q(status='lost')),
+        total_wagered=Sum('bet_amount', filter=settled),
+        total_won=Sum(payout, filter=settled),
+        best_multiplier=Max(won_multiplier),
+    )
+    total_wagered = row['total_wagered'] or 0
+    total_won = row['total_won'] or 0
+    return {
+        'bets_count': row['bets_count'],
+        'settled_count': row['settled_count'],
+        'wins': row['wins'],
+        'losses': row['losses'],
+        'total_wagered': total_wagered,
+        'total_won': total_won,
+        'net': total_won - total_wagered,
+        'roi': round((total_won - total_wagered) / total_wagered, 4) if total_wagered else None,
+        'best_multiplier': row['best_multiplier'],
+    }
+
+
+class PlayerStatsCache:
+    """Кэш агрегатов до следующей ставки или расчёта игрока"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def get(self, player):
+        stats = self._stats.get(player.id)
+        if stats is None:
+            stats = compute_player_stats(player)
+            with self._lock:
+                self._stats[player.id] = stats
+        return stats
+
+    def invalidate(self, player_id):
+        with self._lock:
+            self._stats.pop(player_id, None)
+
+
+player_stats_cache = PlayerStatsCache()
@@ -0,0 +1,182 @@
+"""
+История раундов Краш в памяти процесса.
+
+Для каждой сессии держим кольцевой буфер последних результатов и
+инкрементальную статистику (медиана, распределение по уровням
+MULTIPLIER_TIERS, серии). Буфер пополняется при завершении раунда и
+один раз восстанавливается из CrashGame при первом обращении к сессии,
+поэтому /history и /stats отдаются без запросов к БД.
+"""
+import heapq
+import threading
+from collections import deque
+
+from .crash import MULTIPLIER_TIERS
+from .models import CrashGame, Session
+
+
+# Сколько последних раундов держим в буфере
+HISTORY_SIZE = 50
+# Множитель, начиная с которого раунд считается «высоким» для серий
+HIGH_MULTIPLIER = 2.0
+
+# Корзины распределения — те же диапазоны, что и уровни в create_crash_game
+BUCKETS = [
+    (f'{base:g}-{base + span:g}', base, base + span)
+    for _upper, _lower, _width, base, span in MULTIPLIER_TIERS
+]
+
+
+class RunningMedian:
+    """Медиана потока за O(log n) на вставку (две кучи)"""
+
+    def __init__(self):
+        self._low = []  # max-куча (храним со знаком минус)
+        self._high = []  # min-куча
+
+    def add(self, value):
+        if self._low and value > -self._low[0]:
+            heapq.heappush(self._high, value)
+        else:
+            heapq.heappush(self._low, -value)
+        if len(self._low) > len(self._high) + 1:
+            heapq.heappush(self._high, -heapq.heappop(self._low))
+        elif len(self._high) > len(self._low):
+            heapq.heappush(self._low, -heapq.heappop(self._high))
+
+    @property
+    def value(self):
+        if not self._low:
+            return None
+        if len(self._low) > len(self._high):
+            return -self._low[0]
+        return round((-self._low[0] + self._high[0]) / 2, 2)
+
+
+class SessionCrashStats:
+    """Кольцевой буфер и статистика одной сессии"""
+
+    def __init__(self):
+        self.recent = deque(maxlen=HISTORY_SIZE)
+        self.median = RunningMedian()
+        self.count = 0
+        self.total = 0.0
+        self.max_multiplier = None
+        self.min_multiplier = None
+        self.buckets = [0] * len(BUCKETS)
+        self.streak_kind = None  # 'low' или 'high'
+        self.streak_length = 0
+        self.longest_low_streak = 0
+        self.longest_high_streak = 0
+        self._seen = set()
+
+    def add(self, game_id, multiplier, started_at):
+        if game_id in self._seen:
+            return
+        self._seen.add(game_id)
+        self.recent.append({
+            'game_id': game_id,
+            'multiplier': multiplier,
+            'started_at': started_at.isoformat() if started_at else None,
+        })
+        self.median.add(multiplier)
+        self.count += 1
+        self.total += multiplier
+        self.max_multiplier = multiplier if self.max_multiplier is None else max(self.max_multiplier, multiplier)
+        self.min_multiplier = multiplier if self.min_multiplier is None else min(self.min_multiplier, multiplier)
+
+        # Подкрученные значения могут выйти за диапазон — кладём в крайние корзины
+        bucket_index = len(BUCKETS) - 1
+        for idx, (_label, _low, high) in enumerate(BUCKETS):
+            if multiplier < high:
+                bucket_index = idx
+                break
+        self.buckets[bucket_index] += 1
+
+        kind = 'high' if multiplier >= HIGH_MULTIPLIER else 'low'
+        if kind == self.streak_kind:
+            self.streak_length += 1
+        else:
+            self.streak_kind = kind
+            self.streak_length = 1
+        if kind == 'high':
+            self.longest_high_streak = max(self.longest_high_streak, self.streak_length)
+        else:
+            self.longest_low_streak = max(self.longest_low_streak, self.streak_length)
+
+    def history(self, limit):
+        """Последние limit раундов, новые первыми"""
+        items = list(self.recent)[-limit:] if limit else []
+        items.reverse()
+        return items
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'median': self.median.value,
+            'mean': round(self.total / self.count, 2) if self.count else None,
+            'max': self.max_multiplier,
+            'min': self.min_multiplier,
+            'buckets': [
+                {
+                    'range': label,
+                    'count': count,
+                    'share': round(count / self.count, 4) if self.count else 0,
+                }
+                for (label, _low, _high), count in zip(BUCKETS, self.buckets)
+            ],
+            'streak': {
+                'kind': self.streak_kind,
+                'length': self.streak_length,
+                'high_threshold': HIGH_MULTIPLIER,
+                'longest_low': self.longest_low_streak,
+                'longest_high': self.longest_high_streak,
+            },
+        }
+
+
+class CrashHistoryRegistry:
+    """Статистика по всем сессиям процесса (ключ — код сессии)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def _rebuild(self, session_code):
+        session_id = Session.objects.filter(code=session_code).values_list('id', flat=True).first()
+        if session_id is None:
+            return None
+        stats = SessionCrashStats()
+        games = CrashGame.objects.filter(
+            session_id=session_id, ended_at__isnull=False
+        ).order_by('started_at').values_list('id', 'multiplier', 'started_at')
+        for game_id, multiplier, started_at in games.iterator():
+            stats.add(str(game_id), multiplier, started_at)
+        return stats
+
+    def get(self, session_code):
+        """Статистика сессии или None, если сессии нет"""
+        stats = self._sessions.get(session_code)
+        if stats is None:
+            with self._lock:
+                stats = self._sessions.get(session_code)
+                if stats is None:
+                    stats = self._rebuild(session_code)
+                    if stats is not None:
+                        self._sessions[session_code] = stats
+        return stats
+
+    def record(self, session_code, game):
+        """Вызывается при завершении раунда"""
+        stats = self.get(session_code)
+        if stats is None:
+            return
+        with self._lock:
+            stats.add(str(game.id), game.multiplier, game.started_at)
+
+    def forget(self, session_code):
+        with self._lock:
+            self._sessions.pop(session_code, None)
+
+
+crash_history = CrashHistoryRegistry()
@@ -0,0 +1,121 @@
+"""
+Векторная симуляция экономики Краша (NumPy).
+
+Множители считаются по тем же MULTIPLIER_TIERS, что и multiplier_from_float
+в game/crash.py: hash_to_float даёт равномерное число из сетки k / 16**8,
+поэтому вместо SHA-256 берём равномерные 32-битные целые. Совпадение
+векторного и скалярного отображения проверяет verify_mapping().
+
+Ставка списывается при размещении (record_stake), выплата — как в
+finish_crash_game: если цель ставки не выше множителя раунда, игрок
+получает ставку + int(ставка × цель), иначе ничего. Прирост бонусов
+игрока — выплата минус ставка.
+"""
+from .crash import MAX_MULTIPLIER, MULTIPLIER_TIERS, crash_multiplier, hash_to_float, multiplier_from_float
+
+try:
+    import numpy as np
+except ImportError:  # numpy нужен только симулятору
+    np = None
+
+
+HASH_SPACE = 16 ** 8
+BETTING_SECONDS = 10  # фаза ставок в create_crash_game
+DURATION_RANGE = (20, 40)  # длительность раунда в create_crash_game, секунд
+CHUNK_ROUNDS = 2_000_000  # раундов за один проход (ограничение памяти)
+
+
+def multipliers_from_floats(values):
+    """Векторный multiplier_from_float"""
+    uppers = np.array([tier[0] for tier in MULTIPLIER_TIERS])
+    tier_index = np.minimum(np.searchsorted(uppers, values, side='right'), len(MULTIPLIER_TIERS) - 1)
+    lower, width, base, span = (np.array([tier[i] for tier in MULTIPLIER_TIERS])[tier_index] for i in range(1, 5))
+    return np.minimum(np.round(base + (values - lower) / width * span, 2), MAX_MULTIPLIER)
+
+
+def random_multipliers(rng, size):
+    """Множители size раундов с тем же распределением, что у цепочки сидов"""
+    return multipliers_from_floats(rng.integers(0, HASH_SPACE, size=size) / HASH_SPACE)
+
+
+def verify_mapping(rng, samples=100_000, hashed=1000):
+    """
+    Число расхождений векторного отображения со скалярным: на samples
+    случайных точках сетки и на hashed настоящих SHA-256 сидах.
+    """
+    values = rng.integers(0, HASH_SPACE, size=samples) / HASH_SPACE
+    vectorized = multipliers_from_floats(values)
+    mismatches = sum(1 for v, m in zip(values.tolist(), vectorized.tolist()) if multiplier_from_float(v) != m)
+    seed = rng.bytes(32).hex()
+    floats = np.array([hash_to_float(seed, nonce) for nonce in range(hashed)])
+    exact = [crash_multiplier(seed, nonce) for nonce in range(hashed)]
+    mismatches += sum(1 for a, b in zip(multipliers_from_floats(floats).tolist(), exact) if a != b)
+    return mismatches
+
+
+def payout_ratio(multipliers, targets, stake):
+    """Выплата на единицу ставки: (ставка + int(ставка × цель)) / ставка при выигрыше, иначе 0"""
+    won = targets <= multipliers
+    return np.where(won, (stake + np.floor(stake * targets)) / stake, 0.0)
+
+
+def target_table(rng, rounds, targets, stake):
+    """
+    RTP и разброс для фиксированных целей: для каждой цели —
+    (цель, вероятность выигрыша, RTP, дисперсия выплаты на единицу ставки).
+    """
+    sums = np.zeros((len(targets), 3))  # выигрыши, сумма выплат, сумма квадратов
+    targets = np.asarray(targets, dtype=float)
+    done = 0
+    while done < rounds:
+        size = min(CHUNK_ROUNDS, rounds - done)
+        multipliers = random_multipliers(rng, size)
+        for idx, target in enumerate(targets):
+            ratio = payout_ratio(multipliers, target, stake)
+            sums[idx] += (np.count_nonzero(ratio), ratio.sum(), np.square(ratio).sum())
+        done += size
+    rows = []
+    for idx, target in enumerate(targets):
+        wins, total, squares = sums[idx]
+        rtp = total / rounds
+        rows.append((float(target), wins / rounds, rtp, squares / rounds - rtp ** 2))
+    return rows
+
+
+def simulate_parties(rng, parties, players, hours, bet_probability, stake_range, target_range, round_gap):
+    """
+    Вечеринки целиком: каждый раунд каждый игрок с вероятностью bet_probability
+    ставит случайную сумму из stake_range на цель, лог-равномерную в target_range.
+
+    Возвращает словарь массивов: выплаты на единицу ставки по всем ставкам,
+    по вечеринкам на игрока в час — прирост бонусов (выплаты минус списанные
+    ставки, как на сервере) и сумму выплат без учёта ставок, — и число раундов в час.
+    """
+    mean_cycle = BETTING_SECONDS + sum(DURATION_RANGE) / 2 + round_gap
+    rounds = max(1, int(hours * 3600 / mean_cycle))
+    per_party = rounds * players
+    batch = max(1, CHUNK_ROUNDS // per_party)
+
+    ratios = []
+    gross = np.empty(parties)
+    net = np.empty(parties)
+    log_low, log_high = np.log(target_range[0]), np.log(target_range[1])
+    for start in range(0, parties, batch):
+        size = min(batch, parties - start)
+        multipliers = random_multipliers(rng, (size, rounds, 1))
+        bets = rng.random((size, rounds, players)) < bet_probability
+        stakes = rng.integers(stake_range[0], stake_range[1] + 1, size=(size, rounds, players)) * bets
+        targets = np.round(np.exp(rng.uniform(log_low, log_high, size=(size, rounds, players))), 2)
+        won = targets <= multipliers
+        payouts = np.where(won, stakes + np.floor(stakes * targets), 0)
+        placed = stakes > 0
+        ratios.append(payouts[placed] / stakes[placed])
+        player_hours = players * hours
+        gross[start:start + size] = payouts.sum(axis=(1, 2)) / player_hours
+        net[start:start + size] = (payouts - stakes).sum(axis=(1, 2)) / player_hours
+    return {
+        'ratios': np.concatenate(ratios) if ratios else np.empty(0),
+        'gross_per_player_hour': gross,
+        'net_per_player_hour': net,
+        'rounds_per_hour': rounds / hours,
+    }
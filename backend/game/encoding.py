@@ -0,0 +1,206 @@
+"""
+Кодирование WebSocket-сообщений.
+
+Клиент выбирает формат при подключении — через Sec-WebSocket-Protocol
+(``snowparty.msgpack``, ``snowparty.json.deflate``, ``snowparty.json``)
+или query-параметр ``?encoding=msgpack``. По умолчанию остаётся JSON-текст,
+поэтому старые клиенты продолжают работать без изменений.
+
+- ``json`` — текстовые фреймы, как раньше.
+- ``json.deflate`` — бинарные фреймы, JSON сжат raw-deflate с общим словарём
+  на всё соединение (аналог permessage-deflate с context takeover).
+- ``msgpack`` — бинарные фреймы MessagePack с короткими ключами и UUID
+  в виде 16 байт.
+
+Фронтенд сейчас работает с JSON-текстом; msgpack и deflate — для клиентов,
+которые запросят их сами и будут разворачивать ключи по SHORT_KEYS.
+"""
+import json
+import uuid
+import zlib
+from urllib.parse import parse_qs
+
+try:
+    import msgpack
+except ImportError:  # msgpack опционален, без него доступен только JSON
+    msgpack = None
+
+
+ENCODING_JSON = 'json'
+ENCODING_JSON_DEFLATE = 'json.deflate'
+ENCODING_MSGPACK = 'msgpack'
+
+SUBPROTOCOL_PREFIX = 'snowparty.'
+
+# Короткие ключи для msgpack — часть формата: клиент snowparty.msgpack разворачивает их по этой таблице
+SHORT_KEYS = {
+    'type': 't',
+    'payload': 'p',
+    'session_id': 'sid',
+    'player_id': 'pid',
+    'player': 'pl',
+    'players': 'ps',
+    'leaderboard': 'lb',
+    'id': 'i',
+    'name': 'n',
+    'rank': 'r',
+    'status': 's',
+    'code': 'c',
+    'current_level': 'cl',
+    'total_score': 'ts',
+    'bonus_score': 'bs',
+    'final_score': 'fs',
+    'role': 'ro',
+    'role_buff': 'rb',
+    'last_seen': 'ls',
+    'is_connected': 'ic',
+    'started_at': 'sa',
+    'ended_at': 'ea',
+    'kind': 'k',
+    'data': 'd',
+    'message': 'm',
+    'amount': 'a',
+    'reason': 'rs',
+    'game_id': 'gid',
+    'multiplier': 'mu',
+    'winners': 'w',
+}
+LONG_KEYS = {short: long for long, short in SHORT_KEYS.items()}
+
+# Префикс исходного ключа, совпавшего с коротким (например, 'p' в состоянии блэкджека),
+# чтобы при разворачивании он не превратился в длинный
+KEY_ESCAPE = '~'
+
+# Ключи, значения которых — строковые UUID; в msgpack передаются как bin(16)
+UUID_KEYS = frozenset({'id', 'player_id', 'session_id', 'game_id', 'bet_id', 'selfie_id'})
+
+
+def _pack_value(key, value):
+    if key in UUID_KEYS and isinstance(value, str) and len(value) == 36:
+        try:
+            return uuid.UUID(value).bytes
+        except ValueError:
+            return value
+    return _shorten(value)
+
+
+def _short_key(key):
+    if key in SHORT_KEYS:
+        return SHORT_KEYS[key]
+    if key in LONG_KEYS or (isinstance(key, str) and key.startswith(KEY_ESCAPE)):
+        return KEY_ESCAPE + key
+    return key
+
+
+def _long_key(key):
+    if isinstance(key, str) and key.startswith(KEY_ESCAPE):
+        return key[len(KEY_ESCAPE):]
+    return LONG_KEYS.get(key, key)
+
+
+def _shorten(obj):
+    """Рекурсивно заменяет ключи на короткие и UUID-строки на байты"""
+    if isinstance(obj, dict):
+        return {_short_key(k): _pack_value(k, v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_shorten(v) for v in obj]
+    return obj
+
+
+def _unpack_value(key, value):
+    if key in UUID_KEYS and isinstance(value, bytes) and len(value) == 16:
+        return str(uuid.UUID(bytes=value))
+    return _expand(value)
+
+
+def _expand(obj):
+    """Обратное преобразование для входящих msgpack-сообщений"""
+    if isinstance(obj, dict):
+        result = {}
+        for k, v in obj.items():
+            long_key = _long_key(k)
+            result[long_key] = _unpack_value(long_key, v)
+        return result
+    if isinstance(obj, list):
+        return [_expand(v) for v in obj]
+    return obj
+
+
+class JsonCodec:
+    """JSON-текст (формат по умолчанию)"""
+    name = ENCODING_JSON
+    binary = False
+
+    def encode(self, message):
+        return json.dumps(message)
+
+    def decode(self, text_data=None, bytes_data=None):
+        if text_data is None:
+            text_data = bytes_data.decode('utf-8')
+        return json.loads(text_data)
+
+
+class JsonDeflateCodec:
+    """JSON, сжатый raw-deflate с общим окном на всё соединение"""
+    name = ENCODING_JSON_DEFLATE
+    binary = True
+
+    def __init__(self):
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+
+    def encode(self, message):
+        data = json.dumps(message, separators=(',', ':')).encode('utf-8')
+        # Z_SYNC_FLUSH завершает фрейм, но сохраняет словарь для следующих сообщений
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def decode(self, text_data=None, bytes_data=None):
+        # Входящие сообщения клиента маленькие — допускаем и обычный JSON-текст
+        if text_data is not None:
+            return json.loads(text_data)
+        return json.loads(self._decompressor.decompress(bytes_data))
+
+
+class MsgpackCodec:
+    """MessagePack с короткими ключами"""
+    name = ENCODING_MSGPACK
+    binary = True
+
+    def encode(self, message):
+        return msgpack.packb(_shorten(message), use_bin_type=True)
+
+    def decode(self, text_data=None, bytes_data=None):
+        if text_data is not None:
+            return json.loads(text_data)
+        return _expand(msgpack.unpackb(bytes_data, raw=False))
+
+
+# Исключения decode() на битом фрейме: ValueError покрывает JSON, UnicodeDecodeError и ошибки
+# msgpack текущих версий; zlib.error и UnpackException от ValueError не наследуются
+DECODE_ERRORS = (ValueError, zlib.error) + ((msgpack.UnpackException,) if msgpack is not None else ())
+
+CODECS = {
+    ENCODING_JSON: JsonCodec,
+    ENCODING_JSON_DEFLATE: JsonDeflateCodec,
+}
+if msgpack is not None:
+    CODECS[ENCODING_MSGPACK] = MsgpackCodec
+
+
+def negotiate(scope):
+    """
+    Выбор кодека для соединения.
+
+    Возвращает (codec, subprotocol). subprotocol нужно передать в accept(),
+    если клиент договаривался через Sec-WebSocket-Protocol.
+    """
+    for subprotocol in scope.get('subprotocols') or []:
+        if subprotocol.startswith(SUBPROTOCOL_PREFIX):
+            name = subprotocol[len(SUBPROTOCOL_PREFIX):]
+            if name in CODECS:
+                return CODECS[name](), subprotocol
+
+    query = parse_qs((scope.get('query_string') or b'').decode('latin-1'))
+    name = (query.get('encoding') or [ENCODING_JSON])[0]
+    codec_class = CODECS.get(name, JsonCodec)
+    return codec_class(), None
@@ -0,0 +1,257 @@
+"""
+Журнал игровых событий (append-only) и восстановление состояния по нему.
+
+Все изменения состояния (вход игрока, результаты уровней, бонусы, ставки,
+кэшауты, начисления админа) дописываются в GameEvent. Запись идёт
+пачками: события копятся в памяти и сбрасываются одним bulk_create
+фоновым потоком по размеру пачки или по таймеру, так что таблица
+растёт строго последовательно.
+
+replay_session() проигрывает журнал сессии и строит проекцию: очки,
+уровни и прогресс игроков, исходы раундов Краш. Проекцию можно сравнить
+с текущими моделями или записать в них (manage.py replay_events).
+"""
+import atexit
+import threading
+
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .logs import log_error
+from .models import CrashBet, CrashGame, GameEvent, Player, Progress
+
+
+FLUSH_BATCH_SIZE = 200
+FLUSH_INTERVAL = 0.5  # секунд
+
+# Поля игрока, которые меняет update_player_progress
+PROGRESS_FIELDS = ('current_level', 'current_green_game', 'current_yellow_game', 'current_red_game', 'played_bonus_games')
+
+# Поля проекции, которые сравниваются с моделью и записываются в неё
+PLAYER_FIELDS = ('total_score', 'bonus_score', 'current_level', 'status') + PROGRESS_FIELDS[1:]
+
+
+def _jsonable(value):
+    if isinstance(value, dict):
+        return {k: _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+class EventLog:
+    """Буфер событий с фоновым пакетным сбросом в GameEvent"""
+
+    def __init__(self, batch_size=FLUSH_BATCH_SIZE, interval=FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._buffer = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    def append(self, session_id, kind, player_id=None, **data):
+        event = GameEvent(
+            session_id=session_id,
+            kind=kind,
+            player_id=player_id,
+            data=_jsonable(data),
+            created_at=timezone.now(),
+        )
+        with self._cond:
+            self._buffer.append(event)
+            self._ensure_thread()
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+
+    def flush(self):
+        """Сбросить всё накопленное (вызывается и из фонового потока)"""
+        with self._flush_lock:
+            with self._cond:
+                batch, self._buffer = self._buffer, []
+            if batch:
+                try:
+                    GameEvent.objects.bulk_create(batch, batch_size=self.batch_size)
+                except Exception:
+                    # Вернём пачку в начало буфера, порядок событий сохраняется;
+                    # следующая попытка — через FLUSH_INTERVAL
+                    with self._cond:
+                        self._buffer[:0] = batch
+                    raise
+            return len(batch)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='game-event-log', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait(timeout=self.interval)
+            try:
+                self.flush()
+            except Exception:
+                log_error('flush', 'events.flush_failed')
+            finally:
+                close_old_connections()
+
+
+event_log = EventLog()
+atexit.register(event_log.flush)
+
+
+def log_event(session_id, kind, player_id=None, **data):
+    event_log.append(session_id, kind, player_id=player_id, **data)
+
+
+# Восстановление состояния
+
+def _new_player(data):
+    return {
+        'name': data.get('name'),
+        'role_buff': data.get('role_buff', 0),
+        'total_score': 0,
+        'bonus_score': 0,
+        'current_level': 'none',
+        'status': 'ready',
+        'progress': {},
+        'current_green_game': 0,
+        'current_yellow_game': 0,
+        'current_red_game': 0,
+        'played_bonus_games': [],
+        'deleted': False,
+    }
+
+
+def replay_session(session_id):
+    """Проекция состояния сессии по журналу событий"""
+    players = {}
+    crash_games = {}
+    bets = {}
+    session_status = 'pending'
+
+    def player(pid):
+        return players.setdefault(pid, _new_player({}))
+
+    for event in GameEvent.objects.filter(session_id=session_id).order_by('id').iterator():
+        kind, data = event.kind, event.data
+        pid = str(event.player_id) if event.player_id else None
+
+        if kind == 'player.joined':
+            p = players.setdefault(pid, _new_player(data))
+            p['name'] = data.get('name', p['name'])
+            p['role_buff'] = data.get('role_buff', p['role_buff'])
+            if session_status == 'pending':
+                p['status'] = 'ready'
+        elif kind == 'session.started':
+            session_status = 'active'
+            for p in players.values():
+                p['status'] = 'playing'
+                p['current_level'] = 'green'
+        elif kind == 'session.finished':
+            session_status = 'finished'
+        elif kind == 'progress.submitted':
+            p = player(pid)
+            p['progress'][data['level']] = {
+                'score': data['score'],
+                'time_spent_ms': data.get('time_spent_ms', 0),
+                'details': data.get('details', {}),
+            }
+            p['total_score'] = sum(item['score'] for item in p['progress'].values())
+            p['current_level'] = data.get('current_level', p['current_level'])
+            p['status'] = data.get('status', p['status'])
+        elif kind == 'level.expired':
+            for expired_pid in data.get('players', []):
+                p = player(str(expired_pid))
+                if data.get('next_level'):
+                    p['current_level'] = data['next_level']
+                else:
+                    p['current_level'] = 'red'
+                    p['status'] = 'done'
+        elif kind == 'player.progress_updated':
+            p = player(pid)
+            p.update((field, value) for field, value in data.items() if field in PROGRESS_FIELDS)
+        elif kind in ('bonus.added', 'admin.adjusted', 'crash.cashed_out', 'crash.settled'):
+            player(pid)['bonus_score'] += data.get('amount', 0)
+            if kind in ('crash.cashed_out', 'crash.settled'):
+                bet = bets.setdefault(data['bet_id'], {})
+                bet.update(status=data['status'], win_amount=data.get('win_amount', 0))
+        elif kind == 'crash.bet_placed':
+            # amount — списанная ставка (в старых записях ставка не списывалась)
+            player(pid)['bonus_score'] += data.get('amount', 0)
+            bets[data['bet_id']] = {
+                'game_id': data['game_id'],
+                'player_id': pid,
+                'multiplier': data['multiplier'],
+                'bet_amount': data['bet_amount'],
+                'status': 'pending',
+                'win_amount': 0,
+            }
+        elif kind == 'crash.round_created':
+            crash_games[data['game_id']] = {'multiplier': data['multiplier'], 'nonce': data.get('nonce'), 'finished': False}
+        elif kind == 'crash.round_finished':
+            crash_games.setdefault(data['game_id'], {'multiplier': data.get('multiplier')})['finished'] = True
+        elif kind == 'player.deleted':
+            player(pid)['deleted'] = True
+
+    return {
+        'status': session_status,
+        'players': players,
+        'crash_games': crash_games,
+        'bets': bets,
+    }
+
+
+def diff_projection(session_id, projection):
+    """Расхождения между проекцией и текущими моделями"""
+    diffs = []
+    current = {str(p.id): p for p in Player.objects.filter(session_id=session_id)}
+    for pid, state in projection['players'].items():
+        p = current.get(pid)
+        if state['deleted']:
+            if p:
+                diffs.append((pid, 'deleted', True, False))
+            continue
+        if p is None:
+            diffs.append((pid, 'exists', True, False))
+            continue
+        for field in PLAYER_FIELDS:
+            if getattr(p, field) != state[field]:
+                diffs.append((pid, field, state[field], getattr(p, field)))
+    db_bets = {str(b.id): b for b in CrashBet.objects.filter(crash_game__session_id=session_id)}
+    for bet_id, state in projection['bets'].items():
+        bet = db_bets.get(bet_id)
+        if bet and (bet.status, bet.win_amount) != (state['status'], state['win_amount']):
+            diffs.append((bet_id, 'bet', (state['status'], state['win_amount']), (bet.status, bet.win_amount)))
+    return diffs
+
+
+def apply_projection(session_id, projection):
+    """Записать проекцию в модели (игроки, прогресс, ставки)"""
+    with transaction.atomic():
+        for pid, state in projection['players'].items():
+            if state['deleted']:
+                continue
+            updated = Player.objects.filter(id=pid, session_id=session_id).update(
+                **{field: state[field] for field in PLAYER_FIELDS}
+            )
+            if not updated:
+                continue
+            for level, item in state['progress'].items():
+                Progress.objects.update_or_create(
+                    player_id=pid, level=level,
+                    defaults={
+                        'status': 'completed',
+                        'score': item['score'],
+                        'time_spent_ms': item['time_spent_ms'],
+                        'details': item['details'],
+                    },
+                )
+        for bet_id, state in projection['bets'].items():
+            CrashBet.objects.filter(id=bet_id).update(status=state['status'], win_amount=state['win_amount'])
+        for game_id, state in projection['crash_games'].items():
+            if state.get('finished'):
+                CrashGame.objects.filter(id=game_id, ended_at__isnull=True).update(ended_at=timezone.now())
@@ -0,0 +1,285 @@
+"""
+Idempotency-Key для изменяющих запросов игрока.
+
+Телефон, не дождавшийся ответа, повторяет запрос. Если в запросе есть
+заголовок Idempotency-Key (строка до MAX_KEY_LENGTH символов, обычно UUID),
+повтор с тем же ключом получает сохранённый ответ первого запроса с
+заголовком Idempotent-Replayed: true — вьюха не вызывается, модели,
+состояние сессии и рассылки не трогаются. Без заголовка всё как раньше.
+
+WS-команды с теми же действиями передают ключ полем idempotency_key и
+делят хранилище с REST (consumers.SessionConsumer.perform_action): повтор
+после переподключения получает action.ack с replayed: true.
+
+- Ключ действует в пределах эндпоинта IDEMPOTENCY_TTL секунд.
+  Сохраняются только успешные ответы: ошибку безопасно выполнить заново.
+- Тот же ключ с другим телом запроса — 422. Повтор, пока первый запрос
+  ещё выполняется, — 409 с Retry-After.
+- Ответы держатся в ограниченном LRU-кэше процесса. Чтобы пережить
+  рестарт, они же пачками пишутся в IdempotencyRecord фоновым потоком
+  (как журнал событий); там же удаляются просроченные записи. В таблицу
+  при промахе кэша заглядываем, только пока в ней могут быть ключи, которых
+  нет в кэше: записи прошлого запуска или вытесненные из кэша.
+
+Кэш — свой у каждого процесса: роутер manage.py serve направляет запросы
+сессии (X-Session-Code) в один воркер, так что повтор попадает туда же.
+"""
+import atexit
+import functools
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework import status
+from rest_framework.response import Response
+
+from .logs import log, log_error
+from .models import IdempotencyRecord
+
+
+IDEMPOTENCY_TTL = getattr(settings, 'IDEMPOTENCY_TTL', 24 * 60 * 60)  # секунд
+IDEMPOTENCY_CACHE_SIZE = getattr(settings, 'IDEMPOTENCY_CACHE_SIZE', 10000)
+MAX_KEY_LENGTH = 128
+FLUSH_INTERVAL = 1.0  # секунд между записями в таблицу
+PURGE_INTERVAL = 600  # секунд между удалениями просроченных записей
+IN_FLIGHT_RETRY_AFTER = 1  # секунд
+
+Stored = namedtuple('Stored', 'fingerprint status_code data created_at')
+
+IN_FLIGHT = object()  # первый запрос с этим ключом ещё выполняется
+
+
+def _canonical(value):
+    """Тело запроса в JSON-совместимом виде; файлы — именем и размером"""
+    if hasattr(value, 'lists'):
+        return {key: [_canonical(v) for v in values] for key, values in value.lists()}
+    if isinstance(value, dict):
+        return {str(key): _canonical(v) for key, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if hasattr(value, 'read') and hasattr(value, 'size'):
+        return {'file': getattr(value, 'name', None), 'size': value.size}
+    return value
+
+
+def data_fingerprint(data):
+    data = json.dumps(_canonical(data), sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def request_fingerprint(request):
+    return data_fingerprint(request.data)
+
+
+class IdempotencyStore:
+    """Ответы по (эндпоинт, ключ): LRU-кэш с TTL и фоновая запись в IdempotencyRecord"""
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL, max_entries=IDEMPOTENCY_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._cond = threading.Condition()
+        self._cache = OrderedDict()  # (эндпоинт, ключ) -> Stored
+        self._in_flight = set()
+        self._pending = []  # IdempotencyRecord к записи
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        # До этого момента (unix-время) на промахе кэша смотрим в таблицу; None — ещё не проверяли
+        self._db_until = None
+        self._purged_at = 0.0
+        self.replayed = 0
+        self.rejected = 0
+
+    def begin(self, endpoint, key):
+        """Сохранённый ответ, IN_FLIGHT или None — тогда запрос выполняется и завершается finish/abort"""
+        ident = (endpoint, key)
+        now = time.time()
+        with self._cond:
+            stored = self._cached(ident, now)
+            if stored is None:
+                if ident in self._in_flight:
+                    return IN_FLIGHT
+                self._in_flight.add(ident)
+        if stored is None:
+            # Ключ занят на время чтения таблицы: параллельный повтор получит 409
+            try:
+                stored = self._load(ident, now) if self._needs_db(now) else None
+            except BaseException:
+                self.abort(endpoint, key)
+                raise
+            if stored is not None:
+                with self._cond:
+                    self._in_flight.discard(ident)
+                    self._remember(ident, stored)
+        if stored is not None:
+            with self._cond:
+                self.replayed += 1
+        return stored
+
+    def finish(self, endpoint, key, fingerprint, status_code, data):
+        """Запомнить ответ (только успешный) и снять отметку «выполняется»"""
+        ident = (endpoint, key)
+        with self._cond:
+            self._in_flight.discard(ident)
+            if status_code >= 400:
+                return
+            stored = Stored(fingerprint, status_code, data, time.time())
+            self._remember(ident, stored)
+            self._pending.append(IdempotencyRecord(
+                endpoint=endpoint,
+                key=key,
+                fingerprint=fingerprint,
+                status_code=status_code,
+                response=data,
+                created_at=datetime.fromtimestamp(stored.created_at, dt_timezone.utc),
+            ))
+            self._ensure_thread()
+
+    def abort(self, endpoint, key):
+        with self._cond:
+            self._in_flight.discard((endpoint, key))
+
+    def count_rejected(self):
+        with self._cond:
+            self.rejected += 1
+
+    def stats(self):
+        with self._cond:
+            return {
+                'cached': len(self._cache),
+                'in_flight': len(self._in_flight),
+                'pending_writes': len(self._pending),
+                'replayed': self.replayed,
+                'rejected': self.rejected,
+            }
+
+    def _cached(self, ident, now):
+        stored = self._cache.get(ident)
+        if stored is None:
+            return None
+        if now - stored.created_at > self.ttl:
+            del self._cache[ident]
+            return None
+        self._cache.move_to_end(ident)
+        return stored
+
+    def _remember(self, ident, stored):
+        self._cache[ident] = stored
+        self._cache.move_to_end(ident)
+        while len(self._cache) > self.max_entries:
+            _, evicted = self._cache.popitem(last=False)
+            # Вытесненный ключ теперь есть только в таблице
+            self._db_until = max(self._db_until or 0, evicted.created_at + self.ttl)
+
+    def _needs_db(self, now):
+        if self._db_until is None:
+            newest = IdempotencyRecord.objects.order_by('-created_at').values_list('created_at', flat=True).first()
+            with self._cond:
+                if self._db_until is None:
+                    self._db_until = newest.timestamp() + self.ttl if newest else 0
+        return now < self._db_until
+
+    def _load(self, ident, now):
+        endpoint, key = ident
+        record = IdempotencyRecord.objects.filter(
+            endpoint=endpoint,
+            key=key,
+            created_at__gte=datetime.fromtimestamp(now - self.ttl, dt_timezone.utc),
+        ).first()
+        if record is None:
+            return None
+        return Stored(record.fingerprint, record.status_code, record.response, record.created_at.timestamp())
+
+    def flush(self):
+        """Записать накопленные ответы в таблицу (вызывается и из фонового потока)"""
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, []
+            if batch:
+                IdempotencyRecord.objects.bulk_create(batch, ignore_conflicts=True)
+            now = time.time()
+            if now - self._purged_at >= PURGE_INTERVAL:
+                self._purged_at = now
+                IdempotencyRecord.objects.filter(
+                    created_at__lt=datetime.fromtimestamp(now, dt_timezone.utc) - timedelta(seconds=self.ttl)
+                ).delete()
+            return len(batch)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='idempotency-store', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception:
+                log_error('flush', 'idempotency.flush_failed')
+            finally:
+                close_old_connections()
+
+
+idempotency_store = IdempotencyStore()
+atexit.register(idempotency_store.flush)
+
+
+def replay(endpoint, key, fingerprint):
+    """
+    Проверка ключа перед выполнением запроса.
+
+    None — запрос выполняется и завершается idempotency_store.finish/abort.
+    Иначе готовый ответ (статус, тело, replayed): сохранённый ответ первого
+    запроса или ошибка — длинный ключ, ключ занят, ключ от другого тела.
+    """
+    if len(key) > MAX_KEY_LENGTH:
+        return status.HTTP_400_BAD_REQUEST, {'error': f'Idempotency-Key длиннее {MAX_KEY_LENGTH} символов'}, False
+    stored = idempotency_store.begin(endpoint, key)
+    if stored is None:
+        return None
+    if stored is IN_FLIGHT:
+        idempotency_store.count_rejected()
+        return status.HTTP_409_CONFLICT, {'error': 'Запрос с этим Idempotency-Key ещё выполняется'}, False
+    if stored.fingerprint != fingerprint:
+        idempotency_store.count_rejected()
+        return (
+            status.HTTP_422_UNPROCESSABLE_ENTITY,
+            {'error': 'Idempotency-Key уже использован для другого запроса'},
+            False,
+        )
+    log('idempotency', 'idempotent.replayed', endpoint=endpoint)
+    return stored.status_code, stored.data, True
+
+
+def idempotent(endpoint):
+    """Декоратор вьюхи: повтор с тем же Idempotency-Key получает сохранённый ответ"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key = request.headers.get('Idempotency-Key')
+            if not key:
+                return view(request, *args, **kwargs)
+            fingerprint = request_fingerprint(request)
+            outcome = replay(endpoint, key, fingerprint)
+            if outcome is not None:
+                status_code, data, replayed = outcome
+                response = Response(data, status=status_code)
+                if replayed:
+                    response['Idempotent-Replayed'] = 'true'
+                elif status_code == status.HTTP_409_CONFLICT:
+                    response['Retry-After'] = str(IN_FLIGHT_RETRY_AFTER)
+                return response
+            try:
+                response = view(request, *args, **kwargs)
+            except BaseException:
+                idempotency_store.abort(endpoint, key)
+                raise
+            idempotency_store.finish(endpoint, key, fingerprint, response.status_code, getattr(response, 'data', None))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,148 @@
+"""
+Структурное логирование горячих путей без блокировки цикла событий.
+
+Логгеры game.* пишут в QueueHandler: запись только кладётся в очередь
+процесса, а форматирование (включая чтение исходников для трейсбека) и
+вывод в stderr делает QueueListener в своём потоке. Очередь ограничена:
+при переполнении запись отбрасывается и учитывается в dropped(), а не
+останавливает вызвавший поток.
+
+Одна запись — одна JSON-строка: время, уровень, категория, код сессии,
+игрок, событие и поля. Частые категории (подключения, рассылки, загрузки, повторы)
+пишутся с выборкой LOG_SAMPLING — доля событий, попавших в лог, указана в
+поле sampled. Предупреждения и ошибки пишутся всегда.
+
+Если для логгера game в LOGGING уже заданы обработчики, configure() их
+не трогает.
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from django.conf import settings
+
+
+LOGGER_NAME = 'game'
+LOG_LEVEL = getattr(settings, 'GAME_LOG_LEVEL', 'INFO')
+LOG_QUEUE_SIZE = getattr(settings, 'GAME_LOG_QUEUE_SIZE', 10000)
+# Категория -> доля событий уровня INFO и ниже, попадающих в лог (нет в словаре — все)
+LOG_SAMPLING = getattr(settings, 'LOG_SAMPLING', {
+    'connect': 0.1,
+    'disconnect': 0.1,
+    'broadcast': 0.01,
+    'upload': 1.0,
+    'idempotency': 0.1,
+})
+
+RECORD_TAGS = ('category', 'session', 'player')
+
+
+class StructuredFormatter(logging.Formatter):
+    """Запись лога одной JSON-строкой"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'event': record.getMessage(),
+        }
+        for tag in RECORD_TAGS:
+            value = getattr(record, tag, None)
+            if value is not None:
+                entry[tag] = value
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class GameQueueHandler(QueueHandler):
+    """QueueHandler, который не блокирует и не форматирует в вызывающем потоке"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Очередь в памяти процесса: exc_info можно отдать слушателю как есть,
+        # трейсбек отформатируется в его потоке (стандартный prepare делает это здесь)
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler = None
+_listener = None
+_configure_lock = threading.Lock()
+
+
+def configure(stream=None):
+    """Подключить очередь и слушателя к логгеру game (повторный вызов меняет поток вывода)"""
+    global _handler, _listener
+    with _configure_lock:
+        logger = logging.getLogger(LOGGER_NAME)
+        if _handler is None and logger.handlers:
+            return
+        _stop()
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(StructuredFormatter())
+        _handler = GameQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        _listener = QueueListener(_handler.queue, output, respect_handler_level=True)
+        logger.addHandler(_handler)
+        logger.setLevel(LOG_LEVEL)
+        logger.propagate = False
+        _listener.start()
+
+
+def shutdown():
+    """Дописать очередь и отключить слушателя"""
+    with _configure_lock:
+        _stop()
+
+
+def _stop():
+    global _handler, _listener
+    if _listener is not None:
+        _listener.stop()
+    if _handler is not None:
+        logging.getLogger(LOGGER_NAME).removeHandler(_handler)
+    _handler = _listener = None
+
+
+def dropped():
+    """Сколько записей отброшено из-за переполненной очереди"""
+    return _handler.dropped if _handler is not None else 0
+
+
+def log(category, event, session=None, player=None, level=logging.INFO, exc_info=False, **fields):
+    """Событие категории game.<category> с тегами сессии и игрока"""
+    logger = logging.getLogger(f'{LOGGER_NAME}.{category}')
+    if not logger.isEnabledFor(level):
+        return
+    extra = {'category': category, 'session': session, 'player': str(player) if player is not None else None}
+    if level < logging.WARNING:
+        rate = LOG_SAMPLING.get(category, 1.0)
+        if rate < 1.0:
+            if random.random() >= rate:
+                return
+            fields['sampled'] = rate
+    extra['fields'] = fields
+    logger.log(level, event, exc_info=exc_info, extra=extra)
+
+
+def log_error(category, event, session=None, player=None, **fields):
+    """Ошибка с трейсбеком текущего исключения"""
+    log(category, event, session=session, player=player, level=logging.ERROR, exc_info=True, **fields)
+
+
+atexit.register(shutdown)
@@ -0,0 +1,69 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game.archive import (
+    DEFAULT_CHUNK_SIZE,
+    default_archive_dir,
+    delete_session_rows,
+    export_session,
+    finished_sessions,
+    purge_expired_admin_tokens,
+    vacuum,
+)
+from game.models import Session
+
+
+class Command(BaseCommand):
+    help = 'Выгрузить завершённые сессии в .ndjson.gz и удалить их строки из базы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--session', type=str, help='Код конкретной сессии (должна быть завершена)')
+        parser.add_argument('--older-than-days', type=int, default=1,
+                            help='Архивировать сессии, завершённые раньше N дней назад (по умолчанию 1)')
+        parser.add_argument('--output-dir', type=str, help='Папка для архивов (по умолчанию BASE_DIR/archives)')
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Размер пачки при выгрузке и удалении')
+        parser.add_argument('--keep-rows', action='store_true', help='Только выгрузить, ничего не удалять')
+        parser.add_argument('--no-vacuum', action='store_true', help='Не выполнять VACUUM после удаления')
+        parser.add_argument('--every', type=int, help='Работать фоном: повторять каждые N секунд')
+
+    def handle(self, *args, **options):
+        if options['every']:
+            self.stdout.write(f'Архивация каждые {options["every"]} с (Ctrl+C для остановки)')
+            while True:
+                self.run_once(options)
+                time.sleep(options['every'])
+        self.run_once(options)
+
+    def run_once(self, options):
+        if options['session']:
+            try:
+                sessions = [Session.objects.get(code=options['session'])]
+            except Session.DoesNotExist:
+                raise CommandError(f'Сессия {options["session"]} не найдена')
+            if sessions[0].status != 'finished':
+                raise CommandError(f'Сессия {options["session"]} ещё не завершена')
+        else:
+            sessions = list(finished_sessions(options['older_than_days']))
+
+        archive_dir = options['output_dir'] or default_archive_dir()
+        chunk_size = options['chunk_size']
+        deleted_any = False
+        for session in sessions:
+            path, counts = export_session(session, archive_dir, chunk_size=chunk_size)
+            total = sum(counts.values())
+            self.stdout.write(self.style.SUCCESS(f'{session.code}: {total} строк -> {path}'))
+            if not options['keep_rows']:
+                delete_session_rows(session, chunk_size=chunk_size)
+                deleted_any = True
+
+        tokens = 0 if options['keep_rows'] else purge_expired_admin_tokens(chunk_size=chunk_size)
+        if tokens:
+            self.stdout.write(f'Удалено просроченных админ-токенов: {tokens}')
+            deleted_any = True
+
+        if deleted_any and not options['no_vacuum']:
+            vacuum()
+            self.stdout.write('VACUUM выполнен')
+        if not sessions:
+            self.stdout.write('Нет сессий для архивации')
@@ -0,0 +1,65 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from game.models import Player, Session
+from game.serializers import PlayerSerializer, SessionSerializer, player_data, session_data
+
+
+def build_objects():
+    """Несохранённые сессия и игрок — сериализация без обращений к базе"""
+    now = timezone.now()
+    session = Session(
+        id=uuid.uuid4(), code='BENCH1', status='active', created_at=now, started_at=now,
+        level_duration_seconds=300, min_players=2, auto_start=True,
+    )
+    player = Player(
+        id=uuid.uuid4(), session=session, name='Снеговик 7', device_uuid=uuid.uuid4(), token='t' * 43,
+        status='playing', current_level='yellow', total_score=137, bonus_score=420, role='VIP', role_buff=200,
+        created_at=now, current_green_game=3, current_yellow_game=1, played_bonus_games=['slots', 'crash'],
+    )
+    return session, player
+
+
+class Command(BaseCommand):
+    help = 'Сравнить DRF ModelSerializer и быстрые сериализаторы (время на 1000 сериализаций)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=10000, help='Количество сериализаций на вариант')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        session, player = build_objects()
+        cases = [
+            (
+                'Player',
+                lambda: PlayerSerializer(player).data,
+                lambda: player_data(player),
+            ),
+            (
+                'Session',
+                lambda: SessionSerializer(session, context={'players_count': 12}).data,
+                lambda: session_data(session, 12),
+            ),
+        ]
+
+        self.stdout.write(f'{iterations} сериализаций на вариант')
+        self.stdout.write(f'{"модель":<10}{"DRF, мс/1000":>16}{"быстрый, мс/1000":>20}{"ускорение":>12}')
+        for name, drf, fast in cases:
+            # Быстрый вариант обязан выдавать ровно то же, что DRF
+            if dict(drf()) != fast():
+                raise CommandError(f'{name}: вывод отличается от DRF:\n{dict(drf())}\n{fast()}')
+            drf_time = self._measure(drf, iterations)
+            fast_time = self._measure(fast, iterations)
+            self.stdout.write(
+                f'{name:<10}{drf_time * 1000:>16.2f}{fast_time * 1000:>20.2f}{drf_time / fast_time:>11.1f}x'
+            )
+
+    def _measure(self, func, iterations):
+        """Секунд на 1000 вызовов"""
+        started = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        return (time.perf_counter() - started) / iterations * 1000
@@ -0,0 +1,81 @@
+import random
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from game.encoding import CODECS, ENCODING_MSGPACK
+
+
+def build_leaderboard_message(players_count):
+    """Реалистичный leaderboard.update — такой же, как шлёт broadcast_leaderboard_update"""
+    rnd = random.Random(42)
+    names = ['Снегурочка', 'Дед Мороз', 'Олень Рудольф', 'Ёлочка', 'Снеговик', 'Гном', 'Эльф', 'Vip Маша']
+    levels = ['green', 'yellow', 'red']
+    rows = []
+    for idx in range(players_count):
+        total_score = rnd.randint(0, 300)
+        bonus_score = rnd.randint(0, 2000)
+        role_buff = rnd.choice([0, 0, 0, 200, 500])
+        rows.append({
+            'rank': idx + 1,
+            'player_id': str(uuid.uuid4()),
+            'name': f'{rnd.choice(names)} {idx}',
+            'total_score': total_score,
+            'bonus_score': bonus_score,
+            'role': 'VIP' if role_buff == 200 else None,
+            'role_buff': role_buff,
+            'final_score': total_score + bonus_score + role_buff,
+            'current_level': rnd.choice(levels),
+            'status': 'playing',
+        })
+    return {
+        'type': 'leaderboard.update',
+        'payload': {
+            'session_id': str(uuid.uuid4()),
+            'generated_at': timezone.now().isoformat(),
+            'leaderboard': rows,
+        }
+    }
+
+
+class Command(BaseCommand):
+    help = 'Сравнить размер фреймов и время кодирования WebSocket-форматов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=100, help='Количество игроков в лидерборде')
+        parser.add_argument('--iterations', type=int, default=1000, help='Количество кодирований на формат')
+
+    def handle(self, *args, **options):
+        players = options['players']
+        iterations = options['iterations']
+        message = build_leaderboard_message(players)
+
+        self.stdout.write(f'leaderboard.update, {players} игроков, {iterations} итераций')
+        self.stdout.write(f'{"формат":<16}{"первый фрейм, Б":>18}{"повторный, Б":>16}{"мкс/кодирование":>18}')
+
+        baseline = None
+        for name, codec_class in CODECS.items():
+            codec = codec_class()
+            first = codec.encode(message)
+            # Для deflate повторный кадр показывает выигрыш от общего словаря соединения
+            repeat = codec.encode(message)
+
+            codec = codec_class()
+            started = time.perf_counter()
+            for _ in range(iterations):
+                codec.encode(message)
+            elapsed_us = (time.perf_counter() - started) / iterations * 1_000_000
+
+            first_size = len(first.encode('utf-8') if isinstance(first, str) else first)
+            repeat_size = len(repeat.encode('utf-8') if isinstance(repeat, str) else repeat)
+            if baseline is None:
+                baseline = first_size
+            ratio = first_size / baseline * 100
+            self.stdout.write(
+                f'{name:<16}{first_size:>12} ({ratio:3.0f}%){repeat_size:>16}{elapsed_us:>18.1f}'
+            )
+
+        if ENCODING_MSGPACK not in CODECS:
+            self.stdout.write(self.style.WARNING('msgpack не установлен — формат msgpack пропущен'))
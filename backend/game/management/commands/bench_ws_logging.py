@@ -0,0 +1,134 @@
+import asyncio
+import io
+import logging
+import secrets
+import statistics
+import string
+import time
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+
+from game import logs
+from game.models import Session
+from game.routing import websocket_urlpatterns
+from game.state import state_engine
+
+
+MODES = ('off', 'sync', 'queue')
+
+
+class SlowSink(io.TextIOBase):
+    """Вывод с задержкой на каждую запись — как медленный терминал или заполненный пайп"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.lines = 0
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        time.sleep(self.delay)
+        self.lines += text.count('\n')
+        return len(text)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Шторм WebSocket-подключений при разных режимах логирования: выключено, синхронный вывод '
+        '(как print) и очередь с фоновым потоком (game/logs.py). Временная сессия удаляется после проверки.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=200, help='Одновременных подключений')
+        parser.add_argument('--rounds', type=int, default=3, help='Штормов на режим')
+        parser.add_argument('--sink-delay-ms', type=float, default=1.0, help='Задержка вывода на одну строку')
+        parser.add_argument('--sampling', action='store_true',
+                            help='С выборкой LOG_SAMPLING (по умолчанию пишется каждое событие)')
+
+    def handle(self, *args, **options):
+        code = ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(6))
+        session = Session.objects.create(code=code, min_players=1)
+        sampling = dict(logs.LOG_SAMPLING)
+        if not options['sampling']:
+            logs.LOG_SAMPLING.clear()
+        app = URLRouter(websocket_urlpatterns)
+        try:
+            state_engine.get(code)
+            self.stdout.write(
+                f'{options["clients"]} подключений × {options["rounds"]}, вывод {options["sink_delay_ms"]} мс/строка, '
+                f'{"с выборкой" if options["sampling"] else "все события"}'
+            )
+            self.stdout.write(
+                f'{"режим":<8}{"p50, мс":>10}{"p95, мс":>10}{"макс, мс":>10}{"задержка цикла, мс":>21}{"строк":>8}'
+            )
+            for mode in MODES:
+                sink = SlowSink(options['sink_delay_ms'] / 1000)
+                self._set_mode(mode, sink)
+                latencies, lags = [], []
+                for _ in range(options['rounds']):
+                    round_latencies, lag = asyncio.run(self._storm(app, code, options['clients']))
+                    latencies += round_latencies
+                    lags.append(lag)
+                # Очередь дописывается до подсчёта строк
+                self._set_mode('off', sink)
+                self.stdout.write(
+                    f'{mode:<8}{percentile(latencies, 0.5) * 1000:>10.1f}{percentile(latencies, 0.95) * 1000:>10.1f}'
+                    f'{max(latencies) * 1000:>10.1f}{max(lags) * 1000:>21.1f}{sink.lines:>8}'
+                )
+        finally:
+            logs.LOG_SAMPLING.update(sampling)
+            self._set_mode('queue', None)
+            state_engine.evict(code)
+            session.delete()
+
+    def _set_mode(self, mode, sink):
+        logs.shutdown()
+        logger = logging.getLogger(logs.LOGGER_NAME)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        logger.setLevel(logs.LOG_LEVEL)
+        if mode == 'off':
+            logger.setLevel(logging.CRITICAL + 1)
+        elif mode == 'sync':
+            handler = logging.StreamHandler(sink)
+            handler.setFormatter(logs.StructuredFormatter())
+            logger.addHandler(handler)
+        else:
+            logs.configure(sink)
+
+    async def _storm(self, app, code, clients):
+        """(время подключения до начального снимка по каждому клиенту, макс. задержка цикла событий)"""
+        stop = asyncio.Event()
+        lag = 0.0
+
+        async def watch_loop():
+            nonlocal lag
+            while not stop.is_set():
+                started = time.perf_counter()
+                await asyncio.sleep(0.001)
+                lag = max(lag, time.perf_counter() - started - 0.001)
+
+        async def connect():
+            started = time.perf_counter()
+            communicator = WebsocketCommunicator(app, f'/ws/session/{code}/')
+            connected, _ = await communicator.connect(timeout=30)
+            if connected:
+                # session.state, players.list, leaderboard.update
+                for _ in range(3):
+                    await communicator.receive_from(timeout=30)
+            return communicator, time.perf_counter() - started
+
+        watcher = asyncio.create_task(watch_loop())
+        results = await asyncio.gather(*(connect() for _ in range(clients)))
+        stop.set()
+        await watcher
+        await asyncio.gather(*(communicator.disconnect() for communicator, _ in results))
+        return [elapsed for _, elapsed in results], lag
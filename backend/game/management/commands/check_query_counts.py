@@ -0,0 +1,9 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Проверить число SQL-запросов на горячих путях (game.tests.QueryCountTests на тестовой базе)'
+
+    def handle(self, *args, **options):
+        call_command('test', 'game.tests.QueryCountTests', verbosity=options['verbosity'])
@@ -0,0 +1,12 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Проверить планы запросов горячих путей по EXPLAIN QUERY PLAN '
+        '(game.tests.QueryPlanTests на тестовой базе)'
+    )
+
+    def handle(self, *args, **options):
+        call_command('test', 'game.tests.QueryPlanTests', verbosity=options['verbosity'])
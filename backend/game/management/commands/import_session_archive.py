@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from game.archive import import_archive
+
+
+class Command(BaseCommand):
+    help = 'Восстановить сессию из архива .ndjson.gz (для просмотра)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', type=str, help='Путь к архиву')
+        parser.add_argument('--replace', action='store_true', help='Заменить сессию с тем же кодом, если она есть')
+
+    def handle(self, *args, **options):
+        try:
+            code, counts = import_archive(options['path'], replace=options['replace'])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        total = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS(f'Восстановлена сессия {code}: {total} строк'))
+        for label, count in sorted(counts.items()):
+            self.stdout.write(f'  {label}: {count}')
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from game.events import apply_projection, diff_projection, event_log, replay_session
+from game.models import GameEvent, Session
+
+
+class Command(BaseCommand):
+    help = 'Восстановить состояние сессии по журналу событий и сравнить с базой'
+
+    def add_arguments(self, parser):
+        parser.add_argument('code', type=str, help='Код сессии')
+        parser.add_argument('--apply', action='store_true', help='Записать восстановленное состояние в базу')
+
+    def handle(self, *args, **options):
+        session = Session.objects.filter(code=options['code']).first()
+        if session is None:
+            raise CommandError(f"Сессия {options['code']} не найдена")
+
+        event_log.flush()
+        events = GameEvent.objects.filter(session=session).count()
+        projection = replay_session(session.id)
+        self.stdout.write(
+            f"{session.code}: {events} событий, {len(projection['players'])} игроков, "
+            f"{len(projection['crash_games'])} раундов Краш, {len(projection['bets'])} ставок"
+        )
+
+        diffs = diff_projection(session.id, projection)
+        for obj_id, field, expected, actual in diffs:
+            self.stdout.write(f'  {obj_id} {field}: журнал={expected!r} база={actual!r}')
+        if not diffs:
+            self.stdout.write(self.style.SUCCESS('Состояние совпадает с журналом'))
+            return
+
+        if options['apply']:
+            apply_projection(session.id, projection)
+            self.stdout.write(self.style.SUCCESS(f'Исправлено расхождений: {len(diffs)}'))
+        else:
+            self.stdout.write(self.style.WARNING(f'Расхождений: {len(diffs)} (--apply чтобы исправить)'))
@@ -0,0 +1,37 @@
+import asyncio
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from game.serving import serve
+
+
+class Command(BaseCommand):
+    help = 'Запустить N ASGI-воркеров за роутером с привязкой сессии к воркеру (SIGHUP — плавный перезапуск)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Число воркеров daphne')
+        parser.add_argument('--host', type=str, default='0.0.0.0', help='Адрес роутера')
+        parser.add_argument('--port', type=int, default=8000, help='Порт роутера')
+        parser.add_argument('--worker-base-port', type=int, default=8100,
+                            help='Порт первого воркера, остальные — следующие (слушают 127.0.0.1)')
+        parser.add_argument('--drain-timeout', type=float, default=10,
+                            help='Сколько секунд ждать текущие соединения при перезапуске и остановке')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers должно быть не меньше 1')
+        module, _, attr = settings.ASGI_APPLICATION.rpartition('.')
+        try:
+            asyncio.run(serve(
+                host=options['host'],
+                port=options['port'],
+                workers=options['workers'],
+                worker_base_port=options['worker_base_port'],
+                application=f'{module}:{attr}',
+                drain_timeout=options['drain_timeout'],
+                log=self.stdout.write,
+            ))
+        except RuntimeError as e:
+            raise CommandError(str(e))
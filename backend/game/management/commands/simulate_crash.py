@@ -0,0 +1,72 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from game import crash_sim
+
+
+def parse_range(value, cast):
+    low, _, high = value.partition('-')
+    return cast(low), cast(high or low)
+
+
+class Command(BaseCommand):
+    help = 'Симуляция экономики Краша: RTP, разброс и перцентили выплат, прирост бонусов за час вечеринки (NumPy)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=5_000_000, help='Раундов для таблицы по целям')
+        parser.add_argument('--targets', type=str, default='1.1,1.5,2,3,5,10,20,50',
+                            help='Цели ставок для таблицы RTP через запятую')
+        parser.add_argument('--stake', type=int, default=100, help='Ставка для таблицы RTP (влияет округление int)')
+        parser.add_argument('--parties', type=int, default=2000, help='Вечеринок для симуляции')
+        parser.add_argument('--players', type=int, default=20, help='Игроков на вечеринке')
+        parser.add_argument('--hours', type=float, default=3, help='Длительность вечеринки, часов')
+        parser.add_argument('--bet-probability', type=float, default=0.6, help='Вероятность ставки игрока в раунде')
+        parser.add_argument('--stakes', type=str, default='10-200', help='Диапазон ставок, например 10-200')
+        parser.add_argument('--target-range', type=str, default='1.1-10', help='Диапазон целей (лог-равномерно)')
+        parser.add_argument('--round-gap', type=float, default=10, help='Пауза между раундами, секунд')
+        parser.add_argument('--seed', type=int, help='Сид генератора для воспроизводимости')
+
+    def handle(self, *args, **options):
+        if crash_sim.np is None:
+            raise CommandError('Для симуляции нужен numpy: pip install numpy')
+        np = crash_sim.np
+        rng = np.random.default_rng(options['seed'])
+        started = time.perf_counter()
+
+        mismatches = crash_sim.verify_mapping(rng)
+        if mismatches:
+            raise CommandError(f'Векторное отображение hash -> множитель расходится с crash.py: {mismatches}')
+
+        targets = [float(t) for t in options['targets'].split(',') if t.strip()]
+        rows = crash_sim.target_table(rng, options['rounds'], targets, options['stake'])
+        self.stdout.write(f'Фиксированная цель, {options["rounds"]:,} раундов, ставка {options["stake"]}')
+        self.stdout.write(f'{"цель":>8}{"P(выигрыш)":>13}{"RTP":>9}{"дисперсия":>12}')
+        for target, win_rate, rtp, variance in rows:
+            self.stdout.write(f'{target:>8.2f}{win_rate:>13.4f}{rtp:>9.3f}{variance:>12.3f}')
+
+        stake_range = parse_range(options['stakes'], int)
+        target_range = parse_range(options['target_range'], float)
+        result = crash_sim.simulate_parties(
+            rng, options['parties'], options['players'], options['hours'], options['bet_probability'],
+            stake_range, target_range, options['round_gap'],
+        )
+        ratios = result['ratios']
+        self.stdout.write('')
+        self.stdout.write(
+            f'Вечеринки: {options["parties"]} × {options["players"]} игроков × {options["hours"]} ч, '
+            f'{result["rounds_per_hour"]:.0f} раундов/ч, ставок: {len(ratios):,}'
+        )
+        if len(ratios):
+            p50, p90, p99 = np.percentile(ratios, [50, 90, 99])
+            self.stdout.write(
+                f'выплата/ставка: RTP {ratios.mean():.3f}, дисперсия {ratios.var():.3f}, '
+                f'p50 {p50:.2f}, p90 {p90:.2f}, p99 {p99:.2f}, max {ratios.max():.2f}'
+            )
+        for label, values in (
+            ('прирост бонусов на игрока в час (выплаты минус ставки)', result['net_per_player_hour']),
+            ('выплаты на игрока в час (без учёта списанных ставок)', result['gross_per_player_hour']),
+        ):
+            p10, p50, p90 = np.percentile(values, [10, 50, 90])
+            self.stdout.write(f'{label}: среднее {values.mean():.0f}, p10 {p10:.0f}, p50 {p50:.0f}, p90 {p90:.0f}')
+        self.stdout.write(f'Время: {time.perf_counter() - started:.1f} с')
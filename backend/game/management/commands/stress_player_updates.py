@@ -0,0 +1,107 @@
+import secrets
+import string
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from game import views
+from game.events import event_log
+from game.models import Player, Session
+from game.state import state_engine
+
+
+def sql_bytes(queries):
+    return sum(len(query['sql'].encode()) for query in queries)
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочная проверка compare-and-set по версии игрока: параллельные обновления '
+            'одного игрока без потерь (временная сессия удаляется после проверки)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Параллельных «телефонов»')
+        parser.add_argument('--updates', type=int, default=25, help='Обновлений на поток')
+        parser.add_argument('--latency-ms', type=float, default=2, help='Задержка между чтением и отправкой')
+        parser.add_argument('--no-version', action='store_true',
+                            help='Не присылать version — показать потерянные обновления')
+
+    def handle(self, *args, **options):
+        code = ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(6))
+        session = Session.objects.create(code=code, min_players=1, status='active')
+        player = Player.objects.create(
+            session=session, name='Стресс', device_uuid=uuid.uuid4(), token=secrets.token_urlsafe(32),
+            status='playing', current_level='green',
+        )
+        try:
+            self._run(code, player.token, options)
+        finally:
+            state_engine.evict(code)
+            event_log.flush()
+            session.delete()
+
+    def _run(self, code, token, options):
+        threads_count, updates = options['threads'], options['updates']
+        use_version = not options['no_version']
+        latency = options['latency_ms'] / 1000
+        state, player = state_engine.by_token(token)
+        conflicts = [0] * threads_count
+        errors = []
+
+        def worker(idx):
+            try:
+                for n in range(updates):
+                    # Список сыгранных игр клиент присылает целиком: прочитал — дополнил — отправил
+                    while True:
+                        with state.lock:
+                            version = player.version
+                            played = list(player.played_bonus_games)
+                        time.sleep(latency)  # сеть и рендер на телефоне
+                        data = {'player_token': token, 'played_bonus_games': played + [f'{idx}-{n}']}
+                        if use_version:
+                            data['version'] = version
+                        try:
+                            views.perform_update_player_progress(data)
+                        except views.ActionError as e:
+                            if e.status_code != 409:
+                                raise
+                            conflicts[idx] += 1
+                            continue
+                        break
+                    # Очки мини-игры — приращение на сервере, версия не нужна
+                    views.perform_submit_progress({'token': token, 'level': 'bonus', 'score': 1, 'is_minigame': True})
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(idx,)) for idx in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise CommandError(f'Ошибка в потоке: {errors[0]!r}')
+
+        expected = {f'{idx}-{n}' for idx in range(threads_count) for n in range(updates)}
+        lost = expected - set(player.played_bonus_games)
+        self.stdout.write(f'{threads_count} потоков × {updates} обновлений, version: {"да" if use_version else "нет"}')
+        self.stdout.write(f'конфликтов (409, повторено): {sum(conflicts)}')
+        self.stdout.write(f'bonus_score: {player.bonus_score} из {len(expected)}, версия: {player.version}')
+        style = self.style.SUCCESS if not lost else self.style.ERROR
+        self.stdout.write(style(f'потеряно элементов played_bonus_games: {len(lost)} из {len(expected)}'))
+
+        # Объём записи на одно обновление: полный save() против частичного сброса изменённых полей
+        state.flush()
+        with CaptureQueriesContext(connection) as full:
+            Player.objects.get(id=player.id).save()
+        views.perform_update_player_progress({'player_token': token, 'current_green_game': 2})
+        with CaptureQueriesContext(connection) as partial:
+            state.flush()
+        self.stdout.write(
+            f'SQL на обновление: save() — {sql_bytes(full.captured_queries[-1:])} Б, '
+            f'сброс изменённых полей — {sql_bytes(partial.captured_queries)} Б'
+        )
+        if use_version and (lost or player.bonus_score != len(expected)):
+            raise CommandError('Потеряны обновления при compare-and-set')
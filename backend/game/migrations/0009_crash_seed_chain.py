@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:53
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0008_player_current_green_game_player_current_red_game_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CrashSeedChain',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('root_seed', models.CharField(max_length=64)),
+                ('head_hash', models.CharField(max_length=64)),
+                ('length', models.IntegerField()),
+                ('next_index', models.IntegerField(default=0)),
+                ('nonce_start', models.IntegerField(default=1)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='crash_chains', to='game.session')),
+            ],
+            options={
+                'ordering': ['session', 'nonce_start'],
+            },
+        ),
+        migrations.AddField(
+            model_name='crashgame',
+            name='chain',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='games', to='game.crashseedchain'),
+        ),
+    ]
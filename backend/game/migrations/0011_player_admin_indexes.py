@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:56
+
+import django.db.models.expressions
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0010_ledger_balance_after'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(fields=['created_at', 'id'], name='player_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(fields=['last_seen', 'id'], name='player_last_seen_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('total_score'), '+', models.F('bonus_score')), '+', models.F('role_buff')), models.F('id'), name='player_final_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(fields=['session', 'created_at'], name='player_session_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(fields=['is_connected', 'last_seen'], name='player_active_idx'),
+        ),
+    ]
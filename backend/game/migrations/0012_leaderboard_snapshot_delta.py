@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0011_player_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leaderboardsnapshot',
+            name='is_keyframe',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddIndex(
+            model_name='leaderboardsnapshot',
+            index=models.Index(fields=['session', 'created_at'], name='snapshot_session_time_idx'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-19 19:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game', '0014_player_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='crashbet',
+            name='player',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='crash_bets', to='game.player'),
+        ),
+        migrations.AlterField(
+            model_name='crashgame',
+            name='session',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='crash_games', to='game.session'),
+        ),
+        migrations.AlterField(
+            model_name='pointstransaction',
+            name='player',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='game.player'),
+        ),
+        migrations.AlterField(
+            model_name='rigoverride',
+            name='session',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='rig_overrides', to='game.session'),
+        ),
+        migrations.AddIndex(
+            model_name='crashbet',
+            index=models.Index(fields=['player', 'created_at', 'id'], name='crash_bet_player_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='crashgame',
+            index=models.Index(fields=['session', 'ended_at', 'started_at'], name='crash_game_session_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(fields=['session', 'status'], name='player_session_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pointstransaction',
+            index=models.Index(fields=['player', 'created_at'], name='ledger_player_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rigoverride',
+            index=models.Index(condition=models.Q(('consumed', False)), fields=['session', 'created_at'], name='rig_session_pending_idx'),
+        ),
+    ]
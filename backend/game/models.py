@@ -1,4 +1,6 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import F, Q
 import uuid
 import json
 
@@ -70,10 +72,21 @@ class Player(models.Model):
     current_yellow_game = models.IntegerField(default=0)  # Текущая игра в желтом уровне (1-3)
     current_red_game = models.IntegerField(default=0)    # Текущая игра в красном уровне (1-3)
     played_bonus_games = models.JSONField(default=list, blank=True)  # Список пройденных бонусных игр
+    # Растёт при каждом изменении игрового состояния; клиент может прислать её для compare-and-set
+    version = models.PositiveIntegerField(default=0)
     
     class Meta:
         ordering = ['-total_score', '-bonus_score', 'created_at']
         unique_together = [['session', 'device_uuid']]
+        indexes = [
+            # Сортировки и фильтры списка игроков в админке (keyset по (поле, id))
+            models.Index(fields=['created_at', 'id'], name='player_created_idx'),
+            models.Index(fields=['last_seen', 'id'], name='player_last_seen_idx'),
+            models.Index(F('total_score') + F('bonus_score') + F('role_buff'), 'id', name='player_final_score_idx'),
+            models.Index(fields=['session', 'created_at'], name='player_session_created_idx'),
+            models.Index(fields=['is_connected', 'last_seen'], name='player_active_idx'),
+            models.Index(fields=['session', 'status'], name='player_session_status_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} ({self.session.code})"
@@ -136,10 +149,17 @@ class Selfie(models.Model):
     session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='selfies')
     task = models.CharField(max_length=200)  # Задание для селфи
     image = models.ImageField(upload_to=selfie_upload_path)  # Сохраняем в api/upload с datetime-name-id
+    content_hash = models.CharField(max_length=64, blank=True, default='')  # sha256 файла; пусто у старых селфи
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ['-created_at']
+        constraints = [
+            # Повторная загрузка того же файла игроком возвращает существующее селфи
+            models.UniqueConstraint(
+                fields=['player', 'content_hash'], condition=~Q(content_hash=''), name='selfie_player_hash_uniq',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.player.name} - {self.task}"
@@ -149,17 +169,21 @@ class LeaderboardSnapshot(models.Model):
     """Снимок лидерборда (для истории и отладки)"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='snapshots')
-    payload = models.JSONField()  # Список игроков с местами и очками
+    payload = models.JSONField()  # Полный список игроков (keyframe) или только изменения (delta)
+    is_keyframe = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['session', 'created_at'], name='snapshot_session_time_idx'),
+        ]
 
 
 class CrashGame(models.Model):
     """Игра Краш - история раундов"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='crash_games')
+    session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='crash_games', db_index=False)
     multiplier = models.FloatField()  # Множитель на котором упал (например, 2.5)
     started_at = models.DateTimeField(auto_now_add=True)
     ended_at = models.DateTimeField(null=True, blank=True)
@@ -172,14 +196,37 @@ class CrashGame(models.Model):
     server_seed = models.CharField(max_length=64, null=True, blank=True)  # Серверный seed (скрытый)
     server_seed_hash = models.CharField(max_length=64, null=True, blank=True)  # Хэш серверного seed (показывается игрокам)
     nonce = models.IntegerField(default=0)  # Счетчик для уникальности
+    chain = models.ForeignKey('CrashSeedChain', on_delete=models.SET_NULL, null=True, blank=True, related_name='games')  # Цепочка, из которой взят seed
     
     class Meta:
         ordering = ['-started_at']
+        indexes = [
+            # Текущий раунд (ended_at IS NULL) и история завершённых по времени
+            models.Index(fields=['session', 'ended_at', 'started_at'], name='crash_game_session_state_idx'),
+        ]
     
     def __str__(self):
         return f"Crash {self.session.code} - {self.multiplier}x"
 
 
+class CrashSeedChain(models.Model):
+    """Цепочка хэшей Provably Fair (пакет заранее сгенерированных seed'ов)"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='crash_chains')
+    root_seed = models.CharField(max_length=64)  # Секретный конец цепочки, из него выводятся все seed'ы
+    head_hash = models.CharField(max_length=64)  # sha256 первого seed'а (публикуется заранее)
+    length = models.IntegerField()
+    next_index = models.IntegerField(default=0)  # Следующий неиспользованный seed
+    nonce_start = models.IntegerField(default=1)  # Nonce первого раунда цепочки
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['session', 'nonce_start']
+    
+    def __str__(self):
+        return f"Chain {self.session.code} #{self.nonce_start} ({self.next_index}/{self.length})"
+
+
 class CrashBet(models.Model):
     """Ставка игрока в игре Краш"""
     STATUS_CHOICES = [
@@ -191,7 +238,7 @@ class CrashBet(models.Model):
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     crash_game = models.ForeignKey(CrashGame, on_delete=models.CASCADE, related_name='bets')
-    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='crash_bets')
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='crash_bets', db_index=False)
     multiplier = models.FloatField(null=True, blank=True)  # Авто-вывод на множитель (опционально)
     bet_amount = models.IntegerField(default=0)  # Сколько поставил (в баллах)
     win_amount = models.IntegerField(default=0)  # Сколько выиграл
@@ -203,6 +250,9 @@ class CrashBet(models.Model):
     class Meta:
         ordering = ['-created_at']
         unique_together = [['crash_game', 'player']]  # Один игрок - одна ставка на раунд
+        indexes = [
+            models.Index(fields=['player', 'created_at', 'id'], name='crash_bet_player_time_idx'),
+        ]
     
     def __str__(self):
         return f"{self.player.name} - {self.status}"
@@ -235,16 +285,21 @@ class AdminToken(models.Model):
 class PointsTransaction(models.Model):
     """История изменений баланса игрока (начисления/списания)"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='transactions')
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, related_name='transactions', db_index=False)
     session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='transactions')
     amount = models.IntegerField()  # + начисление, - списание
     reason = models.TextField(blank=True, null=True)
     is_hidden = models.BooleanField(default=False)  # Не показывать игроку
     created_at = models.DateTimeField(auto_now_add=True)
     admin = models.ForeignKey(AdminUser, on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions')
+    crash_bet = models.ForeignKey(CrashBet, on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions')  # Расчёт ставки Краш
+    balance_after = models.IntegerField(null=True, blank=True)  # Баланс (final_score) после операции
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['player', 'created_at'], name='ledger_player_time_idx'),
+        ]
 
     def __str__(self):
         sign = "+" if self.amount >= 0 else "-"
@@ -254,7 +309,7 @@ class PointsTransaction(models.Model):
 class RigOverride(models.Model):
     """Подкрутка результата (для ближайшей крутки/раунда)"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='rig_overrides')
+    session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='rig_overrides', db_index=False)
     player = models.ForeignKey(Player, on_delete=models.CASCADE, null=True, blank=True, related_name='rig_overrides')
     value = models.FloatField()  # Какое значение должно выпасть (например, множитель или число)
     rig_type = models.CharField(max_length=20, default='multiplier', choices=[
@@ -269,6 +324,10 @@ class RigOverride(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Только неиспользованные подкрутки (consumed=False даёт в SQL «NOT consumed», как равенство не ищется)
+            models.Index(fields=['session', 'created_at'], name='rig_session_pending_idx', condition=Q(consumed=False)),
+        ]
 
     def __str__(self):
         target = self.player.name if self.player else "any"
@@ -278,3 +337,42 @@ class RigOverride(models.Model):
         else:
             return f"Multiplier rig {self.value}x for {self.session.code} ({target})"
 
+
+
+class GameEvent(models.Model):
+    """Журнал игровых событий (только дописывается, id растёт последовательно)"""
+    session = models.ForeignKey(Session, on_delete=models.CASCADE, related_name='events')
+    player_id = models.UUIDField(null=True, blank=True)  # Без FK: событие переживает удаление игрока
+    kind = models.CharField(max_length=40)  # player.joined, progress.submitted, crash.bet_placed, ...
+    data = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['session', 'id'], name='event_session_seq_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.kind} ({self.session_id})"
+
+
+class IdempotencyRecord(models.Model):
+    """Сохранённый ответ изменяющего запроса по Idempotency-Key (game/idempotency.py)"""
+    endpoint = models.CharField(max_length=40)  # submit_progress, place_crash_bet, ...
+    key = models.CharField(max_length=128)
+    fingerprint = models.CharField(max_length=64)  # sha256 тела запроса
+    status_code = models.PositiveSmallIntegerField()
+    response = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['endpoint', 'key'], name='idempotency_endpoint_key_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='idempotency_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.endpoint} {self.key} ({self.status_code})"
@@ -0,0 +1,72 @@
+"""
+Keyset-пагинация (курсор вместо OFFSET).
+
+Курсор — base64 от JSON-списка значений ключа сортировки последней строки
+страницы и её id. Следующая страница начинается строго после этой строки,
+поэтому запрос идёт по индексу и не зависит от номера страницы.
+"""
+import base64
+import json
+import uuid
+from datetime import datetime
+
+from django.db.models import F, Q
+
+
+def encode_cursor(*values):
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Список значений курсора или ValueError для битого курсора"""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    if not isinstance(values, list):
+        raise ValueError('cursor must be a list')
+    return values
+
+
+def keyset_q(field, value, pk, descending=True):
+    """
+    Условие «строго после (value, pk)» для сортировки по (field, id).
+
+    NULL-значения field идут в конце страницы в обоих направлениях.
+    """
+    op = 'lt' if descending else 'gt'
+    if value is None:
+        return Q(**{f'{field}__isnull': True, f'id__{op}': pk})
+    return (
+        Q(**{f'{field}__{op}': value})
+        | Q(**{field: value, f'id__{op}': pk})
+        | Q(**{f'{field}__isnull': True})
+    )
+
+
+def paginate(queryset, field, cursor=None, limit=50, descending=True, parse=None):
+    """
+    Страница queryset по (field, id).
+
+    parse — преобразование значения из курсора (например, datetime.fromisoformat).
+    Возвращает (rows, next_cursor).
+    """
+    if cursor:
+        value, pk = decode_cursor(cursor)
+        try:
+            pk = uuid.UUID(str(pk))
+            if value is not None and parse:
+                value = parse(value)
+        except TypeError as e:
+            raise ValueError(str(e))
+        queryset = queryset.filter(keyset_q(field, value, pk, descending))
+
+    order_field = F(field).desc(nulls_last=True) if descending else F(field).asc(nulls_last=True)
+    id_order = '-id' if descending else 'id'
+    rows = list(queryset.order_by(order_field, id_order)[:limit + 1])
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, field), str(last.id))
+    return rows, next_cursor
@@ -3,13 +3,18 @@ from .models import Session, Player, Progress
 
 
 class SessionSerializer(serializers.ModelSerializer):
-    players_count = serializers.IntegerField(source='players.count', read_only=True)
+    players_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Session
         fields = ['id', 'code', 'status', 'created_at', 'started_at', 'ended_at',
                   'level_duration_seconds', 'min_players', 'auto_start', 'players_count']
 
+    def get_players_count(self, obj):
+        # Число игроков можно передать в context, чтобы не делать запрос
+        count = self.context.get('players_count')
+        return obj.players.count() if count is None else count
+
 
 class PlayerSerializer(serializers.ModelSerializer):
     final_score = serializers.IntegerField(read_only=True)
@@ -18,7 +23,7 @@ class PlayerSerializer(serializers.ModelSerializer):
         model = Player
         fields = ['id', 'name', 'device_uuid', 'token', 'status', 'current_level',
                   'total_score', 'bonus_score', 'final_score', 'role', 'role_buff', 'created_at',
-                  'current_green_game', 'current_yellow_game', 'current_red_game', 'played_bonus_games']
+                  'current_green_game', 'current_yellow_game', 'current_red_game', 'played_bonus_games', 'version']
 
 
 class ProgressSerializer(serializers.ModelSerializer):
@@ -28,3 +33,88 @@ class ProgressSerializer(serializers.ModelSerializer):
                   'details', 'completed_at', 'created_at']
 
 
+
+# Быстрые сериализаторы для горячих ответов и WebSocket-рассылок.
+# Поля перечислены явно и выдают то же, что ModelSerializer выше, но без
+# построения полей DRF на каждый вызов (см. manage.py bench_serializers).
+
+def format_datetime(value):
+    """Дата как в DRF DateTimeField: ISO 8601, UTC с суффиксом Z"""
+    if value is None:
+        return None
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def session_data(session, players_count):
+    """То же, что SessionSerializer; число игроков передаётся явно"""
+    return {
+        'id': str(session.id),
+        'code': session.code,
+        'status': session.status,
+        'created_at': format_datetime(session.created_at),
+        'started_at': format_datetime(session.started_at),
+        'ended_at': format_datetime(session.ended_at),
+        'level_duration_seconds': session.level_duration_seconds,
+        'min_players': session.min_players,
+        'auto_start': session.auto_start,
+        'players_count': players_count,
+    }
+
+
+def player_data(player):
+    """То же, что PlayerSerializer (ответ игроку, включая токен)"""
+    return {
+        'id': str(player.id),
+        'name': player.name,
+        'device_uuid': str(player.device_uuid),
+        'token': player.token,
+        'status': player.status,
+        'current_level': player.current_level,
+        'total_score': player.total_score,
+        'bonus_score': player.bonus_score,
+        'final_score': player.total_score + player.bonus_score + player.role_buff,
+        'role': player.role,
+        'role_buff': player.role_buff,
+        'created_at': format_datetime(player.created_at),
+        'current_green_game': player.current_green_game,
+        'current_yellow_game': player.current_yellow_game,
+        'current_red_game': player.current_red_game,
+        'played_bonus_games': player.played_bonus_games,
+        'version': player.version,
+    }
+
+
+def player_public_data(player):
+    """Игрок в списках и рассылках сессии (players.list, player.update)"""
+    return {
+        'id': str(player.id),
+        'name': player.name,
+        'status': player.status,
+        'current_level': player.current_level,
+        'total_score': player.total_score,
+        'bonus_score': player.bonus_score,
+        'role': player.role,
+        'role_buff': player.role_buff,
+        'final_score': player.total_score + player.bonus_score + player.role_buff,
+        'last_seen': player.last_seen.isoformat() if player.last_seen else None,
+        'is_connected': player.is_connected,
+    }
+
+
+def leaderboard_row(rank, player):
+    """Строка leaderboard.update"""
+    return {
+        'rank': rank,
+        'player_id': str(player.id),
+        'name': player.name,
+        'total_score': player.total_score,
+        'bonus_score': player.bonus_score,
+        'role': player.role,
+        'role_buff': player.role_buff,
+        'final_score': player.total_score + player.bonus_score + player.role_buff,
+        'current_level': player.current_level,
+        'status': player.status,
+    }
@@ -0,0 +1,286 @@
+"""
+Несколько ASGI-воркеров (daphne) за маленьким фронт-роутером.
+
+Состояние сессии живёт в памяти процесса (game/state.py), поэтому весь
+трафик одной вечеринки должен попадать в один воркер. Роутер читает
+заголовок HTTP-запроса и выбирает воркер по коду сессии:
+
+- путь /ws/session/<code>/, /api/session/<code>/..., /api/crash/<code>/...;
+- заголовок X-Session-Code (его шлёт фронтенд для запросов по токену);
+- параметр ?session=<code>.
+
+Воркер выбирается по crc32(code) % N — одинаково после перезапуска.
+Запросы без кода сессии распределяются по кругу. Воркер знает свой номер
+(WORKER_ENV), и изменяющие вьюхи по чужой сессии отвечают 421
+(owns_session) — иначе изменение ушло бы в чужое состояние в памяти и
+мимо сокетов сессии. Админка поэтому тоже шлёт X-Session-Code.
+
+В воркере клиентский адрес — последний элемент X-Forwarded-For: его
+дописывает роутер, остальное прислал клиент (forwarded_client_ip). Обычные HTTP-запросы
+идут с Connection: close, чтобы keep-alive соединение не унесло запрос
+другой сессии в чужой воркер; WebSocket пробрасывается как есть.
+
+SIGHUP — плавный перезапуск воркеров по одному: новые соединения к
+воркеру ждут, текущие дорабатывают до drain_timeout (оставшиеся WS
+закрываются — клиент переподключается), воркер останавливается со
+сбросом состояния в базу и запускается заново.
+"""
+import asyncio
+import itertools
+import os
+import re
+import signal
+import subprocess
+import sys
+import zlib
+from urllib.parse import parse_qs, urlsplit
+
+
+SESSION_PATH_RE = re.compile(r'^/(?:ws/session|api/session|api/crash)/([A-Z0-9]+)(?:/|$)')
+MAX_HEAD_SIZE = 64 * 1024
+CHUNK_SIZE = 64 * 1024
+START_TIMEOUT = 30  # секунд на запуск воркера
+HOP_BY_HOP = {b'connection', b'keep-alive', b'proxy-connection'}
+WORKER_ENV = 'SNOWPARTY_WORKER'  # "<номер>/<всего>" в окружении воркера
+
+
+def worker_index(code, workers):
+    """Номер воркера сессии"""
+    return zlib.crc32(code.encode()) % workers
+
+
+def current_worker():
+    """(номер, всего) этого процесса под роутером или None"""
+    value = os.environ.get(WORKER_ENV)
+    if not value:
+        return None
+    index, _, count = value.partition('/')
+    return int(index), int(count)
+
+
+def owns_session(code):
+    """Обслуживает ли этот процесс сессию (без роутера — любую)"""
+    worker = current_worker()
+    return worker is None or worker_index(code.upper(), worker[1]) == worker[0]
+
+
+def forwarded_client_ip(forwarded_for):
+    """Адрес клиента из X-Forwarded-For, выставленного роутером: последний элемент"""
+    return forwarded_for.split(',')[-1].strip()
+
+
+def session_code(target, headers):
+    """Код сессии из пути, заголовка X-Session-Code или ?session=; иначе None"""
+    parts = urlsplit(target)
+    match = SESSION_PATH_RE.match(parts.path)
+    if match:
+        return match.group(1)
+    code = headers.get(b'x-session-code', b'').decode('latin-1').strip().upper()
+    if code:
+        return code
+    values = parse_qs(parts.query).get('session')
+    return values[0].upper() if values else None
+
+
+def parse_head(head):
+    """(метод, цель, [(имя, значение)], {имя в нижнем регистре: значение})"""
+    lines = head.split(b'\r\n')
+    method, target, _ = lines[0].split(b' ', 2)
+    raw_headers = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, _, value = line.partition(b':')
+        raw_headers.append((name.strip(), value.strip()))
+    headers = {name.lower(): value for name, value in raw_headers}
+    return method, target.decode('latin-1'), raw_headers, headers
+
+
+def build_head(method, target, raw_headers, client_ip, upgrade):
+    """Заголовок для воркера: X-Forwarded-For и, для HTTP, Connection: close"""
+    lines = [b'%s %s HTTP/1.1' % (method, target.encode('latin-1'))]
+    forwarded = client_ip.encode()
+    for name, value in raw_headers:
+        lower = name.lower()
+        if lower == b'x-forwarded-for':
+            forwarded = value + b', ' + forwarded
+            continue
+        if not upgrade and lower in HOP_BY_HOP:
+            continue
+        lines.append(name + b': ' + value)
+    lines.append(b'X-Forwarded-For: ' + forwarded)
+    if not upgrade:
+        lines.append(b'Connection: close')
+    return b'\r\n'.join(lines) + b'\r\n\r\n'
+
+
+class Worker:
+    """Процесс daphne на своём порту"""
+
+    def __init__(self, index, host, port, application, count=1):
+        self.index = index
+        self.count = count
+        self.host = host
+        self.port = port
+        self.application = application
+        self.process = None
+        self.ready = asyncio.Event()  # снят — новые соединения ждут (перезапуск)
+        self.connections = set()  # задачи активных соединений
+        self.restarting = False
+
+    async def start(self):
+        self.process = subprocess.Popen([
+            sys.executable, '-m', 'daphne', '-b', self.host, '-p', str(self.port), self.application,
+        ], env={**os.environ, WORKER_ENV: f'{self.index}/{self.count}'})
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + START_TIMEOUT
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'Воркер {self.index} завершился при запуске (код {self.process.returncode})')
+            try:
+                _, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError:
+                if loop.time() > deadline:
+                    raise RuntimeError(f'Воркер {self.index} не открыл порт {self.port} за {START_TIMEOUT} с')
+                await asyncio.sleep(0.1)
+                continue
+            writer.close()
+            break
+        self.ready.set()
+
+    async def stop(self, drain_timeout):
+        """Не пускать новые соединения, дождаться текущих, остановить процесс"""
+        self.ready.clear()
+        if self.connections:
+            await asyncio.wait(list(self.connections), timeout=drain_timeout)
+        for task in list(self.connections):
+            task.cancel()
+        if self.process and self.process.poll() is None:
+            # SIGTERM: daphne завершается штатно, atexit сбрасывает состояние сессий в базу
+            self.process.terminate()
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.process.wait, drain_timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+    async def restart(self, drain_timeout):
+        self.restarting = True
+        try:
+            await self.stop(drain_timeout)
+            await self.start()
+        finally:
+            self.restarting = False
+
+
+class Router:
+    """Фронт-роутер: соединение клиента -> воркер сессии"""
+
+    def __init__(self, workers, drain_timeout=10, log=print):
+        self.workers = workers
+        self.drain_timeout = drain_timeout
+        self.log = log
+        self._round_robin = itertools.cycle(range(len(workers)))
+        self._reloading = None
+
+    def pick(self, code):
+        if code:
+            return self.workers[worker_index(code, len(self.workers))]
+        return self.workers[next(self._round_robin)]
+
+    async def handle(self, reader, writer):
+        task = asyncio.current_task()
+        worker = None
+        upstream_writer = None
+        try:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                return
+            try:
+                method, target, raw_headers, headers = parse_head(head[:-4])
+            except ValueError:
+                writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                return
+            upgrade = headers.get(b'upgrade', b'').lower() == b'websocket'
+            worker = self.pick(session_code(target, headers))
+            await worker.ready.wait()
+            worker.connections.add(task)
+            peer = writer.get_extra_info('peername')
+            client_ip = peer[0] if peer else ''
+            try:
+                upstream_reader, upstream_writer = await asyncio.open_connection(worker.host, worker.port)
+            except OSError:
+                writer.write(b'HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                return
+            upstream_writer.write(build_head(method, target, raw_headers, client_ip, upgrade))
+            to_upstream = asyncio.ensure_future(self._pipe(reader, upstream_writer))
+            try:
+                # Соединение живёт, пока воркер отвечает; клиент может закрыть свою половину раньше
+                await self._pipe(upstream_reader, writer)
+            finally:
+                to_upstream.cancel()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if worker is not None:
+                worker.connections.discard(task)
+            for w in (upstream_writer, writer):
+                if w is not None:
+                    w.close()
+
+    async def _pipe(self, reader, writer):
+        try:
+            while True:
+                data = await reader.read(CHUNK_SIZE)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+            if writer.can_write_eof():
+                writer.write_eof()
+        except (ConnectionError, OSError):
+            writer.close()
+
+    async def reload(self):
+        """Плавно перезапустить воркеры по одному"""
+        if self._reloading and not self._reloading.done():
+            return
+        self._reloading = asyncio.current_task()
+        for worker in self.workers:
+            self.log(f'Перезапуск воркера {worker.index} (порт {worker.port})')
+            await worker.restart(self.drain_timeout)
+        self.log('Воркеры перезапущены')
+
+    async def supervise(self):
+        """Поднять упавший воркер"""
+        while True:
+            await asyncio.sleep(1)
+            for worker in self.workers:
+                if worker.restarting or worker.process is None or worker.process.poll() is None:
+                    continue
+                self.log(f'Воркер {worker.index} завершился с кодом {worker.process.returncode}, перезапуск')
+                await worker.restart(self.drain_timeout)
+
+
+async def serve(host, port, workers, worker_base_port, application, drain_timeout, log=print):
+    pool = [Worker(idx, '127.0.0.1', worker_base_port + idx, application, workers) for idx in range(workers)]
+    router = Router(pool, drain_timeout=drain_timeout, log=log)
+    await asyncio.gather(*(worker.start() for worker in pool))
+    server = await asyncio.start_server(router.handle, host, port, limit=MAX_HEAD_SIZE)
+    log(f'Роутер слушает {host}:{port}, воркеров: {workers} (порты {worker_base_port}-{worker_base_port + workers - 1})')
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGHUP, lambda: loop.create_task(router.reload()))
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    supervisor = loop.create_task(router.supervise())
+    try:
+        await stop.wait()
+    finally:
+        log('Остановка: ждём текущие соединения')
+        supervisor.cancel()
+        server.close()
+        await asyncio.gather(*(worker.stop(drain_timeout) for worker in pool))
@@ -0,0 +1,158 @@
+"""
+Запись истории лидерборда (LeaderboardSnapshot) для «повтора гонки».
+
+Снимки пишутся из broadcast_leaderboard_update — лидерборд там уже посчитан,
+поэтому запись не делает лишних запросов, кроме самого INSERT. Пишем не
+чаще SNAPSHOT_INTERVAL секунд, а при переходах уровней, старте и финише —
+сразу. Обычный снимок хранит только изменившихся игроков (delta),
+полный (keyframe) — раз в KEYFRAME_EVERY снимков.
+"""
+import threading
+import time
+from datetime import datetime
+
+from .models import LeaderboardSnapshot
+
+
+SNAPSHOT_INTERVAL = 10  # секунд между плановыми снимками
+KEYFRAME_EVERY = 30  # каждый N-й снимок — полный
+
+# Поля игрока, которые хранятся в снимке
+SNAPSHOT_FIELDS = ('name', 'total_score', 'bonus_score', 'role_buff', 'final_score', 'current_level', 'status')
+
+
+def _entry(row):
+    return {field: row.get(field) for field in SNAPSHOT_FIELDS}
+
+
+class _SessionRecorder:
+    __slots__ = ('state', 'last_written', 'since_keyframe')
+
+    def __init__(self):
+        self.state = {}  # player_id -> entry, как записано в последнем снимке
+        self.last_written = 0.0
+        self.since_keyframe = None
+
+
+class SnapshotRecorder:
+    """Пишет снимки лидерборда с дельта-кодированием"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def observe(self, session_id, leaderboard, reason=None):
+        """
+        Новое состояние лидерборда сессии.
+
+        reason (например 'level', 'started', 'finished') форсирует запись
+        независимо от интервала.
+        """
+        now = time.monotonic()
+        with self._lock:
+            rec = self._sessions.get(session_id)
+            if rec is None:
+                rec = self._sessions[session_id] = _SessionRecorder()
+            if reason is None and now - rec.last_written < SNAPSHOT_INTERVAL:
+                return None
+
+            current = {row['player_id']: _entry(row) for row in leaderboard}
+            keyframe = rec.since_keyframe is None or rec.since_keyframe + 1 >= KEYFRAME_EVERY
+            if keyframe:
+                payload = {
+                    'kind': 'key',
+                    'players': [dict(player_id=row['player_id'], **current[row['player_id']]) for row in leaderboard],
+                }
+            else:
+                changed = [
+                    dict(player_id=pid, **entry)
+                    for pid, entry in current.items()
+                    if rec.state.get(pid) != entry
+                ]
+                removed = [pid for pid in rec.state if pid not in current]
+                if not changed and not removed and reason is None:
+                    return None
+                payload = {'kind': 'delta', 'changed': changed, 'removed': removed}
+            if reason:
+                payload['reason'] = reason
+
+            rec.state = current
+            rec.last_written = now
+            rec.since_keyframe = 0 if keyframe else rec.since_keyframe + 1
+
+        return LeaderboardSnapshot.objects.create(session_id=session_id, is_keyframe=keyframe, payload=payload)
+
+    def forget(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+snapshot_recorder = SnapshotRecorder()
+
+
+def _ranking(state, order):
+    """Лидерборд из состояния — та же сортировка, что в broadcast_leaderboard_update"""
+    position = {pid: idx for idx, pid in enumerate(order)}
+    players = sorted(
+        state.items(),
+        key=lambda item: (-(item[1]['final_score'] or 0), -(item[1]['total_score'] or 0), position.get(item[0], 0)),
+    )
+    return [dict(rank=idx + 1, player_id=pid, **entry) for idx, (pid, entry) in enumerate(players)]
+
+
+def _apply(state, order, payload):
+    if isinstance(payload, list) or payload.get('kind') == 'key':
+        state.clear()
+        for row in payload if isinstance(payload, list) else payload['players']:
+            pid = row['player_id']
+            state[pid] = _entry(row)
+            if pid not in order:
+                order.append(pid)
+    else:
+        for row in payload.get('changed', []):
+            pid = row['player_id']
+            state[pid] = _entry(row)
+            if pid not in order:
+                order.append(pid)
+        for pid in payload.get('removed', []):
+            state.pop(pid, None)
+
+
+def replay(session, at=None):
+    """
+    Кадры лидерборда сессии.
+
+    Без at — все кадры по порядку (для анимации). С at — один кадр:
+    рейтинг на момент at (от ближайшего полного снимка, с дельтами после него).
+    """
+    qs = LeaderboardSnapshot.objects.filter(session=session)
+    if at is not None:
+        keyframe = qs.filter(is_keyframe=True, created_at__lte=at).order_by('-created_at').first()
+        if keyframe is None:
+            return []
+        # Ничьи внутри кадра разбиваются порядком игроков в полном снимке
+        qs = qs.filter(created_at__gte=keyframe.created_at, created_at__lte=at)
+
+    state, order, frames = {}, [], []
+    snapshot = None
+    for snapshot in qs.order_by('created_at').iterator():
+        _apply(state, order, snapshot.payload)
+        if at is None:
+            frames.append(_frame(snapshot, state, order))
+    if at is not None and snapshot is not None:
+        frames.append(_frame(snapshot, state, order))
+    return frames
+
+
+def _frame(snapshot, state, order):
+    payload = snapshot.payload
+    return {
+        'at': snapshot.created_at.isoformat(),
+        'reason': payload.get('reason') if isinstance(payload, dict) else None,
+        'leaderboard': _ranking(state, order),
+    }
+
+
+def parse_time(value):
+    """ISO-время из query-параметра (ValueError для неверного формата)"""
+    return datetime.fromisoformat(value.replace(' ', '+').replace('Z', '+00:00'))
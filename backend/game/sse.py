@@ -0,0 +1,224 @@
+"""
+Server-Sent Events: запасной канал обновлений сессии без WebSocket.
+
+GET /api/session/<code>/events отдаёт те же сообщения, что SessionConsumer
+шлёт по сокету, — по одному JSON {"type", "payload"} в поле data.
+
+Группу сессии в процессе слушает один SessionStream, сколько бы ни было
+SSE-клиентов: он нумерует сообщения, держит последние BUFFER_SIZE в буфере
+и раздаёт их очередям клиентов. id события — "<эпоха потока>-<номер>".
+Клиент, переподключившийся с Last-Event-ID, получает пропущенное из
+буфера; если продолжить нельзя (сервер перезапущен, сообщения вытеснены
+из буфера или это первое подключение) — начальный снимок, как при
+подключении сокета: session.state, players.list, leaderboard.update.
+
+Потоки живут в цикле событий сервера и трогаются только из него, поэтому
+без блокировок; поток без клиентов закрывается через LINGER_SECONDS.
+"""
+import asyncio
+import json
+import time
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+
+from .serializers import player_public_data
+from .state import state_engine
+
+
+BUFFER_SIZE = 512  # сообщений для продолжения по Last-Event-ID
+CLIENT_QUEUE_SIZE = 256  # клиент, отставший сильнее, отключается и переподключается
+HEARTBEAT_INTERVAL = 15  # секунд между комментариями-пингами (прокси не рвут тихое соединение)
+LINGER_SECONDS = 60  # поток без клиентов живёт столько, чтобы переподключение продолжило буфер
+RETRY_MS = 3000  # пауза перед переподключением EventSource
+
+# Групповое сообщение -> (тип сообщения клиенту, kind для game.event) — как обработчики SessionConsumer
+GROUP_MESSAGES = {
+    'session_state': ('session.state', None),
+    'players_list': ('players.list', None),
+    'player_update': ('player.update', None),
+    'player_balance_update': ('player.balance_update', None),
+    'player_balance_bulk_update': ('player.balance_bulk_update', None),
+    'leaderboard_update': ('leaderboard.update', None),
+    'game_event': ('game.event', None),
+    'timer_tick': ('timer.tick', None),
+    'crash_game_finished': ('game.event', 'crash.finished'),
+    'selfie_uploaded': ('game.event', 'selfie.uploaded'),
+    'blackjack_ready': ('blackjack.ready', None),
+    'blackjack_start': ('game.event', 'blackjack.start'),
+    'blackjack_action': ('game.event', 'blackjack.action'),
+}
+
+
+def client_message(event):
+    """Сообщение клиенту по групповому сообщению или None для незнакомого типа"""
+    mapping = GROUP_MESSAGES.get(event.get('type'))
+    if mapping is None:
+        return None
+    message_type, kind = mapping
+    payload = event.get('payload')
+    if kind is not None:
+        payload = {'kind': kind, 'data': payload}
+    return {'type': message_type, 'payload': payload}
+
+
+def initial_messages(state):
+    """Начальный снимок — то же, что SessionConsumer.send_initial_state"""
+    from .views import _build_leaderboard
+
+    session = state.session
+    with state.lock:
+        players = state.ordered_players()
+    session_id = str(session.id)
+    return [
+        {'type': 'session.state', 'payload': {'session_id': session_id, 'code': session.code, 'status': session.status}},
+        {'type': 'players.list', 'payload': {
+            'session_id': session_id, 'players': [player_public_data(p) for p in players],
+        }},
+        {'type': 'leaderboard.update', 'payload': {'session_id': session_id, 'leaderboard': _build_leaderboard(state)}},
+    ]
+
+
+def format_event(message, event_id=None):
+    lines = f'id: {event_id}\n' if event_id else ''
+    return f'{lines}data: {json.dumps(message, separators=(",", ":"))}\n\n'
+
+
+class SessionStream:
+    """Сообщения группы одной сессии в этом процессе: нумерация, буфер и раздача SSE-клиентам"""
+
+    def __init__(self, code):
+        self.code = code
+        self.epoch = format(time.time_ns() // 1000, 'x')
+        self.seq = 0
+        self.buffer = deque(maxlen=BUFFER_SIZE)  # (номер, сообщение)
+        self.clients = set()  # asyncio.Queue клиентов
+        self.idle_since = time.monotonic()
+        self.task = None
+
+    def event_id(self, seq):
+        return f'{self.epoch}-{seq}'
+
+    def attach(self):
+        queue = asyncio.Queue(CLIENT_QUEUE_SIZE)
+        self.clients.add(queue)
+        return queue
+
+    def detach(self, queue):
+        self.clients.discard(queue)
+        if not self.clients:
+            self.idle_since = time.monotonic()
+
+    def replay(self, last_event_id):
+        """Сообщения после last_event_id или None, если продолжить по буферу нельзя"""
+        epoch, _, seq = (last_event_id or '').partition('-')
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        oldest = self.buffer[0][0] if self.buffer else self.seq + 1
+        if seq > self.seq or seq < oldest - 1:
+            return None
+        return [item for item in self.buffer if item[0] > seq]
+
+    def publish(self, message):
+        self.seq += 1
+        item = (self.seq, message)
+        self.buffer.append(item)
+        for queue in list(self.clients):
+            try:
+                queue.put_nowait(item)
+            except asyncio.QueueFull:
+                # Отставший клиент: закрываем поток, EventSource вернётся с Last-Event-ID
+                self.clients.discard(queue)
+                _close(queue)
+
+    async def run(self):
+        layer = get_channel_layer()
+        channel = await layer.new_channel('sse.')
+        group = f'session_{self.code}'
+        await layer.group_add(group, channel)
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(layer.receive(channel), timeout=HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    if not self.clients and time.monotonic() - self.idle_since >= LINGER_SECONDS:
+                        # Без await между проверкой и удалением: новый клиент получит новый поток
+                        if _streams.get(self.code) is self:
+                            del _streams[self.code]
+                        break
+                    continue
+                message = client_message(event)
+                if message is not None:
+                    self.publish(message)
+        finally:
+            if _streams.get(self.code) is self:
+                del _streams[self.code]
+            for queue in list(self.clients):
+                _close(queue)
+            await layer.group_discard(group, channel)
+
+
+def _close(queue):
+    """Закрыть поток клиента: вместо недоставленного — признак конца"""
+    while not queue.empty():
+        queue.get_nowait()
+    queue.put_nowait(None)
+
+
+_streams = {}  # код сессии -> SessionStream
+
+
+def get_stream(code):
+    stream = _streams.get(code)
+    if stream is None:
+        stream = _streams[code] = SessionStream(code)
+        stream.task = asyncio.get_running_loop().create_task(stream.run())
+    return stream
+
+
+async def event_stream(code, state, last_event_id):
+    stream = get_stream(code)
+    # Подписка и продолжение — без await между ними, чтобы не потерять и не задвоить сообщение
+    queue = stream.attach()
+    replay = stream.replay(last_event_id)
+    snapshot_seq = stream.seq
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        if replay is None:
+            messages = await sync_to_async(initial_messages, thread_sensitive=False)(state)
+            for idx, message in enumerate(messages):
+                # id у последнего сообщения снимка: с него продолжится переподключение
+                yield format_event(message, stream.event_id(snapshot_seq) if idx == len(messages) - 1 else None)
+        else:
+            for seq, message in replay:
+                yield format_event(message, stream.event_id(seq))
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+            if item is None:
+                break
+            seq, message = item
+            yield format_event(message, stream.event_id(seq))
+    finally:
+        stream.detach(queue)
+
+
+async def session_events(request, code):
+    """SSE-поток обновлений сессии (Last-Event-ID — продолжение после обрыва)"""
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    state = await sync_to_async(state_engine.get)(code)
+    if state is None:
+        return JsonResponse({'error': 'Сессия не найдена'}, status=404)
+    # EventSource шлёт Last-Event-ID сам; ?last_event_id= — если клиент пересоздаёт EventSource
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    response = StreamingHttpResponse(event_stream(code, state, last_event_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx не буферизует поток
+    return response
@@ -0,0 +1,390 @@
+"""
+Состояние «горячих» сессий в памяти процесса.
+
+Вечеринка целиком живёт в одном процессе, поэтому сессия, её игроки,
+прогресс по уровням и текущий раунд Краш загружаются из базы один раз
+(при первом обращении) и дальше читаются из памяти без запросов.
+
+Изменения делаются под блокировкой сессии прямо в объектах моделей,
+а в базу уходят отложенно: фоновый поток раз в FLUSH_INTERVAL секунд
+пишет изменённые поля через bulk_update/bulk_create. Сессии, к которым
+не обращались EVICT_AFTER секунд, сбрасываются и выгружаются.
+
+Код, который меняет игроков напрямую в базе (F()-обновления, удаление),
+оборачивается в state_engine.detached(): изменения сессии сбрасываются
+в базу до блока, а после него состояние перечитывается.
+
+Под роутером manage.py serve сессию держит только воркер-владелец: второй
+экземпляр состояния в другом процессе перетирал бы его записи. Поэтому
+чужую сессию get() не загружает, а бросает MisdirectedSession (ответ 421,
+клиент повторяет запрос с X-Session-Code).
+"""
+import atexit
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.db import close_old_connections, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .analytics import SessionAnalytics
+from .events import event_log
+from .logs import log_error
+from .models import CrashGame, Player, Progress, Session
+from .timers import schedule_session
+from .serializers import session_data
+from .serving import owns_session
+
+
+def is_finished(player):
+    """Игрок закончил игру: прошёл все уровни или дошёл до красного"""
+    return player.status == 'done' or player.current_level == 'red'
+
+
+FLUSH_INTERVAL = 1.0  # секунд — максимальная задержка записи в базу
+# Поля активности: их изменение не меняет версию игрока
+UNVERSIONED_FIELDS = frozenset({'last_seen', 'is_connected', 'ip_address', 'user_agent', 'device_type'})
+EVICT_AFTER = 600  # секунд без обращений до выгрузки сессии
+
+
+class MisdirectedSession(APIException):
+    """Сессию обслуживает другой воркер manage.py serve"""
+    status_code = status.HTTP_421_MISDIRECTED_REQUEST
+    message = 'Сессию обслуживает другой воркер: повторите запрос с X-Session-Code'
+
+    def __init__(self, codes):
+        super().__init__({'error': self.message, 'sessions': sorted(codes)})
+
+
+class SessionState:
+    """Сессия, её игроки и прогресс в памяти"""
+
+    def __init__(self, session, players, progresses, crash_game, analytics=None):
+        self.lock = threading.RLock()
+        # Запись в базу целиком, от снимка изменений до commit; берётся раньше lock
+        self.flush_lock = threading.RLock()
+        self.session = session
+        self.players = {}
+        self.by_token = {}
+        self.progress = {}  # (player_id, level) -> Progress
+        for player in players:
+            self._index(player)
+        for progress in progresses:
+            self.progress[(progress.player_id, progress.level)] = progress
+        self.crash_game = crash_game  # Текущий незавершённый раунд Краш или None
+        self.remaining = self._count_remaining()  # Сколько игроков ещё не закончили
+        self.analytics = analytics or SessionAnalytics()  # Агрегаты уровней и мини-игр (game/analytics.py)
+        self.dirty_players = {}  # player_id -> {поля}
+        self.dirty_progress = {}  # (player_id, level) -> Progress
+        self.dirty_session = set()
+        self.last_access = time.monotonic()
+
+    def refresh(self):
+        """Перечитать сессию из базы, сохранив объекты игроков"""
+        with self.lock:
+            self.session.refresh_from_db()
+            fresh = {p.id: p for p in Player.objects.filter(session=self.session)}
+            for pid in list(self.players):
+                if pid not in fresh:
+                    self.by_token.pop(self.players.pop(pid).token, None)
+            for pid, player in fresh.items():
+                current = self.players.get(pid)
+                if current is None:
+                    self._index(player)
+                    continue
+                for field in Player._meta.concrete_fields:
+                    setattr(current, field.attname, getattr(player, field.attname))
+            self.progress = {
+                (p.player_id, p.level): p for p in Progress.objects.filter(player__session=self.session)
+            }
+            self.crash_game = (
+                CrashGame.objects.filter(session=self.session, ended_at__isnull=True).order_by('-started_at').first()
+            )
+            self.remaining = self._count_remaining()
+
+    def _count_remaining(self):
+        return sum(1 for p in self.players.values() if not is_finished(p))
+
+    def _index(self, player):
+        # Все объекты ссылаются на один экземпляр сессии — player.session без запросов
+        player.session = self.session
+        self.players[player.id] = player
+        self.by_token[player.token] = player
+
+    def add_player(self, player):
+        with self.lock:
+            self._index(player)
+            self.remaining += not is_finished(player)
+
+    def update_player(self, player, **fields):
+        """Изменить поля игрока (с учётом счётчика remaining) и пометить их к записи"""
+        with self.lock:
+            was_finished = is_finished(player)
+            for field, value in fields.items():
+                setattr(player, field, value)
+            self.remaining += was_finished - is_finished(player)
+            self.mark_player(player, *fields)
+
+    @property
+    def all_finished(self):
+        return self.remaining == 0
+
+    def ordered_players(self):
+        """Игроки в порядке Player.Meta.ordering"""
+        players = sorted(self.players.values(), key=lambda p: p.created_at)
+        players.sort(key=lambda p: (p.total_score, p.bonus_score), reverse=True)
+        return players
+
+    def get_progress(self, player, level):
+        """Прогресс игрока на уровне; новый объект создаётся в памяти"""
+        key = (player.id, level)
+        progress = self.progress.get(key)
+        if progress is None:
+            progress = self.progress[key] = Progress(player=player, level=level)
+        return progress
+
+    def mark_player(self, player, *fields):
+        """Пометить поля к записи; изменение игрового состояния увеличивает player.version"""
+        with self.lock:
+            dirty = self.dirty_players.setdefault(player.id, set())
+            dirty.update(fields)
+            if not UNVERSIONED_FIELDS.issuperset(fields):
+                player.version += 1
+                dirty.add('version')
+
+    def mark_progress(self, progress):
+        with self.lock:
+            self.dirty_progress[(progress.player_id, progress.level)] = progress
+
+    def mark_session(self, *fields):
+        with self.lock:
+            self.dirty_session.update(fields)
+
+    @property
+    def is_dirty(self):
+        return bool(self.dirty_players or self.dirty_progress or self.dirty_session)
+
+    def flush(self):
+        """
+        Записать изменения в базу.
+
+        flush_lock держится до конца записи: StateEngine.detached() дожидается
+        идущего сброса, иначе тот записал бы устаревшие поля поверх прямых
+        изменений блока (F()-обновлений бонусов).
+        """
+        with self.flush_lock:
+            with self.lock:
+                dirty_players, self.dirty_players = self.dirty_players, {}
+                dirty_progress, self.dirty_progress = self.dirty_progress, {}
+                dirty_session, self.dirty_session = self.dirty_session, set()
+                # Игроки с одинаковым набором изменённых полей — одним bulk_update: поле, которое
+                # у игрока не менялось, не пишем, иначе затрём значение, записанное мимо состояния
+                by_fields = {}
+                for pid, pfields in dirty_players.items():
+                    if pid in self.players and pfields:
+                        by_fields.setdefault(frozenset(pfields), []).append(self.players[pid])
+                # Прогресс удалённых игроков не пишем
+                progress = [p for p in dirty_progress.values() if p.player_id in self.players]
+                created = [p for p in progress if p._state.adding]
+                updated = [p for p in progress if not p._state.adding]
+            try:
+                with transaction.atomic():
+                    if dirty_session:
+                        self.session.save(update_fields=sorted(dirty_session))
+                    for fields, players in by_fields.items():
+                        Player.objects.bulk_update(players, sorted(fields))
+                    if created:
+                        Progress.objects.bulk_create(created)
+                    if updated:
+                        Progress.objects.bulk_update(
+                            updated, ['status', 'score', 'time_spent_ms', 'details', 'completed_at']
+                        )
+            except Exception:
+                # Вернём изменения в очередь, следующая попытка — через FLUSH_INTERVAL
+                with self.lock:
+                    for pid, pfields in dirty_players.items():
+                        self.dirty_players.setdefault(pid, set()).update(pfields)
+                    for key, progress in dirty_progress.items():
+                        self.dirty_progress.setdefault(key, progress)
+                    self.dirty_session |= dirty_session
+                raise
+
+    def session_data(self):
+        """Данные сессии без запроса players.count"""
+        return session_data(self.session, len(self.players))
+
+
+class StateEngine:
+    """Реестр загруженных сессий с фоновой записью в базу"""
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, evict_after=EVICT_AFTER):
+        self.flush_interval = flush_interval
+        self.evict_after = evict_after
+        self._lock = threading.RLock()
+        self._states = {}  # code -> SessionState
+        self._codes = {}  # session_id -> code
+        self._tokens = {}  # token игрока -> code
+        self._player_codes = {}  # player_id -> code
+        self._thread = None
+
+    def _load(self, session):
+        players = list(Player.objects.filter(session=session))
+        progresses = list(Progress.objects.filter(player__session=session))
+        crash_game = CrashGame.objects.filter(session=session, ended_at__isnull=True).order_by('-started_at').first()
+        # Аналитика восстанавливается по журналу — сначала сбрасываем в него буфер событий
+        event_log.flush()
+        analytics = SessionAnalytics.from_events(session.id)
+        state = SessionState(session, players, progresses, crash_game, analytics)
+        self._states[session.code] = state
+        self._codes[session.id] = session.code
+        for player in players:
+            self._tokens[player.token] = session.code
+            self._player_codes[player.id] = session.code
+        self._ensure_thread()
+        # После перезапуска процесса таймеры уровней активной сессии восстанавливаются по started_at
+        schedule_session(session)
+        return state
+
+    def get(self, code):
+        """Состояние сессии по коду или None, если сессии нет; чужая сессия — MisdirectedSession"""
+        state = self._states.get(code)
+        if state is None:
+            if not owns_session(code):
+                raise MisdirectedSession([code])
+            with self._lock:
+                state = self._states.get(code)
+                if state is None:
+                    session = Session.objects.filter(code=code).first()
+                    if session is None:
+                        return None
+                    state = self._load(session)
+        state.last_access = time.monotonic()
+        return state
+
+    def loaded(self, code):
+        """Состояние сессии, только если она уже загружена (без запросов)"""
+        return self._states.get(code)
+
+    def get_by_id(self, session_id):
+        code = self._codes.get(session_id)
+        if code is None:
+            code = Session.objects.filter(id=session_id).values_list('code', flat=True).first()
+            if code is None:
+                return None
+        return self.get(code)
+
+    def _lookup_player(self, index, key, **lookup):
+        code = index.get(key)
+        if code is None:
+            code = Player.objects.filter(**lookup).values_list('session__code', flat=True).first()
+            if code is None:
+                return None, None
+        state = self.get(code)
+        if state is None:
+            return None, None
+        player = state.by_token.get(key) if index is self._tokens else state.players.get(key)
+        return state, player
+
+    def by_token(self, token):
+        """(состояние, игрок) по токену игрока или (None, None)"""
+        return self._lookup_player(self._tokens, token, token=token)
+
+    def by_player_id(self, player_id):
+        """(состояние, игрок) по id игрока или (None, None)"""
+        return self._lookup_player(self._player_codes, player_id, id=player_id)
+
+    def add_player(self, state, player):
+        state.add_player(player)
+        self._tokens[player.token] = state.session.code
+        self._player_codes[player.id] = state.session.code
+
+    def _drop(self, code):
+        with self._lock:
+            state = self._states.pop(code, None)
+            if state is None:
+                return
+            self._codes.pop(state.session.id, None)
+            for player in state.players.values():
+                self._tokens.pop(player.token, None)
+                self._player_codes.pop(player.id, None)
+
+    @contextmanager
+    def detached(self, *session_ids):
+        """
+        Блок, который меняет игроков сессий напрямую в базе.
+
+        Пока блок выполняется, загрузка сессий, изменения загруженных
+        сессий и их фоновый сброс ждут; перед блоком их изменения
+        сбрасываются в базу, после — состояние перечитывается из базы.
+        """
+        with ExitStack() as stack:
+            stack.enter_context(self._lock)
+            states = []
+            for session_id in sorted(set(session_ids), key=str):
+                code = self._codes.get(session_id)
+                state = self._states.get(code) if code else None
+                if state is not None:
+                    stack.enter_context(state.flush_lock)
+                    stack.enter_context(state.lock)
+                    state.flush()
+                    states.append(state)
+            yield
+            for state in states:
+                state.refresh()
+                for player in state.players.values():
+                    self._tokens[player.token] = state.session.code
+                    self._player_codes[player.id] = state.session.code
+
+    def evict(self, code, flush=True):
+        """Выгрузить сессию; flush=False — отбросить несохранённые изменения"""
+        with self._lock:
+            state = self._states.get(code)
+            if state is None:
+                return
+            with state.flush_lock, state.lock:
+                if flush:
+                    state.flush()
+                self._drop(code)
+
+    def flush_all(self):
+        for state in list(self._states.values()):
+            if state.is_dirty:
+                state.flush()
+
+    def evict_idle(self):
+        deadline = time.monotonic() - self.evict_after
+        with self._lock:
+            for code, state in list(self._states.items()):
+                if state.last_access >= deadline or not state.flush_lock.acquire(blocking=False):
+                    continue
+                try:
+                    if not state.lock.acquire(blocking=False):
+                        continue
+                    try:
+                        state.flush()
+                        self._drop(code)
+                    finally:
+                        state.lock.release()
+                finally:
+                    state.flush_lock.release()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='session-state-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush_all()
+                self.evict_idle()
+            except Exception:
+                log_error('flush', 'state.flush_failed')
+            finally:
+                close_old_connections()
+
+
+state_engine = StateEngine()
+atexit.register(state_engine.flush_all)
@@ -0,0 +1,422 @@
+"""
+Проверки горячих путей на тестовой базе: число SQL-запросов и планы запросов,
+а также пакет результатов, журнал событий и разбиение сессий по воркерам.
+
+    python manage.py test game
+
+Сессия живёт в памяти процесса (state_engine), поэтому фоновые потоки записи
+отключены: изменения пишутся явным flush внутри транзакции теста. Планы
+проверяются через EXPLAIN QUERY PLAN и рассчитаны на SQLite.
+"""
+import os
+import re
+import secrets
+import uuid
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+from django.db import DatabaseError, connection
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+
+from . import views
+from .crash import chain_pool
+from .crash_history import crash_history
+from .encoding import CODECS, ENCODING_MSGPACK, MsgpackCodec
+from .events import EventLog, event_log
+from .idempotency import idempotency_store
+from .models import (
+    AdminToken, AdminUser, CrashBet, CrashGame, GameEvent, Player, PointsTransaction, RigOverride, Selfie, Session,
+)
+from .serving import WORKER_ENV, Router, Worker
+from .snapshots import snapshot_recorder
+from .state import state_engine
+
+
+# Сколько SQL-запросов допускается на горячих путях (после загрузки сессии в память)
+QUERY_BUDGETS = {
+    'get_session_state': 0,
+    'submit_progress': 0,
+    'submit_progress (переход уровня)': 1,  # снимок лидерборда
+    'submit_progress (мини-игра)': 0,
+    'submit_progress_batch': 1,  # один снимок лидерборда на весь пакет с переходом уровня
+    'submit_progress (повтор по Idempotency-Key)': 0,  # сохранённый ответ, без вьюхи
+    'submit_progress (финиш сессии)': 2,  # снимки перехода уровня и финала
+}
+
+# Полный проход таблицы: "SCAN game_player" без "USING ... INDEX"
+FULL_SCAN_RE = re.compile(r'^SCAN (?!CONSTANT ROW)(\S+)(?!.* USING )')
+# План проверяется у чтений и у изменений с WHERE
+CHECKED_STATEMENTS = ('SELECT', 'UPDATE', 'DELETE')
+# Индексы, которые обязан использовать путь (game/migrations/0015_hot_query_indexes.py)
+EXPECTED_INDEXES = {
+    'get_current_crash_game (загрузка)': 'crash_game_session_state_idx',
+    'get_crash_history (загрузка)': 'crash_game_session_state_idx',
+    'get_crash_bets': 'crash_bet_player_time_idx',
+    'admin_player_detail': 'ledger_player_time_idx',
+    'create_crash_game (с подкруткой)': 'rig_session_pending_idx',
+    'admin_create_rig': 'rig_session_pending_idx',
+    'admin_bulk_adjust_points (фильтр)': 'player_session_status_idx',
+}
+
+
+def explain(statements):
+    """[(sql, [строки плана])] для проверяемых запросов из [(sql, params)]"""
+    explained = []
+    with connection.cursor() as cursor:
+        for sql, params in statements:
+            if not sql.lstrip().upper().startswith(CHECKED_STATEMENTS):
+                continue
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            explained.append((sql, [row[3] for row in cursor.fetchall()]))
+    return explained
+
+
+class SessionTestCase(TestCase):
+    """Временная сессия с игроками, загруженная в память"""
+
+    players_count = 5
+
+    def setUp(self):
+        # Фоновые потоки писали бы мимо транзакции теста
+        for store in (state_engine, event_log, idempotency_store):
+            patcher = mock.patch.object(store, '_ensure_thread')
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.factory = APIRequestFactory()
+        self.session = Session.objects.create(code=secrets.token_hex(3).upper(), min_players=1)
+        self.code = self.session.code
+        self.addCleanup(self._forget_session)
+        self.tokens = [
+            self.call(views.join_session, self.factory.post(
+                f'/api/session/{self.code}/join',
+                {'name': f'Игрок {idx}', 'device_uuid': str(uuid.uuid4())},
+                format='json',
+            ), self.code).data['token']
+            for idx in range(self.players_count)
+        ]
+        self.call(views.start_session, self.factory.post(f'/api/session/{self.code}/start'), self.code)
+
+    def _forget_session(self):
+        state_engine.evict(self.code)
+        event_log.flush()
+        idempotency_store.flush()
+        snapshot_recorder.forget(self.session.id)
+        chain_pool.forget(self.session.id)
+        crash_history.forget(self.code)
+
+    def call(self, view, request, *args):
+        response = view(request, *args)
+        self.assertLess(response.status_code, 400, f'{view.__name__}: {getattr(response, "data", "")}')
+        return response
+
+    def submit(self, token, headers=None, **data):
+        request = self.factory.post('/api/progress', dict(token=token, **data), format='json', **(headers or {}))
+        return self.call(views.submit_progress, request)
+
+
+class QueryCountTests(SessionTestCase):
+    """Число SQL-запросов на горячих путях укладывается в QUERY_BUDGETS"""
+
+    def assertBudget(self, name):
+        return self.assertNumQueries(QUERY_BUDGETS[name])
+
+    def test_session_state(self):
+        with self.assertBudget('get_session_state'):
+            self.call(views.get_session_state, self.factory.get(f'/api/session/{self.code}'), self.code)
+
+    def test_submit_progress(self):
+        with self.assertBudget('submit_progress'):
+            self.submit(self.tokens[0], level='green', score=2, details={'game': 1})
+        with self.assertBudget('submit_progress (переход уровня)'):
+            response = self.submit(self.tokens[0], level='green', score=3, details={'game': 3})
+        # Переигровка уровня заменяет его счёт, а не добавляется к нему
+        self.assertEqual(response.data['player']['total_score'], 3)
+        with self.assertBudget('submit_progress (мини-игра)'):
+            self.submit(self.tokens[0], level='bonus', score=5, is_minigame=True)
+
+    def test_submit_progress_batch(self):
+        # Пакет после обрыва сети: три игры зелёного, игра жёлтого, бонус и ошибочный результат
+        request = self.factory.post('/api/progress/batch', {'token': self.tokens[1], 'results': [
+            {'level': 'green', 'score': 1, 'details': {'game': 1}},
+            {'level': 'green', 'score': 2, 'details': {'game': 2}},
+            {'level': 'green', 'score': 3, 'details': {'game': 3}},
+            {'level': 'yellow', 'score': 2, 'details': {'game': 1}},
+            {'level': 'bonus', 'score': 5, 'is_minigame': True},
+            {'level': 'purple', 'score': 1},
+        ]}, format='json')
+        with self.assertBudget('submit_progress_batch'):
+            response = self.call(views.submit_progress_batch, request)
+        player = response.data['player']
+        self.assertEqual((player['total_score'], player['bonus_score'], player['current_level']), (13, 5, 'yellow'))
+        self.assertEqual([item['status'] for item in response.data['results']], [200, 200, 200, 200, 200, 400])
+
+    def test_idempotent_replay(self):
+        # Повтор бонуса с тем же ключом не начисляет очки второй раз
+        key = {'HTTP_IDEMPOTENCY_KEY': str(uuid.uuid4())}
+        first = self.submit(self.tokens[1], headers=key, level='bonus', score=5, is_minigame=True)
+        with self.assertBudget('submit_progress (повтор по Idempotency-Key)'):
+            response = self.submit(self.tokens[1], headers=key, level='bonus', score=5, is_minigame=True)
+        self.assertEqual(response.data, first.data)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(state_engine.by_token(self.tokens[1])[1].bonus_score, 5)
+
+    def test_session_finish(self):
+        # Все, кроме последнего, доходят до красного уровня; финиш ловит счётчик, без обхода игроков
+        for token in self.tokens[:-1]:
+            self.submit(token, level='red', score=1, details={'game': 3})
+        with self.assertBudget('submit_progress (финиш сессии)'):
+            self.submit(self.tokens[-1], level='red', score=1, details={'game': 3})
+        self.assertEqual(state_engine.get(self.code).session.status, 'finished')
+
+
+class ProgressBatchTests(SessionTestCase):
+    """Пакет результатов: ошибка в одном результате не оставляет в состоянии половину пакета"""
+
+    def batch(self, *results):
+        return self.factory.post('/api/progress/batch', {'token': self.tokens[0], 'results': list(results)}, format='json')
+
+    def test_invalid_item_types(self):
+        response = self.call(views.submit_progress_batch, self.batch(
+            {'level': 'green', 'score': 2, 'details': {'game': 1}},
+            {'level': 'green', 'score': '3', 'details': {'game': 2}},
+            {'level': 'green', 'score': 1, 'time_spent_ms': 'долго'},
+            {'level': 'yellow', 'score': 1, 'details': [1]},
+        ))
+        self.assertEqual([item['status'] for item in response.data['results']], [200, 400, 400, 400])
+        self.assertEqual((response.data['applied'], response.data['player']['total_score']), (1, 2))
+
+    def test_unexpected_error_leaves_state_untouched(self):
+        state, player = state_engine.by_token(self.tokens[0])
+        version = player.version
+        # Второй результат обрывает пакет исключением уже после разбора первого
+        with mock.patch.object(views, '_validate_result', side_effect=[None, RuntimeError('сбой')]), \
+                mock.patch.object(views, 'log_event') as log_event:
+            with self.assertRaises(RuntimeError):
+                views.submit_progress_batch(self.batch(
+                    {'level': 'green', 'score': 2, 'details': {'game': 1}},
+                    {'level': 'bonus', 'score': 5, 'is_minigame': True},
+                ))
+        log_event.assert_not_called()
+        self.assertEqual((player.total_score, player.bonus_score, player.version), (0, 0, version))
+        self.assertNotIn((player.id, 'green'), state.dirty_progress)
+
+
+class PlayerProgressTests(SessionTestCase):
+    """POST /api/player/progress"""
+
+    def test_version_bumped_once(self):
+        state, player = state_engine.by_token(self.tokens[0])
+        version = player.version
+        response = self.call(views.update_player_progress, self.factory.post('/api/player/progress', {
+            'player_token': self.tokens[0], 'version': version,
+            'current_level': 'yellow', 'current_green_game': 3, 'played_bonus_games': ['slots'],
+        }, format='json'))
+        self.assertEqual(response.data['version'], version + 1)
+        self.assertEqual((player.current_level, player.current_green_game), ('yellow', 3))
+        self.assertLessEqual({'current_level', 'current_green_game', 'version'}, state.dirty_players[player.id])
+
+
+class EventLogTests(SessionTestCase):
+    """Сбой записи журнала не теряет события"""
+
+    def test_failed_flush_keeps_batch(self):
+        log = EventLog()
+        log._ensure_thread = mock.Mock()  # сбрасываем вручную, как и общий журнал в setUp
+        for idx in range(3):
+            log.append(self.session.id, 'test.event', idx=idx)
+        with mock.patch.object(GameEvent.objects, 'bulk_create', side_effect=DatabaseError('database is locked')):
+            with self.assertRaises(DatabaseError):
+                log.flush()
+        # Событие, пришедшее во время неудачной записи, остаётся после возвращённой пачки
+        log.append(self.session.id, 'test.event', idx=3)
+        self.assertEqual(log.flush(), 4)
+        events = GameEvent.objects.filter(session=self.session, kind='test.event').order_by('id')
+        self.assertEqual([event.data['idx'] for event in events], [0, 1, 2, 3])
+
+
+@skipUnless(ENCODING_MSGPACK in CODECS, 'msgpack не установлен')
+class MsgpackCodecTests(SimpleTestCase):
+    """Короткие ключи msgpack не искажают пересылаемые как есть данные"""
+
+    def test_colliding_keys_roundtrip(self):
+        codec = MsgpackCodec()
+        message = {'type': 'blackjack_update', 'payload': {
+            'player_id': str(uuid.uuid4()),
+            'state': {'p': [10, 7], 'd': [9], 's': 'stand', 'i': 2, 'n': 'рука', '~t': 1, 'name': 'Игрок'},
+        }}
+        self.assertEqual(codec.decode(bytes_data=codec.encode(message)), message)
+
+
+class WorkerOwnershipTests(SessionTestCase):
+    """
+    Два воркера manage.py serve: процесс переключается между ними через WORKER_ENV.
+
+    Запрос без X-Session-Code роутер отдаёт по кругу; воркер, которому сессия
+    не принадлежит, отвечает 421 и не загружает её состояние.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.router = Router([Worker(idx, '127.0.0.1', 0, 'snowparty.asgi:application', 2) for idx in range(2)])
+        # Как после рестарта: состояние сессии ещё не загружено ни одним воркером
+        state_engine.evict(self.code)
+
+    def on_worker(self, worker):
+        return mock.patch.dict(os.environ, {WORKER_ENV: f'{worker.index}/{worker.count}'})
+
+    def progress_request(self, **headers):
+        return self.factory.post('/api/progress', {
+            'token': self.tokens[0], 'level': 'green', 'score': 2, 'details': {'game': 1},
+        }, format='json', **headers)
+
+    def test_round_robin_request_refused_by_foreign_worker(self):
+        owner = self.router.pick(self.code)
+        statuses = {}
+        for _ in range(2):
+            worker = self.router.pick(None)
+            with self.on_worker(worker):
+                statuses[worker.index] = views.submit_progress(self.progress_request()).status_code
+                if worker is not owner:
+                    self.assertIsNone(state_engine.loaded(self.code))
+            # У каждого воркера своя память: состояние владельца другому не достаётся
+            state_engine.evict(self.code)
+        self.assertEqual(statuses, {owner.index: 200, 1 - owner.index: 421})
+        self.assertEqual(state_engine.by_token(self.tokens[0])[1].total_score, 2)
+
+    def test_session_header_routes_to_owner(self):
+        worker = self.router.pick(self.code)
+        with self.on_worker(worker):
+            response = views.submit_progress(self.progress_request(HTTP_X_SESSION_CODE=self.code))
+        self.assertEqual(response.status_code, 200)
+
+    def test_admin_request_refused_by_foreign_worker(self):
+        admin = AdminUser.objects.create(username='owner', password_hash='!')
+        token = AdminToken.objects.create(
+            admin=admin, token=secrets.token_urlsafe(32), expires_at=timezone.now() + timedelta(hours=1)
+        )
+        player_id = Player.objects.get(token=self.tokens[0]).id
+        foreign = self.router.workers[1 - self.router.pick(self.code).index]
+        with self.on_worker(foreign):
+            response = views.admin_adjust_points(self.factory.post(
+                f'/api/admin/player/{player_id}/points', {'delta': 5}, format='json',
+                HTTP_AUTHORIZATION=f'Bearer {token.token}',
+            ), player_id)
+        self.assertEqual(response.status_code, 421)
+        self.assertIsNone(state_engine.loaded(self.code))
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Проверка планов рассчитана на SQLite (EXPLAIN QUERY PLAN)')
+class QueryPlanTests(SessionTestCase):
+    """Запросы горячих путей не проходят таблицы целиком и используют нужные индексы"""
+
+    players_count = 10
+    rounds = 5
+
+    def setUp(self):
+        super().setUp()
+        self.admin = AdminUser.objects.create(username='plans', password_hash='!')
+        token = AdminToken.objects.create(
+            admin=self.admin, token=secrets.token_urlsafe(32), expires_at=timezone.now() + timedelta(hours=1)
+        )
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {token.token}'}
+        self.players = list(state_engine.get(self.code).players.values())
+        # Раунды Краш со ставками, проводки, подкрутка и селфи
+        for _ in range(self.rounds):
+            response = self.call(
+                views.create_crash_game, self.factory.post(f'/api/crash/{self.code}/create'), self.code
+            )
+            game = CrashGame.objects.get(id=response.data['game_id'])
+            for player in self.players:
+                bet = CrashBet.objects.create(crash_game=game, player=player, bet_amount=10, multiplier=1.5)
+                PointsTransaction.objects.create(
+                    player=player, session=self.session, amount=-10, crash_bet=bet, admin=self.admin, reason='Краш'
+                )
+            self.call(views.finish_crash_game, self.factory.post(f'/api/crash/{game.id}/finish'), str(game.id))
+        RigOverride.objects.create(session=self.session, value=2.0, admin=self.admin)
+        for player in self.players[:5]:
+            Selfie.objects.create(player=player, session=self.session, task='Селфи', image='selfies/plans.jpg')
+        state_engine.flush_all()
+        event_log.flush()
+
+    def plans(self, view, request, *args):
+        """Планы запросов, выполненных вьюхой: (ответ, [(sql, [строки плана])])"""
+        statements = []
+
+        def record(execute, sql, params, many, context):
+            if not many:
+                statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            response = self.call(view, request, *args)
+        return response, explain(statements)
+
+    def cold(self, view, request, *args):
+        # Загрузка сессии и истории Краш в память — тоже горячий путь (первый запрос после рестарта)
+        state_engine.evict(self.code)
+        crash_history.forget(self.code)
+        return self.plans(view, request, *args)[1]
+
+    def assertIndexed(self, name, queries):
+        with self.subTest(name):
+            scans = [
+                f'{sql[:200]}\n  ' + '\n  '.join(plan)
+                for sql, plan in queries if any(FULL_SCAN_RE.match(line) for line in plan)
+            ]
+            self.assertEqual(scans, [], 'полный проход таблицы')
+            index = EXPECTED_INDEXES.get(name)
+            if index is not None:
+                self.assertTrue(
+                    any(f' {index} ' in f'{line} ' for _, plan in queries for line in plan), f'нет индекса {index}'
+                )
+
+    def test_player_paths(self):
+        code, get = self.code, self.factory.get
+        self.assertIndexed('get_session_state (загрузка сессии)',
+                           self.cold(views.get_session_state, get(f'/api/session/{code}'), code))
+        self.assertIndexed('get_session_selfies',
+                           self.plans(views.get_session_selfies, get(f'/api/session/{code}/selfies'), code)[1])
+        self.assertIndexed('get_session_timeline',
+                           self.plans(views.get_session_timeline, get(f'/api/session/{code}/timeline'), code)[1])
+
+    def test_crash_paths(self):
+        code, get, post = self.code, self.factory.get, self.factory.post
+        self.assertIndexed('get_current_crash_game (загрузка)',
+                           self.cold(views.get_current_crash_game, get(f'/api/crash/{code}/current'), code))
+        self.assertIndexed('get_crash_history (загрузка)',
+                           self.cold(views.get_crash_history, get(f'/api/crash/{code}/history'), code))
+        self.assertIndexed('get_crash_stats', self.plans(views.get_crash_stats, get(f'/api/crash/{code}/stats'), code)[1])
+        self.assertIndexed('get_crash_bets', self.plans(
+            views.get_crash_bets, get(f'/api/crash/{code}/bets', {'token': self.tokens[0]}), code
+        )[1])
+        self.assertIndexed('get_crash_chain', self.plans(views.get_crash_chain, get(f'/api/crash/{code}/chain'), code)[1])
+        self.assertIndexed('verify_crash_history',
+                           self.plans(views.verify_crash_history, get(f'/api/crash/{code}/verify'), code)[1])
+
+        # Раунд с подкруткой: take_rig читает неиспользованные подкрутки сессии
+        chain_pool.mark_rig_pending(self.session.id)
+        response, queries = self.plans(views.create_crash_game, post(f'/api/crash/{code}/create'), code)
+        self.assertIndexed('create_crash_game (с подкруткой)', queries)
+        game_id = response.data['game_id']
+        self.assertIndexed('finish_crash_game', self.plans(
+            views.finish_crash_game, post(f'/api/crash/{game_id}/finish'), game_id
+        )[1])
+
+    def test_admin_paths(self):
+        code, get, post = self.code, self.factory.get, self.factory.post
+        self.assertIndexed('admin_create_rig', self.plans(views.admin_create_rig, post(
+            '/api/admin/rig', {'session': code, 'value': 3.0}, format='json', **self.auth
+        ))[1])
+        self.assertIndexed('admin_players (сессия)', self.plans(views.admin_players, get(
+            '/api/admin/players', {'session': code}, **self.auth
+        ))[1])
+        self.assertIndexed('admin_player_detail', self.plans(views.admin_player_detail, get(
+            f'/api/admin/player/{self.players[0].id}', **self.auth
+        ), self.players[0].id)[1])
+        self.assertIndexed('admin_bulk_adjust_points (фильтр)', self.plans(views.admin_bulk_adjust_points, post(
+            '/api/admin/points/bulk',
+            {'filter': {'session': code, 'status': 'playing'}, 'delta': 1, 'reason': 'Проверка'},
+            format='json', **self.auth
+        ))[1])
@@ -0,0 +1,239 @@
+"""
+Серверные таймеры на общем иерархическом колесе.
+
+Одно колесо на процесс и одна asyncio-задача в цикле событий сервера,
+сколько бы ни было таймеров: таймер — это запись в слоте колеса. Три
+уровня по SLOTS слотов с шагом TICK секунд покрывают ~36 часов; таймер
+дальнего уровня при повороте младшего колеса спускается ниже.
+
+Что планируется (schedule_session, schedule_crash_round):
+- дедлайны уровней: уровень k сессии длится level_duration_seconds от
+  started_at + k × длительность; отстающие игроки переводятся дальше;
+- игрок на красном уровне уже считается закончившим (state.is_finished),
+  поэтому сессия автозавершается, как только таймер жёлтого переведёт
+  последних; таймер красного — страховка (например, после сброса прогресса);
+- конец фазы ставок раунда Краш;
+- раз в COUNTDOWN_INTERVAL секунд — рассылка timer.tick по активным сессиям.
+
+schedule()/cancel() потокобезопасны и вызываются из синхронных вьюх.
+Колбэки — синхронные функции, выполняются через sync_to_async вне цикла.
+Колесо запускается при первом ASGI-запросе (snowparty/asgi.py); без
+запущенного цикла (management-команды) таймеры только копятся.
+"""
+import asyncio
+import threading
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+from .logs import log_error
+
+
+TICK = 0.5  # секунд
+SLOT_BITS = 6
+SLOTS = 1 << SLOT_BITS  # 64 слота на уровень
+LEVELS = 3  # 64 × 64 × 64 тиков по 0.5 с ≈ 36 ч
+COUNTDOWN_INTERVAL = 5  # секунд между рассылками timer.tick
+
+SESSION_LEVELS = ('green', 'yellow', 'red')
+
+
+class Timer:
+    __slots__ = ('key', 'expires', 'callback', 'args', 'cancelled')
+
+    def __init__(self, key, expires, callback, args):
+        self.key = key
+        self.expires = expires  # номер тика
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+
+class TimerWheel:
+    """Иерархическое колесо таймеров (по ключу: повторный schedule заменяет таймер)"""
+
+    def __init__(self, tick=TICK):
+        self.tick = tick
+        self._lock = threading.Lock()
+        self._wheels = [[[] for _ in range(SLOTS)] for _ in range(LEVELS)]
+        self._current = self._tick_at(time.time())
+        self._timers = {}  # ключ -> Timer
+        self._loop = None
+        self._task = None
+        self.fired = 0
+
+    def _tick_at(self, timestamp):
+        return int(timestamp / self.tick)
+
+    def start(self):
+        """Запустить колесо в текущем цикле событий (повторные вызовы ничего не делают)"""
+        if self._task is not None and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._task = self._loop.create_task(self._run())
+
+    def schedule(self, key, at, callback, *args):
+        """Вызвать callback(*args) в момент at (datetime или unix-время)"""
+        timestamp = at.timestamp() if hasattr(at, 'timestamp') else at
+        # Округляем вверх: таймер не срабатывает раньше срока
+        timer = Timer(key, -int(-timestamp // self.tick), callback, args)
+        with self._lock:
+            previous = self._timers.pop(key, None)
+            if previous is not None:
+                previous.cancelled = True
+            self._timers[key] = timer
+            self._place(timer)
+
+    def cancel(self, key):
+        with self._lock:
+            timer = self._timers.pop(key, None)
+            if timer is not None:
+                timer.cancelled = True
+
+    def cancel_prefix(self, *prefix):
+        """Отменить таймеры с ключами-кортежами, начинающимися с prefix"""
+        with self._lock:
+            for key in [k for k in self._timers if isinstance(k, tuple) and k[:len(prefix)] == prefix]:
+                self._timers.pop(key).cancelled = True
+
+    def pending(self):
+        with self._lock:
+            return len(self._timers)
+
+    def _place(self, timer, cascading=False):
+        delta = timer.expires - self._current
+        # При спуске срок может совпасть с текущим тиком — его слот обрабатывается следом
+        if delta < 0 or (delta == 0 and not cascading):
+            # Просроченный — в ближайший тик
+            self._wheels[0][(self._current + 1) & (SLOTS - 1)].append(timer)
+            return
+        for level in range(LEVELS):
+            if delta < 1 << (SLOT_BITS * (level + 1)):
+                self._wheels[level][(timer.expires >> (SLOT_BITS * level)) & (SLOTS - 1)].append(timer)
+                return
+        # Дальше горизонта — в последний слот верхнего уровня, при спуске перепланируется
+        top = LEVELS - 1
+        slot = ((self._current >> (SLOT_BITS * top)) - 1) & (SLOTS - 1)
+        self._wheels[top][slot].append(timer)
+
+    def _advance(self):
+        """Один тик: спуск таймеров с верхних уровней и срабатывание слота нижнего"""
+        self._current += 1
+        for level in range(LEVELS - 1, 0, -1):
+            if self._current & ((1 << (SLOT_BITS * level)) - 1):
+                continue
+            slot = self._wheels[level][(self._current >> (SLOT_BITS * level)) & (SLOTS - 1)]
+            timers, slot[:] = list(slot), []
+            for timer in timers:
+                if not timer.cancelled:
+                    self._place(timer, cascading=True)
+        slot = self._wheels[0][self._current & (SLOTS - 1)]
+        due = []
+        keep = []
+        for timer in slot:
+            if timer.cancelled:
+                continue
+            if timer.expires <= self._current:
+                due.append(timer)
+                if self._timers.get(timer.key) is timer:
+                    del self._timers[timer.key]
+            else:
+                keep.append(timer)
+        slot[:] = keep
+        return due
+
+    async def _run(self):
+        while True:
+            now = self._tick_at(time.time())
+            due = []
+            with self._lock:
+                while self._current < now:
+                    due.extend(self._advance())
+            for timer in due:
+                self._loop.create_task(self._fire(timer))
+            await asyncio.sleep(self.tick - time.time() % self.tick)
+
+    async def _fire(self, timer):
+        self.fired += 1
+        await sync_to_async(self._call, thread_sensitive=False)(timer)
+
+    @staticmethod
+    def _call(timer):
+        try:
+            timer.callback(*timer.args)
+        except Exception:
+            log_error('timer', 'timer.failed', key=timer.key)
+        finally:
+            close_old_connections()
+
+
+timer_wheel = TimerWheel()
+
+# Активные сессии для рассылки обратного отсчёта: code -> (session_id, started_at, level_duration_seconds)
+_countdowns = {}
+_countdowns_lock = threading.Lock()
+
+
+def level_deadlines(session):
+    """[(уровень, конец уровня)] по started_at и level_duration_seconds"""
+    duration = timedelta(seconds=session.level_duration_seconds)
+    return [(level, session.started_at + duration * (idx + 1)) for idx, level in enumerate(SESSION_LEVELS)]
+
+
+def schedule_session(session):
+    """Дедлайны уровней и автозавершение активной сессии (повторный вызов перепланирует)"""
+    from .views import expire_level
+
+    if session.status != 'active' or session.started_at is None or not session.level_duration_seconds:
+        return
+    for level, deadline in level_deadlines(session):
+        timer_wheel.schedule(('level', session.id, level), deadline, expire_level, session.code, level)
+    with _countdowns_lock:
+        _countdowns[session.code] = (session.id, session.started_at, session.level_duration_seconds)
+        if len(_countdowns) == 1:
+            timer_wheel.schedule('countdown', time.time() + COUNTDOWN_INTERVAL, broadcast_countdowns)
+
+
+def unschedule_session(session):
+    timer_wheel.cancel_prefix('level', session.id)
+    with _countdowns_lock:
+        _countdowns.pop(session.code, None)
+
+
+def schedule_crash_round(session_code, game):
+    """Конец фазы ставок раунда Краш"""
+    from .views import close_crash_betting
+
+    if game.betting_phase_end is not None:
+        timer_wheel.schedule(('crash', game.id), game.betting_phase_end, close_crash_betting, session_code, game.id)
+
+
+def countdown_payload(session_id, started_at, duration, now):
+    """Текущий уровень сессии по расписанию и сколько до его конца"""
+    elapsed = (now - started_at).total_seconds()
+    idx = min(int(elapsed // duration), len(SESSION_LEVELS) - 1)
+    level_ends_at = started_at + timedelta(seconds=duration * (idx + 1))
+    return {
+        'session_id': str(session_id),
+        'level': SESSION_LEVELS[idx],
+        'level_ends_at': level_ends_at.isoformat(),
+        'remaining_seconds': max(0, round((level_ends_at - now).total_seconds())),
+        'ends_at': (started_at + timedelta(seconds=duration * len(SESSION_LEVELS))).isoformat(),
+    }
+
+
+def broadcast_countdowns():
+    """Рассылка timer.tick всем активным сессиям — один таймер на все сессии"""
+    from django.utils import timezone
+    from .views import broadcast_timer_tick
+
+    with _countdowns_lock:
+        sessions = list(_countdowns.items())
+    now = timezone.now()
+    for code, (session_id, started_at, duration) in sessions:
+        broadcast_timer_tick(code, countdown_payload(session_id, started_at, duration, now))
+    with _countdowns_lock:
+        if _countdowns:
+            timer_wheel.schedule('countdown', time.time() + COUNTDOWN_INTERVAL, broadcast_countdowns)
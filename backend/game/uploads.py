@@ -0,0 +1,355 @@
+"""
+Селфи: загрузка частями с продолжением и хранение по хэшу содержимого.
+
+На слабом Wi-Fi площадки файл в несколько мегабайт одним запросом рвётся
+и повторяется с нуля, а повторы плодили записи Selfie и файлы. Протокол:
+
+1. POST /api/selfie/upload/init {token, task, size, filename[, sha256]} —
+   upload_id, offset и рекомендуемый chunk_size. Если клиент знает sha256
+   и у игрока уже есть такое селфи, сразу возвращается оно.
+2. PUT /api/selfie/upload/<upload_id>, заголовок Upload-Offset, в теле —
+   байты части. Дописывает часть и отвечает новым offset; offset не с
+   конца принятого — 409 с текущим offset. GET того же адреса — сколько
+   принято (после обрыва).
+3. POST /api/selfie/upload/<upload_id>/finalize {token} — файл хэшируется
+   (sha256) и переносится в api/upload/sha256/<hh>/<hash>.<ext>. Тот же
+   файл того же игрока — существующее селфи без новой записи и файла;
+   повторный finalize отвечает тем же селфи.
+
+Части лежат в MEDIA_ROOT/upload_parts (переживают перезапуск, общие для
+воркеров), брошенные удаляются через UPLOAD_TTL. Части пишутся в пуле
+потоков, не в цикле событий. Загрузка одним запросом (upload_selfie)
+хранит файлы так же и тоже не создаёт дублей.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.http import HttpResponseNotAllowed, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+
+from .admission import rate_limited
+from .logs import log
+from .models import Selfie
+from .state import state_engine
+
+
+CHUNK_SIZE = 512 * 1024  # рекомендуемый размер части
+MAX_CHUNK_SIZE = 2 * 1024 * 1024  # меньше DATA_UPLOAD_MAX_MEMORY_SIZE (2.5 МБ по умолчанию)
+MAX_SELFIE_SIZE = getattr(settings, 'MAX_SELFIE_SIZE', 20 * 1024 * 1024)
+UPLOAD_TTL = 24 * 3600  # секунд до удаления брошенной загрузки
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png', 'webp', 'gif', 'heic', 'heif'}
+HASH_BLOCK = 1024 * 1024
+
+
+class UploadError(Exception):
+    """Ошибка загрузки: текст, HTTP-статус и доп. поля ответа (например, offset)"""
+
+    def __init__(self, message, status_code=status.HTTP_400_BAD_REQUEST, **extra):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.extra = extra
+
+
+def image_extension(filename):
+    ext = os.path.splitext(filename or '')[1].lstrip('.').lower()
+    return ext if ext in IMAGE_EXTENSIONS else None
+
+
+def content_name(digest, ext):
+    """Имя файла в хранилище по хэшу: один файл на одно содержимое"""
+    return f'api/upload/sha256/{digest[:2]}/{digest}.{ext}'
+
+
+def get_or_create_selfie(player, task, digest, name):
+    """(селфи, создано ли): тот же хэш у того же игрока — существующее селфи"""
+    existing = Selfie.objects.filter(player_id=player.id, content_hash=digest).first()
+    if existing is not None:
+        return existing, False
+    try:
+        with transaction.atomic():
+            selfie = Selfie.objects.create(
+                player=player, session_id=player.session_id, task=task, image=name, content_hash=digest,
+            )
+        return selfie, True
+    except IntegrityError:
+        # Параллельный повтор того же файла успел первым
+        return Selfie.objects.get(player_id=player.id, content_hash=digest), False
+
+
+def store_uploaded_selfie(player, task, uploaded):
+    """Селфи из файла, пришедшего одним запросом (multipart)"""
+    ext = image_extension(uploaded.name) or 'jpg'
+    digest = hashlib.sha256()
+    for chunk in uploaded.chunks():
+        digest.update(chunk)
+    digest = digest.hexdigest()
+    name = content_name(digest, ext)
+    if not default_storage.exists(name):
+        uploaded.seek(0)
+        name = default_storage.save(name, uploaded)
+    return get_or_create_selfie(player, task, digest, name)
+
+
+# --- Загрузки частями ---
+
+_locks = {}  # upload_id -> Lock: части одной загрузки дописываются по очереди
+_locks_lock = threading.Lock()
+
+
+def _upload_lock(upload_id):
+    with _locks_lock:
+        return _locks.setdefault(upload_id, threading.Lock())
+
+
+def _parts_dir():
+    return Path(settings.MEDIA_ROOT) / 'upload_parts'
+
+
+def _meta_path(upload_id):
+    return _parts_dir() / f'{upload_id}.json'
+
+
+def _part_path(upload_id):
+    return _parts_dir() / f'{upload_id}.part'
+
+
+def _received(upload_id):
+    part = _part_path(upload_id)
+    return part.stat().st_size if part.exists() else 0
+
+
+def _write_meta(upload_id, meta):
+    tmp = _meta_path(upload_id).with_suffix('.tmp')
+    tmp.write_text(json.dumps(meta))
+    os.replace(tmp, _meta_path(upload_id))
+
+
+def upload_key(upload_id):
+    """upload_id в каноническом виде (32 hex-символа) или None"""
+    try:
+        return uuid.UUID(hex=upload_id).hex
+    except (TypeError, ValueError):
+        return None
+
+
+def load_upload(upload_id):
+    """Описание загрузки или None (неизвестный upload_id)"""
+    try:
+        return json.loads(_meta_path(upload_id).read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _require_upload(upload_id):
+    """(канонический upload_id, описание) или 404"""
+    upload_id = upload_key(upload_id)
+    meta = load_upload(upload_id) if upload_id else None
+    if meta is None:
+        raise UploadError('Загрузка не найдена', status.HTTP_404_NOT_FOUND)
+    return upload_id, meta
+
+
+def remove_stale_uploads(now=None):
+    """Удалить загрузки без изменений дольше UPLOAD_TTL"""
+    now = now or time.time()
+    directory = _parts_dir()
+    if not directory.exists():
+        return
+    for meta in directory.glob('*.json'):
+        upload_id = meta.stem
+        part = _part_path(upload_id)
+        touched = max(meta.stat().st_mtime, part.stat().st_mtime if part.exists() else 0)
+        if now - touched > UPLOAD_TTL:
+            part.unlink(missing_ok=True)
+            meta.unlink(missing_ok=True)
+            with _locks_lock:
+                _locks.pop(upload_id, None)
+
+
+def create_upload(player, task, size, filename, sha256=None):
+    ext = image_extension(filename)
+    if ext is None:
+        raise UploadError(f'Поддерживаются изображения: {", ".join(sorted(IMAGE_EXTENSIONS))}')
+    if size <= 0 or size > MAX_SELFIE_SIZE:
+        raise UploadError(f'Размер файла должен быть от 1 байта до {MAX_SELFIE_SIZE // (1024 * 1024)} МБ')
+    remove_stale_uploads()
+    _parts_dir().mkdir(parents=True, exist_ok=True)
+    upload_id = uuid.uuid4().hex
+    _write_meta(upload_id, {
+        'player_id': str(player.id),
+        'task': task,
+        'size': size,
+        'ext': ext,
+        'sha256': sha256,
+        'created_at': time.time(),
+    })
+    return upload_id
+
+
+def append_chunk(upload_id, offset, read_body):
+    """Дописать часть с offset; read_body читает тело запроса. Возвращает новый offset."""
+    upload_id, meta = _require_upload(upload_id)
+    if meta.get('selfie_id'):
+        raise UploadError('Загрузка уже завершена', status.HTTP_409_CONFLICT, offset=meta['size'])
+    try:
+        data = read_body()
+    except RequestDataTooBig:
+        raise UploadError('Слишком большая часть', status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    if len(data) > MAX_CHUNK_SIZE:
+        raise UploadError('Слишком большая часть', status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    with _upload_lock(upload_id):
+        received = _received(upload_id)
+        if offset != received:
+            raise UploadError('Часть не с конца принятого', status.HTTP_409_CONFLICT, offset=received)
+        if received + len(data) > meta['size']:
+            raise UploadError('Часть выходит за размер файла', offset=received)
+        with _part_path(upload_id).open('ab') as f:
+            f.write(data)
+        return received + len(data)
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with path.open('rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _store_part(name, part):
+    """Перенести собранный файл в хранилище (без копирования, если хранилище локальное)"""
+    if default_storage.exists(name):
+        part.unlink(missing_ok=True)
+        return name
+    try:
+        target = Path(default_storage.path(name))
+    except NotImplementedError:
+        with part.open('rb') as f:
+            name = default_storage.save(name, File(f))
+        part.unlink(missing_ok=True)
+        return name
+    target.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(part, target)
+    return name
+
+
+def finalize_upload(upload_id, player):
+    """(селфи, создано ли) по полностью принятой загрузке"""
+    upload_id, meta = _require_upload(upload_id)
+    if meta['player_id'] != str(player.id):
+        raise UploadError('Загрузка не найдена', status.HTTP_404_NOT_FOUND)
+    with _upload_lock(upload_id):
+        meta = load_upload(upload_id)
+        if meta is None:
+            raise UploadError('Загрузка не найдена', status.HTTP_404_NOT_FOUND)
+        if meta.get('selfie_id'):
+            # Повторный finalize (ответ на первый потерялся)
+            return Selfie.objects.get(id=meta['selfie_id']), False
+        part = _part_path(upload_id)
+        received = _received(upload_id)
+        if received != meta['size']:
+            raise UploadError('Файл загружен не полностью', status.HTTP_409_CONFLICT, offset=received)
+        digest = _file_hash(part)
+        if meta.get('sha256') and meta['sha256'].lower() != digest:
+            part.unlink(missing_ok=True)
+            raise UploadError('Хэш файла не совпадает, загрузите заново', status.HTTP_422_UNPROCESSABLE_ENTITY)
+        existing = Selfie.objects.filter(player_id=player.id, content_hash=digest).first()
+        if existing is not None:
+            part.unlink(missing_ok=True)
+            selfie, created = existing, False
+        else:
+            name = _store_part(content_name(digest, meta['ext']), part)
+            selfie, created = get_or_create_selfie(player, meta['task'], digest, name)
+        _write_meta(upload_id, {**meta, 'selfie_id': str(selfie.id)})
+    return selfie, created
+
+
+def _player(token):
+    if not token:
+        raise UploadError('Токен игрока обязателен')
+    _, player = state_engine.by_token(token)
+    if player is None:
+        raise UploadError('Неверный токен игрока', status.HTTP_401_UNAUTHORIZED)
+    return player
+
+
+def _error_response(e):
+    return Response({'error': e.message, **e.extra}, status=e.status_code)
+
+
+@api_view(['POST'])
+@rate_limited('action')
+def init_selfie_upload(request):
+    """Начать загрузку селфи частями"""
+    from .views import publish_selfie
+
+    try:
+        player = _player(request.data.get('token'))
+        try:
+            size = int(request.data.get('size'))
+        except (TypeError, ValueError):
+            raise UploadError('size должен быть целым числом байт')
+        task = request.data.get('task', '')
+        sha256 = (request.data.get('sha256') or '').lower() or None
+        if sha256:
+            existing = Selfie.objects.filter(player_id=player.id, content_hash=sha256).first()
+            if existing is not None:
+                return Response({**publish_selfie(request, existing, player, created=False), 'upload_id': None})
+        upload_id = create_upload(player, task, size, request.data.get('filename'), sha256)
+    except UploadError as e:
+        return _error_response(e)
+    log('upload', 'selfie.upload_started', session=player.session.code, player=player.id,
+        upload_id=upload_id, size=size)
+    return Response({'upload_id': upload_id, 'offset': 0, 'chunk_size': CHUNK_SIZE}, status=status.HTTP_201_CREATED)
+
+
+@csrf_exempt
+async def selfie_upload_chunk(request, upload_id):
+    """PUT — дописать часть (заголовок Upload-Offset), GET — сколько байт принято"""
+    try:
+        if request.method == 'GET':
+            upload_id, meta = await sync_to_async(_require_upload, thread_sensitive=False)(upload_id)
+            received = await sync_to_async(_received, thread_sensitive=False)(upload_id)
+            return JsonResponse({'upload_id': upload_id, 'offset': received, 'size': meta['size'],
+                                 'selfie_id': meta.get('selfie_id')})
+        if request.method != 'PUT':
+            return HttpResponseNotAllowed(['GET', 'PUT'])
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+        except ValueError:
+            raise UploadError('Нужен заголовок Upload-Offset')
+        # Тело читается и пишется на диск в пуле потоков
+        offset = await sync_to_async(append_chunk, thread_sensitive=False)(upload_id, offset, lambda: request.body)
+    except UploadError as e:
+        return JsonResponse({'error': e.message, **e.extra}, status=e.status_code)
+    return JsonResponse({'upload_id': upload_id, 'offset': offset})
+
+
+@api_view(['POST'])
+@rate_limited('action')
+def finalize_selfie_upload(request, upload_id):
+    """Завершить загрузку частями: селфи по хэшу содержимого"""
+    from .views import publish_selfie
+
+    try:
+        player = _player(request.data.get('token'))
+        selfie, created = finalize_upload(upload_id, player)
+    except UploadError as e:
+        return _error_response(e)
+    return Response(publish_selfie(request, selfie, player, created),
+                    status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
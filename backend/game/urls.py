@@ -1,26 +1,40 @@
 from django.urls import path
-from . import views
+from . import sse, uploads, views
 
 urlpatterns = [
     # Админка
     path('admin/login', views.admin_login, name='admin_login'),
     path('admin/players', views.admin_players, name='admin_players'),
+    path('admin/players/export', views.admin_players_export, name='admin_players_export'),
     path('admin/player/<uuid:player_id>', views.admin_player_detail, name='admin_player_detail'),
     path('admin/player/<uuid:player_id>/points', views.admin_adjust_points, name='admin_adjust_points'),
+    path('admin/points/bulk', views.admin_bulk_adjust_points, name='admin_bulk_adjust_points'),
     path('admin/player/<uuid:player_id>/delete', views.admin_delete_player, name='admin_delete_player'),
     path('admin/rig', views.admin_create_rig, name='admin_create_rig'),
+    path('admin/admission', views.admin_admission_stats, name='admin_admission_stats'),
+    path('admin/analytics', views.admin_analytics, name='admin_analytics'),
 
     path('selfie/upload', views.upload_selfie, name='upload_selfie'),  # Важно: размещаем ПЕРЕД session для избежания конфликтов
+    path('selfie/upload/init', uploads.init_selfie_upload, name='init_selfie_upload'),
+    path('selfie/upload/<str:upload_id>', uploads.selfie_upload_chunk, name='selfie_upload_chunk'),
+    path('selfie/upload/<str:upload_id>/finalize', uploads.finalize_selfie_upload, name='finalize_selfie_upload'),
     path('audio/tracks', views.get_audio_tracks, name='get_audio_tracks'),
     path('session', views.create_session, name='create_session'),
     path('session/<str:code>', views.get_session_state, name='get_session_state'),
+    path('session/<str:code>/timeline', views.get_session_timeline, name='get_session_timeline'),
+    path('session/<str:code>/analytics', views.get_session_analytics, name='get_session_analytics'),
+    path('session/<str:code>/events', sse.session_events, name='session_events'),
     path('session/<str:code>/selfies', views.get_session_selfies, name='get_session_selfies'),
     path('session/<str:code>/join', views.join_session, name='join_session'),
     path('session/<str:code>/start', views.start_session, name='start_session'),
     path('progress', views.submit_progress, name='submit_progress'),
+    path('progress/batch', views.submit_progress_batch, name='submit_progress_batch'),
     path('crash/<str:code>/history', views.get_crash_history, name='get_crash_history'),
+    path('crash/<str:code>/stats', views.get_crash_stats, name='get_crash_stats'),
     path('crash/<str:code>/current', views.get_current_crash_game, name='get_current_crash_game'),
     path('crash/<str:code>/create', views.create_crash_game, name='create_crash_game'),
+    path('crash/<str:code>/chain', views.get_crash_chain, name='get_crash_chain'),
+    path('crash/<str:code>/verify', views.verify_crash_history, name='verify_crash_history'),
     path('crash/bet', views.place_crash_bet, name='place_crash_bet'),
     path('crash/cashout', views.cashout_crash_bet, name='cashout_crash_bet'),
     path('crash/<str:game_id>/finish', views.finish_crash_game, name='finish_crash_game'),
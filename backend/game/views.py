@@ -1,16 +1,20 @@
+import csv
+import json
 import secrets
 import string
 import uuid
 import os
 import random
-from datetime import timedelta
+from datetime import datetime, timedelta
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.conf import settings
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import F, Q
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from django.contrib.auth.hashers import check_password, make_password
@@ -26,7 +30,21 @@ from .models import (
     PointsTransaction,
     RigOverride,
 )
-from .serializers import SessionSerializer, PlayerSerializer, ProgressSerializer
+from .serializers import leaderboard_row, player_data, player_public_data, session_data
+from .crash import chain_pool, multiplier_at, verify_session_history
+from .crash_history import crash_history, HISTORY_SIZE
+from .crash_bets import bets_page, player_stats_cache, record_settlement, record_stake, PAGE_SIZE, MAX_PAGE_SIZE
+from .pagination import paginate
+from .snapshots import snapshot_recorder, replay, parse_time
+from .events import log_event, PROGRESS_FIELDS
+from .state import MisdirectedSession, state_engine
+from .admission import admission_stats, gated_join, rate_limited
+from .analytics import SessionAnalytics, analytics_cache
+from .timers import SESSION_LEVELS, schedule_crash_round, schedule_session, unschedule_session
+from .uploads import store_uploaded_selfie
+from .logs import log, log_error
+from .idempotency import idempotency_store, idempotent
+from .serving import current_worker, forwarded_client_ip, owns_session
 
 
 def generate_session_code():
@@ -42,7 +60,10 @@ def generate_player_token():
 def get_client_ip(request):
     """Извлекает IP из заголовков/соединения"""
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
+    if x_forwarded_for and current_worker() is not None:
+        # За роутером manage.py serve: его элемент последний, предыдущие прислал клиент
+        ip = forwarded_client_ip(x_forwarded_for)
+    elif x_forwarded_for:
         ip = x_forwarded_for.split(',')[0].strip()
     else:
         ip = request.META.get('REMOTE_ADDR')
@@ -85,6 +106,23 @@ def get_admin_from_request(request):
         return None
 
 
+def misdirected(session_codes):
+    """
+    421, если среди сессий есть обслуживаемые другим воркером manage.py serve.
+
+    Состояние сессии, её сокеты и пул цепочек живут в памяти воркера-владельца:
+    изменение в другом процессе потеряется или перетрётся его записью. Роутер
+    направляет запрос по X-Session-Code — его клиент и должен прислать.
+    session_codes читается только под роутером (можно передать ленивый queryset).
+    """
+    if current_worker() is None:
+        return None
+    foreign = sorted({code for code in session_codes if not owns_session(code)})
+    if not foreign:
+        return None
+    return Response({'error': MisdirectedSession.message, 'sessions': foreign}, status=MisdirectedSession.status_code)
+
+
 def ensure_default_admin():
     """Гарантируем наличие дефолтного админа admin/disooloo"""
     admin, created = AdminUser.objects.get_or_create(
@@ -119,43 +157,190 @@ def admin_login(request):
     })
 
 
+ADMIN_PLAYERS_PAGE_SIZE = 50
+ADMIN_PLAYERS_MAX_PAGE_SIZE = 200
+EXPORT_CHUNK_SIZE = 500
+
+# Поля сортировки списка игроков -> (поле/аннотация, парсер значения курсора)
+ADMIN_PLAYER_SORTS = {
+    'created_at': ('created_at', datetime.fromisoformat),
+    'last_seen': ('last_seen', datetime.fromisoformat),
+    'score': ('final_score_db', int),
+}
+
+ADMIN_PLAYER_EXPORT_FIELDS = [
+    'id', 'name', 'session_code', 'total_score', 'bonus_score', 'final_score', 'status',
+    'current_level', 'last_seen', 'is_connected', 'ip_address', 'device_type', 'keys_bought',
+]
+
+
 @api_view(['GET'])
-def admin_players(request):
-    """Список игроков для админки (опционально фильтр active и session)"""
-    admin_user = get_admin_from_request(request)
-    if not admin_user:
+def admin_admission_stats(request):
+    """Счётчики контроля нагрузки: пропущенные и отклонённые (429) запросы, повторы по Idempotency-Key"""
+    if not get_admin_from_request(request):
+        return Response({'error': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
+    return Response({**admission_stats.as_dict(), 'idempotency': idempotency_store.stats()})
+
+
+@api_view(['GET'])
+def admin_analytics(request):
+    """
+    Сводная аналитика по сессиям (слияние посессионных агрегатов).
+
+    ?session=CODE1,CODE2 — конкретные сессии, иначе созданные за ?days= дней (по умолчанию 30).
+    """
+    if not get_admin_from_request(request):
         return Response({'error': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
+    codes = [code.strip() for code in request.GET.get('session', '').split(',') if code.strip()]
+    if codes:
+        sessions = Session.objects.filter(code__in=codes)
+    else:
+        try:
+            days = int(request.GET.get('days', 30))
+        except ValueError:
+            return Response({'error': 'days должно быть числом'}, status=status.HTTP_400_BAD_REQUEST)
+        sessions = Session.objects.filter(created_at__gte=timezone.now() - timedelta(days=days))
+
+    total = SessionAnalytics()
+    count = 0
+    for session_id, code, session_status in sessions.values_list('id', 'code', 'status'):
+        # Загруженные сессии — из памяти, остальные — по журналу событий (завершённые кэшируются)
+        state = state_engine.loaded(code)
+        if state is not None:
+            with state.lock:
+                total.merge(state.analytics)
+        else:
+            total.merge(analytics_cache.get(session_id, finished=session_status == 'finished'))
+        count += 1
+    data = total.as_dict()
+    data['sessions'] = count
+    return Response(data)
+
 
+def _admin_players_queryset(request):
+    """Игроки для админки с фильтрами session, active и q (поиск по имени)"""
     session_code = request.GET.get('session')
     active_only = request.GET.get('active') in ['1', 'true', 'yes']
-    qs = Player.objects.all().select_related('session')
+    search = (request.GET.get('q') or '').strip()
+
+    qs = Player.objects.all().select_related('session').annotate(
+        final_score_db=F('total_score') + F('bonus_score') + F('role_buff')
+    )
     if session_code:
         qs = qs.filter(session__code=session_code)
-
-    now = timezone.now()
     if active_only:
-        active_threshold = now - timedelta(minutes=5)
+        active_threshold = timezone.now() - timedelta(minutes=5)
         qs = qs.filter(Q(is_connected=True) | Q(last_seen__gte=active_threshold))
+    if search:
+        qs = qs.filter(name__icontains=search)
+    return qs
+
+
+def _admin_player_row(p):
+    return {
+        'id': str(p.id),
+        'name': p.name,
+        'session_code': p.session.code,
+        'total_score': p.total_score,
+        'bonus_score': p.bonus_score,
+        'final_score': p.final_score,
+        'status': p.status,
+        'current_level': p.current_level,
+        'last_seen': p.last_seen.isoformat() if p.last_seen else None,
+        'is_connected': p.is_connected,
+        'ip_address': p.ip_address,
+        'device_type': p.device_type,
+        'keys_bought': p.keys_bought,
+    }
 
-    players = []
-    for p in qs.order_by('-created_at'):
-        players.append({
-            'id': str(p.id),
-            'name': p.name,
-            'session_code': p.session.code,
-            'total_score': p.total_score,
-            'bonus_score': p.bonus_score,
-            'final_score': p.final_score,
-            'status': p.status,
-            'current_level': p.current_level,
-            'last_seen': p.last_seen.isoformat() if p.last_seen else None,
-            'is_connected': p.is_connected,
-            'ip_address': p.ip_address,
-            'device_type': p.device_type,
-            'keys_bought': p.keys_bought,
-        })
 
-    return Response({'players': players})
+@api_view(['GET'])
+def admin_players(request):
+    """
+    Список игроков для админки (постранично).
+
+    Фильтры: session, active, q. Сортировка: sort=created_at|last_seen|score,
+    order=desc|asc. Следующая страница — cursor из next_cursor.
+    """
+    admin_user = get_admin_from_request(request)
+    if not admin_user:
+        return Response({'error': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
+
+    sort = request.GET.get('sort', 'created_at')
+    if sort not in ADMIN_PLAYER_SORTS:
+        return Response({'error': f'sort должен быть одним из: {", ".join(ADMIN_PLAYER_SORTS)}'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    order = 'asc' if request.GET.get('order') == 'asc' else 'desc'
+    try:
+        limit = min(max(int(request.GET.get('limit', ADMIN_PLAYERS_PAGE_SIZE)), 1), ADMIN_PLAYERS_MAX_PAGE_SIZE)
+    except (TypeError, ValueError):
+        limit = ADMIN_PLAYERS_PAGE_SIZE
+
+    field, parse = ADMIN_PLAYER_SORTS[sort]
+    try:
+        players, next_cursor = paginate(
+            _admin_players_queryset(request), field,
+            cursor=request.GET.get('cursor'), limit=limit,
+            descending=order == 'desc', parse=parse,
+        )
+    except ValueError:
+        return Response({'error': 'Неверный курсор'}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({
+        'players': [_admin_player_row(p) for p in players],
+        'next_cursor': next_cursor,
+        'sort': sort,
+        'order': order,
+    })
+
+
+@api_view(['GET'])
+def admin_players_export(request):
+    """Потоковая выгрузка игроков в CSV или NDJSON (as=csv|ndjson; format занят DRF)"""
+    admin_user = get_admin_from_request(request)
+    if not admin_user:
+        return Response({'error': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
+
+    export_format = request.GET.get('as', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return Response({'error': 'as должен быть csv или ndjson'}, status=status.HTTP_400_BAD_REQUEST)
+
+    qs = _admin_players_queryset(request).order_by('-created_at', '-id')
+    if export_format == 'ndjson':
+        content_type = 'application/x-ndjson; charset=utf-8'
+    else:
+        content_type = 'text/csv; charset=utf-8'
+
+    filename = f'players_{timezone.now().strftime("%Y%m%d_%H%M%S")}.{export_format}'
+    response = StreamingHttpResponse(_export_stream(qs, export_format), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+class _Echo:
+    """Псевдо-файл для csv.writer: возвращает строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
+async def _export_stream(qs, export_format):
+    """
+    Строки выгрузки по мере чтения из базы.
+
+    Генератор асинхронный: синхронный ASGI-обработчик Django сначала целиком
+    собирает в список. aiterator() читает курсором пачками, не загружая всю
+    таблицу в память.
+    """
+    writer = csv.DictWriter(_Echo(), fieldnames=ADMIN_PLAYER_EXPORT_FIELDS)
+    if export_format == 'csv':
+        yield writer.writeheader()
+    async for p in qs.aiterator(chunk_size=EXPORT_CHUNK_SIZE):
+        row = _admin_player_row(p)
+        if export_format == 'ndjson':
+            yield json.dumps(row, ensure_ascii=False) + '\n'
+        else:
+            yield writer.writerow(row)
 
 
 @api_view(['GET'])
@@ -165,7 +350,10 @@ def admin_player_detail(request, player_id):
     if not admin_user:
         return Response({'error': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
 
-    player = get_object_or_404(Player, id=player_id)
+    player = get_object_or_404(Player.objects.select_related('session'), id=player_id)
+    wrong_worker = misdirected([player.session.code])
+    if wrong_worker:
+        return wrong_worker
     transactions = [
         {
             'id': str(t.id),
@@ -224,27 +412,38 @@ def admin_adjust_points(request, player_id):
     if not admin_user:
         return Response({'error': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
 
-    player = get_object_or_404(Player, id=player_id)
+    wrong_worker = misdirected(Player.objects.filter(id=player_id).values_list('session__code', flat=True))
+    if wrong_worker:
+        return wrong_worker
+    state, player = state_engine.by_player_id(player_id)
+    if player is None:
+        raise Http404
     try:
         delta = int(request.data.get('delta', 0))
     except (TypeError, ValueError):
         return Response({'error': 'delta must be integer'}, status=status.HTTP_400_BAD_REQUEST)
 
-    reason = request.data.get('reason', '').strip() or None
+    try:
+        reason = _parse_reason(request.data.get('reason'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     is_hidden = bool(request.data.get('hidden', False))
 
-    player.bonus_score += delta
-    player.last_seen = timezone.now()
-    player.save(update_fields=['bonus_score', 'last_seen'])
+    with state.lock:
+        player.bonus_score += delta
+        player.last_seen = timezone.now()
+        state.mark_player(player, 'bonus_score', 'last_seen')
 
-    PointsTransaction.objects.create(
-        player=player,
-        session=player.session,
-        amount=delta,
-        reason=reason,
-        is_hidden=is_hidden,
-        admin=admin_user
-    )
+        PointsTransaction.objects.create(
+            player=player,
+            session=player.session,
+            amount=delta,
+            reason=reason,
+            is_hidden=is_hidden,
+            admin=admin_user,
+            balance_after=player.final_score
+        )
+        log_event(player.session_id, 'admin.adjusted', player.id, amount=delta, reason=reason, admin=admin_user.username)
 
     broadcast_player_update(player.session.code, player)
     broadcast_players_list(player.session.code)
@@ -253,10 +452,159 @@ def admin_adjust_points(request, player_id):
 
     return Response({
         'success': True,
-        'player': PlayerSerializer(player).data
+        'player': player_data(player)
+    })
+
+
+BULK_ADJUST_MAX_ITEMS = 1000
+
+
+def _parse_reason(value):
+    """Причина начисления: строка или отсутствует; иначе ValueError"""
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise ValueError('reason должен быть строкой')
+    return value.strip() or None
+
+
+def _parse_bulk_items(data):
+    """
+    Разбор тела bulk-запроса.
+
+    Либо items: [{player_id, delta, reason?}], либо filter: {session, connected?, status?}
+    с общими delta/reason. Возвращает (queryset игроков, {player_id: (delta, reason)} или None,
+    общий delta, общий reason) или бросает ValueError с текстом ошибки.
+    """
+    items = data.get('items')
+    player_filter = data.get('filter')
+    if bool(items) == bool(player_filter):
+        raise ValueError('Нужно передать либо items, либо filter')
+    common_reason = _parse_reason(data.get('reason'))
+
+    if items:
+        if not isinstance(items, list) or len(items) > BULK_ADJUST_MAX_ITEMS:
+            raise ValueError(f'items должен быть списком до {BULK_ADJUST_MAX_ITEMS} элементов')
+        changes = {}
+        for item in items:
+            if not isinstance(item, dict):
+                raise ValueError('Каждый элемент items должен быть объектом')
+            try:
+                player_id = uuid.UUID(str(item['player_id']))
+                delta = int(item.get('delta', 0))
+            except (KeyError, TypeError, ValueError):
+                raise ValueError('Каждый элемент items должен содержать player_id и целый delta')
+            reason = _parse_reason(item.get('reason'))
+            # Повторы одного игрока складываем в одну операцию
+            prev_delta, prev_reason = changes.get(player_id, (0, None))
+            changes[player_id] = (prev_delta + delta, prev_reason or reason)
+        return Player.objects.filter(id__in=list(changes)), changes, None, None
+
+    session_code = player_filter.get('session') if isinstance(player_filter, dict) else None
+    if not session_code or not isinstance(session_code, str):
+        raise ValueError('filter.session обязателен')
+    if not isinstance(player_filter.get('status') or '', str):
+        raise ValueError('filter.status должен быть строкой')
+    try:
+        delta = int(data.get('delta', 0))
+    except (TypeError, ValueError):
+        raise ValueError('delta must be integer')
+    qs = Player.objects.filter(session__code=session_code)
+    if player_filter.get('connected'):
+        qs = qs.filter(is_connected=True)
+    if player_filter.get('status'):
+        qs = qs.filter(status=player_filter['status'])
+    return qs, None, delta, common_reason
+
+
+@api_view(['POST'])
+def admin_bulk_adjust_points(request):
+    """Массовое начисление/списание баллов одной транзакцией"""
+    admin_user = get_admin_from_request(request)
+    if not admin_user:
+        return Response({'error': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
+
+    try:
+        qs, changes, common_delta, common_reason = _parse_bulk_items(request.data)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    wrong_worker = misdirected(qs.values_list('session__code', flat=True).distinct())
+    if wrong_worker:
+        return wrong_worker
+    is_hidden = bool(request.data.get('hidden', False))
+    now = timezone.now()
+
+    # Баланс меняется F()-выражениями в базе — состояние сессий перечитается после
+    session_ids = set(qs.values_list('session_id', flat=True))
+    with state_engine.detached(*session_ids), transaction.atomic():
+        player_ids = list(qs.values_list('id', flat=True))
+        if changes is None:
+            changes = {pid: (common_delta, common_reason) for pid in player_ids}
+            # Один UPDATE на всю выборку
+            Player.objects.filter(id__in=player_ids).update(
+                bonus_score=F('bonus_score') + common_delta, last_seen=now, version=F('version') + 1
+            )
+        else:
+            # Один UPDATE на каждое уникальное значение delta
+            by_delta = {}
+            for pid in player_ids:
+                by_delta.setdefault(changes[pid][0], []).append(pid)
+            for delta, ids in by_delta.items():
+                Player.objects.filter(id__in=ids).update(
+                    bonus_score=F('bonus_score') + delta, last_seen=now, version=F('version') + 1
+                )
+
+        players = list(Player.objects.filter(id__in=player_ids).select_related('session'))
+        PointsTransaction.objects.bulk_create([
+            PointsTransaction(
+                player=p,
+                session=p.session,
+                amount=changes[p.id][0],
+                reason=changes[p.id][1],
+                is_hidden=is_hidden,
+                admin=admin_user,
+                balance_after=p.final_score,
+            )
+            for p in players
+        ])
+    for p in players:
+        log_event(p.session_id, 'admin.adjusted', p.id, amount=changes[p.id][0], reason=changes[p.id][1],
+                  admin=admin_user.username)
+
+    # Одно сводное обновление на каждую затронутую сессию
+    by_session = {}
+    for p in players:
+        by_session.setdefault(p.session.code, []).append(p)
+    for session_code, session_players in by_session.items():
+        broadcast_players_list(session_code)
+        broadcast_leaderboard_update(session_code)
+        if not is_hidden:
+            _broadcast_balance_bulk(session_code, [
+                {'player_id': str(p.id), 'amount': changes[p.id][0], 'reason': changes[p.id][1]}
+                for p in session_players
+            ])
+
+    found = {p.id for p in players}
+    return Response({
+        'success': True,
+        'updated': len(players),
+        'sessions': sorted(by_session),
+        'missing': [str(pid) for pid in changes if pid not in found],
     })
 
 
+def _broadcast_balance_bulk(session_code, updates):
+    """Одно сообщение со всеми изменениями баланса в сессии"""
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(
+        f'session_{session_code}',
+        {
+            'type': 'player_balance_bulk_update',
+            'payload': {'updates': updates}
+        }
+    )
+
+
 @api_view(['DELETE'])
 def admin_delete_player(request, player_id):
     """Удаление игрока"""
@@ -264,13 +612,18 @@ def admin_delete_player(request, player_id):
     if not admin_user:
         return Response({'error': 'Unauthorized'}, status=status.HTTP_401_UNAUTHORIZED)
 
-    player = get_object_or_404(Player, id=player_id)
+    player = get_object_or_404(Player.objects.select_related('session'), id=player_id)
 
     # Сохраняем код сессии для обновления списков
     session_code = player.session.code
+    wrong_worker = misdirected([session_code])
+    if wrong_worker:
+        return wrong_worker
 
     # Удаляем игрока
-    player.delete()
+    with state_engine.detached(player.session_id):
+        player.delete()
+    log_event(player.session_id, 'player.deleted', player_id, admin=admin_user.username)
 
     # Отправляем обновления в сессию
     broadcast_players_list(session_code)
@@ -305,6 +658,9 @@ def admin_create_rig(request):
         return Response({'error': 'value должен быть числом'}, status=status.HTTP_400_BAD_REQUEST)
 
     session = get_object_or_404(Session, code=session_code)
+    wrong_worker = misdirected([session.code])
+    if wrong_worker:
+        return wrong_worker
     player = None
     if player_id:
         player = get_object_or_404(Player, id=player_id, session=session)
@@ -326,6 +682,7 @@ def admin_create_rig(request):
         apply_once=bool(apply_once),
         admin=admin_user
     )
+    chain_pool.mark_rig_pending(session.id)
 
     return Response({
         'success': True,
@@ -383,9 +740,12 @@ def create_session(request):
         min_players=request.data.get('min_players', 2),
         auto_start=request.data.get('auto_start', True),  # По умолчанию автостарт включен
     )
+    # Сразу генерируем цепочку Краша и публикуем её голову
+    chain_pool.ensure_chain(session)
     
-    serializer = SessionSerializer(session)
-    return Response(serializer.data, status=status.HTTP_201_CREATED)
+    data = session_data(session, players_count=0)
+    data['crash_chain'] = _crash_chain_info(session)
+    return Response(data, status=status.HTTP_201_CREATED)
 
 
 @api_view(['GET'])
@@ -425,42 +785,70 @@ def get_session_selfies(request, code):
 @api_view(['GET'])
 def get_session_state(request, code):
     """Получение состояния сессии"""
-    try:
-        session = Session.objects.get(code=code)
-    except Session.DoesNotExist:
+    state = state_engine.get(code)
+    if state is None:
         return Response(
             {'error': 'Сессия не найдена'},
             status=status.HTTP_404_NOT_FOUND
         )
-    serializer = SessionSerializer(session)
-    session_data = serializer.data
+    with state.lock:
+        data = state.session_data()
+        players = state.ordered_players()
     
     # Добавляем список игроков
-    players = session.players.all()
-    players_data = [
-        {
-            'id': str(p.id),
-            'name': p.name,
-            'status': p.status,
-            'current_level': p.current_level,
-            'total_score': p.total_score,
-            'bonus_score': p.bonus_score,
-            'role': p.role,
-            'role_buff': p.role_buff,
-            'final_score': p.final_score,
-            'token': p.token,
-        }
-        for p in players
-    ]
-    session_data['players'] = players_data
+    players_data = []
+    for p in players:
+        row = player_public_data(p)
+        row['token'] = p.token
+        players_data.append(row)
+    data['players'] = players_data
     
-    return Response(session_data)
+    return Response(data)
+
+
+@api_view(['GET'])
+def get_session_timeline(request, code):
+    """
+    История лидерборда для «повтора гонки».
+
+    Без параметров — все кадры по времени; ?at=<ISO-время> — рейтинг на этот момент.
+    """
+    session = get_object_or_404(Session, code=code)
+    at = request.GET.get('at')
+    if at:
+        try:
+            at = parse_time(at)
+        except ValueError:
+            return Response({'error': 'at должен быть в формате ISO 8601'}, status=status.HTTP_400_BAD_REQUEST)
+    frames = replay(session, at=at or None)
+    return Response({
+        'session_id': str(session.id),
+        'frames': frames,
+        'count': len(frames),
+    })
+
+
+@api_view(['GET'])
+def get_session_analytics(request, code):
+    """Аналитика уровней и мини-игр сессии: провалы, распределение очков, квантили времени"""
+    state = state_engine.get(code)
+    if state is None:
+        raise Http404
+    with state.lock:
+        data = state.analytics.as_dict()
+    data['session_id'] = str(state.session.id)
+    return Response(data)
 
 
 @api_view(['POST'])
+@rate_limited('join')
+@gated_join
 def join_session(request, code):
     """Регистрация игрока в сессии"""
-    session = get_object_or_404(Session, code=code)
+    state = state_engine.get(code)
+    if state is None:
+        raise Http404
+    session = state.session
     
     name = request.data.get('name', '').strip()
     if not name or len(name) < 2:
@@ -492,268 +880,540 @@ def join_session(request, code):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # Проверяем, не зарегистрирован ли уже этот device
-    try:
-        # Сначала пытаемся найти существующего игрока
+    auto_started = False
+    with state.lock:
+        # Проверяем, не зарегистрирован ли уже этот device
         try:
-            player = Player.objects.get(session=session, device_uuid=device_uuid)
-            created = False
-            # Игрок уже существует - разрешаем вернуться даже если сессия активна
-            # Обновляем имя и статус, если изменилось
-            if player.name != name:
-                player.name = name
-            # Если сессия активна, сохраняем текущий статус игрока, иначе ставим ready
-            if session.status == 'pending':
-                player.status = 'ready'
-            # Если сессия активна и игрок уже играл, не меняем его статус
-            player.ip_address = ip_address or player.ip_address
-            player.user_agent = user_agent or player.user_agent
-            player.device_type = device_type or player.device_type
-            player.last_seen = now
-            player.is_connected = True
-            player.save()
-        except Player.DoesNotExist:
-            # Игрок не найден - проверяем, можно ли создать нового
-            if session.status != 'pending':
-                return Response(
-                    {'error': 'Сессия уже началась или завершена. Новые игроки не могут присоединиться.'},
-                    status=status.HTTP_400_BAD_REQUEST
+            # Сначала пытаемся найти существующего игрока
+            player = next((p for p in state.players.values() if p.device_uuid == device_uuid), None)
+            if player is not None:
+                created = False
+                # Игрок уже существует - разрешаем вернуться даже если сессия активна
+                # Обновляем имя и статус, если изменилось
+                if player.name != name:
+                    player.name = name
+                # Если сессия активна, сохраняем текущий статус игрока, иначе ставим ready
+                if session.status == 'pending':
+                    state.update_player(player, status='ready')
+                # Если сессия активна и игрок уже играл, не меняем его статус
+                player.ip_address = ip_address or player.ip_address
+                player.user_agent = user_agent or player.user_agent
+                player.device_type = device_type or player.device_type
+                player.last_seen = now
+                player.is_connected = True
+                state.mark_player(player, 'name', 'ip_address', 'user_agent', 'device_type',
+                                  'last_seen', 'is_connected')
+            else:
+                # Игрок не найден - проверяем, можно ли создать нового
+                if session.status != 'pending':
+                    return Response(
+                        {'error': 'Сессия уже началась или завершена. Новые игроки не могут присоединиться.'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                # Игрок не найден, создаём нового
+                # Определяем роль и баф по имени
+                role, role_buff = get_player_role_and_buff(name)
+                
+                player = Player.objects.create(
+                    session=session,
+                    device_uuid=device_uuid,
+                    name=name,
+                    token=generate_player_token(),
+                    status='ready',
+                    role=role,
+                    role_buff=role_buff,
+                    ip_address=ip_address,
+                    user_agent=user_agent,
+                    device_type=device_type,
+                    last_seen=now,
+                    is_connected=True,
                 )
-            # Игрок не найден, создаём нового
-            # Определяем роль и баф по имени
-            role, role_buff = get_player_role_and_buff(name)
-            
-            player = Player.objects.create(
-                session=session,
-                device_uuid=device_uuid,
-                name=name,
-                token=generate_player_token(),
-                status='ready',
-                role=role,
-                role_buff=role_buff,
-                ip_address=ip_address,
-                user_agent=user_agent,
-                device_type=device_type,
-                last_seen=now,
-                is_connected=True,
+                state_engine.add_player(state, player)
+                created = True
+        except Exception as e:
+            log_error('request', 'player.join_failed', session=code)
+            return Response(
+                {'error': f'Ошибка при создании игрока: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
-            created = True
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return Response(
-            {'error': f'Ошибка при создании игрока: {str(e)}'},
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        
+        log_event(session.id, 'player.joined', player.id, name=player.name, device_uuid=player.device_uuid,
+                  role=player.role, role_buff=player.role_buff, created=created)
+        
+        # Проверяем, можно ли автоматически начать игру
+        players_count = sum(1 for p in state.players.values() if p.status == 'ready')
+        if session.auto_start and players_count >= session.min_players and session.status == 'pending':
+            # Автоматически начинаем игру
+            _start_session_state(state)
+            log_event(session.id, 'session.started', auto=True)
+            auto_started = True
+        
+        player_payload = player_data(player)
     
     # Отправляем обновление через WebSocket
     broadcast_players_list(session.code)
     broadcast_leaderboard_update(session.code)
     
-    # Проверяем, можно ли автоматически начать игру
-    players_count = session.players.filter(status='ready').count()
-    if session.auto_start and players_count >= session.min_players and session.status == 'pending':
-        # Автоматически начинаем игру
-        session.status = 'active'
-        session.started_at = timezone.now()
-        session.save()
-        session.players.update(status='playing', current_level='green')
+    if auto_started:
         broadcast_session_state(session.code)
         broadcast_players_list(session.code)
-        broadcast_leaderboard_update(session.code)
+        broadcast_leaderboard_update(session.code, snapshot_reason='started')
         broadcast_game_event(session.code, 'game.started', {
             'message': 'Игра началась! Начинаем с зелёного уровня.'
         })
     
-    serializer = PlayerSerializer(player)
-    return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+    return Response(player_payload, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+def _start_session_state(state):
+    """Старт сессии в памяти: все игроки переходят на зелёный уровень, запускаются таймеры уровней"""
+    session = state.session
+    session.status = 'active'
+    session.started_at = timezone.now()
+    state.mark_session('status', 'started_at')
+    for p in state.players.values():
+        state.update_player(p, status='playing', current_level='green')
+    schedule_session(session)
+
+
+def _finish_session_state(state, **event_data):
+    """Завершение сессии в памяти (под state.lock)"""
+    session = state.session
+    session.status = 'finished'
+    session.ended_at = timezone.now()
+    state.mark_session('status', 'ended_at')
+    log_event(session.id, 'session.finished', **event_data)
+    unschedule_session(session)
+
+
+def _announce_session_finished(state, message):
+    """Финальный кадр лидерборда и рассылка о завершении (вне state.lock)"""
+    snapshot_recorder.observe(state.session.id, _build_leaderboard(state), reason='finished')
+    broadcast_session_state(state.session.code)
+    broadcast_game_event(state.session.code, 'game.finished', {'message': message})
+
+
+def expire_level(session_code, level):
+    """
+    Таймер конца уровня: игроки, не дошедшие дальше level, переводятся на
+    следующий уровень; после красного игроки завершают игру, сессия — тоже.
+    """
+    state = state_engine.get(session_code)
+    if state is None:
+        return
+    session = state.session
+    last = level == SESSION_LEVELS[-1]
+    with state.lock:
+        if session.status != 'active':
+            return
+        position = SESSION_LEVELS.index(level)
+        moved = []
+        for p in state.players.values():
+            if p.status != 'playing' or p.current_level in SESSION_LEVELS[position + 1:]:
+                continue
+            if last:
+                state.update_player(p, status='done', current_level='red')
+            else:
+                state.update_player(p, current_level=SESSION_LEVELS[position + 1])
+            moved.append(p.id)
+        if moved:
+            log_event(session.id, 'level.expired', level=level, players=moved,
+                      next_level=None if last else SESSION_LEVELS[position + 1])
+        session_finished = state.all_finished
+        if session_finished:
+            _finish_session_state(state, reason='timeout')
+
+    if moved:
+        broadcast_players_list(session_code)
+        broadcast_leaderboard_update(session_code, snapshot_reason='level')
+    broadcast_game_event(session_code, 'level.expired', {'level': level})
+    if session_finished:
+        _announce_session_finished(state, 'Время вышло! Игра завершена.')
+
+
+def close_crash_betting(session_code, game_id):
+    """Таймер конца фазы ставок раунда Краш"""
+    broadcast_game_event(session_code, 'crash.betting_closed', {'game_id': str(game_id)})
 
 
 @api_view(['POST'])
 def start_session(request, code):
     """Старт игровой сессии"""
-    session = get_object_or_404(Session, code=code)
-    
-    if session.status != 'pending':
-        return Response(
-            {'error': 'Сессия уже началась или завершена'},
-            status=status.HTTP_400_BAD_REQUEST
-        )
+    state = state_engine.get(code)
+    if state is None:
+        raise Http404
+    session = state.session
     
-    players_count = session.players.count()
-    if players_count < session.min_players:
-        return Response(
-            {'error': f'Недостаточно игроков. Минимум: {session.min_players}'},
-            status=status.HTTP_400_BAD_REQUEST
-        )
-    
-    session.status = 'active'
-    session.started_at = timezone.now()
-    session.save()
-    
-    # Обновляем статус всех игроков
-    session.players.update(status='playing', current_level='green')
+    with state.lock:
+        if session.status != 'pending':
+            return Response(
+                {'error': 'Сессия уже началась или завершена'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        players_count = len(state.players)
+        if players_count < session.min_players:
+            return Response(
+                {'error': f'Недостаточно игроков. Минимум: {session.min_players}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Обновляем статус сессии и всех игроков
+        _start_session_state(state)
+        log_event(session.id, 'session.started', auto=False)
+        session_data = state.session_data()
     
     # Отправляем события через WebSocket
     broadcast_session_state(session.code)
     broadcast_players_list(session.code)
-    broadcast_leaderboard_update(session.code)
+    broadcast_leaderboard_update(session.code, snapshot_reason='started')
     broadcast_game_event(session.code, 'game.started', {
         'message': 'Игра началась! Начинаем с зелёного уровня.'
     })
     
-    serializer = SessionSerializer(session)
-    return Response(serializer.data)
+    return Response(session_data)
 
 
-@api_view(['POST'])
-def submit_progress(request):
-    """Отправка результата уровня или мини-игры"""
-    token = request.data.get('token')
-    if not token:
-        return Response(
-            {'error': 'Токен игрока обязателен'},
-            status=status.HTTP_400_BAD_REQUEST
-        )
-    
+class ActionError(Exception):
+    """Ошибка игрового действия: текст, HTTP-статус и доп. поля ответа (общая для REST и WebSocket)"""
+
+    def __init__(self, message, status_code=status.HTTP_400_BAD_REQUEST, **extra):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.extra = extra
+
+
+def _check_version(player, data):
+    """
+    Compare-and-set по версии игрока.
+
+    Если клиент прислал version, она должна совпадать с текущей, иначе —
+    409 с актуальными версией и состоянием игрока для повтора запроса.
+    Вызывается под state.lock.
+    """
+    expected = data.get('version')
+    if expected is None:
+        return
     try:
-        player = Player.objects.get(token=token)
-    except Player.DoesNotExist:
-        return Response(
-            {'error': 'Неверный токен игрока'},
-            status=status.HTTP_401_UNAUTHORIZED
+        expected = int(expected)
+    except (TypeError, ValueError):
+        raise ActionError('version должна быть числом', status.HTTP_400_BAD_REQUEST)
+    if expected != player.version:
+        raise ActionError(
+            'Состояние игрока изменилось, повторите запрос',
+            status.HTTP_409_CONFLICT,
+            conflict=True,
+            version=player.version,
+            player=player_data(player),
         )
-    
+
+
+def _run_action(action, data, unexpected_status=None):
+    """Игровое действие для REST-вьюхи; unexpected_status — ответ на прочие исключения"""
+    try:
+        return Response(action(data))
+    except ActionError as e:
+        return Response({'error': e.message, **e.extra}, status=e.status_code)
+    except MisdirectedSession:
+        raise
+    except Exception as e:
+        if unexpected_status is None:
+            raise
+        log_error('request', action.__name__)
+        return Response({'error': str(e)}, status=unexpected_status)
+
+
+# Система баллов: зеленый 1б, желтый 5б, красный 10б, бонус 15б
+LEVEL_POINTS = {
+    'green': 1,
+    'yellow': 5,
+    'red': 10,
+}
+# Результатов в одном пакете (POST /api/progress/batch)
+MAX_BATCH_RESULTS = 50
+
+
+def _is_casino(data):
+    """Бонусные игры разрешены и вне активной основной игры"""
+    return data.get('is_minigame', False) or data.get('level') in ('bonus', 'slots')
+
+
+class _ResultChanges:
+    """
+    Изменения от результатов уровней, ещё не применённые к состоянию.
+
+    _apply_result только копит их: поля игрока, прогресс уровней, события
+    журнала и записи аналитики; _commit_changes применяет всё разом, поэтому
+    ошибка в середине пакета не оставляет половину результатов в состоянии.
+    """
+
+    def __init__(self, player):
+        self.player = player
+        self.fields = {}
+        self.progress = {}
+        self.events = []
+        self.analytics = []
+
+    def current(self, field):
+        return self.fields.get(field, getattr(self.player, field))
+
+    def previous_score(self, state, level):
+        """Счёт уровня с учётом ещё не применённых результатов (0, если уровень не завершён)"""
+        if level in self.progress:
+            return self.progress[level]['score']
+        progress = state.progress.get((self.player.id, level))
+        return progress.score if progress is not None and progress.status == 'completed' else 0
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _validate_result(data):
+    """Типы полей результата — до любых изменений состояния; иначе ActionError 400"""
+    if not _is_number(data.get('score', 0)):
+        raise ActionError('score должен быть числом', status.HTTP_400_BAD_REQUEST)
+    if not _is_number(data.get('time_spent_ms', 0)):
+        raise ActionError('time_spent_ms должен быть числом', status.HTTP_400_BAD_REQUEST)
+    if not isinstance(data.get('details', {}), dict):
+        raise ActionError('details должен быть объектом', status.HTTP_400_BAD_REQUEST)
+
+
+def _apply_result(state, player, data, now, changes):
+    """
+    Учесть один результат уровня или мини-игры в changes. Вызывается под state.lock.
+
+    Состояние не меняется: поля игрока (total_score, bonus_score,
+    current_level, status), прогресс уровня, события и аналитика копятся в
+    changes — их применяет _commit_changes, один раз на запрос или на весь пакет.
+    """
+    _validate_result(data)
+    session = state.session
+    level = data.get('level')
+    score = data.get('score', 0)
+    time_spent_ms = data.get('time_spent_ms', 0)
+    details = data.get('details', {})
+    is_minigame = data.get('is_minigame', False)
+    current = changes.current
+
+    if not _is_casino(data) and session.status != 'active':
+        raise ActionError('Игра не активна', status.HTTP_400_BAD_REQUEST)
+
+    if is_minigame or level == 'bonus':
+        # Мини-игра/бонусная игра: добавляем к бонусным очкам
+        changes.fields['bonus_score'] = current('bonus_score') + score  # Используем переданный score
+        changes.events.append(('bonus.added', dict(amount=score, level=level,
+                                                   time_spent_ms=time_spent_ms, details=details)))
+        changes.analytics.append((level, score, time_spent_ms, details))
+        return
+
+    # Обычный уровень
+    if level not in ['green', 'yellow', 'red']:
+        raise ActionError(f'Неверный уровень: {level}. Ожидается green, yellow, red или bonus с is_minigame=true', status.HTTP_400_BAD_REQUEST)
+
+    # Обновляем общий счёт и уровень игрока
+    # Используем систему баллов: базовые очки умножаем на коэффициент уровня
+    base_score = score  # Количество выполненных заданий
+    level_multiplier = LEVEL_POINTS.get(level, 1)
+    final_score = base_score * level_multiplier
+
+    # Новый прогресс или обновление существующего (если игрок переиграл)
+    # Общий счёт — сумма завершённых уровней, меняем его на разницу старого и нового счёта
+    previous_score = changes.previous_score(state, level)
+    changes.progress[level] = dict(status='completed', score=final_score, time_spent_ms=time_spent_ms,
+                                   details=details, completed_at=now)
+
+    # Переход на следующий уровень только если все игры уровня завершены
+    # Проверяем количество завершенных игр в details
+    game_number = details.get('game')
+    player_level, player_status = current('current_level'), current('status')
+    current_level, new_status = player_level, player_status
+    if game_number:
+        # Это одна из игр уровня, проверяем завершенность всего уровня
+        if level == 'green' and game_number == 3:
+            # Все 3 игры зеленого уровня завершены
+            current_level = 'yellow'
+        elif level == 'yellow' and game_number == 3:
+            # Все 3 игры желтого уровня завершены
+            current_level = 'red'
+        elif level == 'red' and game_number == 3:
+            # Все 3 игры красного уровня завершены
+            new_status = 'done'
+            current_level = 'red'
+    # Если game_number нет, не меняем уровень (старая логика для совместимости)
+    # Уровень не откатывается назад: таймер мог перевести игрока дальше, пока шёл запрос
+    if player_level in SESSION_LEVELS and current_level in SESSION_LEVELS and (
+        SESSION_LEVELS.index(current_level) < SESSION_LEVELS.index(player_level)
+    ):
+        current_level = player_level
+    if player_status == 'done':
+        new_status = 'done'
+
+    changes.fields['total_score'] = current('total_score') + final_score - previous_score
+    changes.fields['current_level'] = current_level
+    changes.fields['status'] = new_status
+    changes.events.append(('progress.submitted', dict(level=level, score=final_score,
+                                                      raw_score=score, time_spent_ms=time_spent_ms, details=details,
+                                                      current_level=current_level, status=new_status)))
+    changes.analytics.append((level, score, time_spent_ms, details))
+
+
+def _commit_changes(state, player, changes):
+    """
+    Применить накопленное: прогресс уровней, события, аналитику и поля игрока
+    одним update_player; True, если сменился уровень или статус
+    """
+    for level, fields in changes.progress.items():
+        progress = state.get_progress(player, level)
+        for field, value in fields.items():
+            setattr(progress, field, value)
+        state.mark_progress(progress)
+    for event, fields in changes.events:
+        log_event(state.session.id, event, player.id, **fields)
+    for record in changes.analytics:
+        state.analytics.record(*record)
+    if not changes.fields:
+        return False
+    level_changed = (
+        changes.fields.get('current_level', player.current_level) != player.current_level
+        or changes.fields.get('status', player.status) != player.status
+    )
+    state.update_player(player, **changes.fields)
+    return level_changed
+
+
+def _touch_player(state, player, now):
     # Обновляем активность игрока
-    player.last_seen = timezone.now()
+    player.last_seen = now
     player.is_connected = True
-    player.save(update_fields=['last_seen', 'is_connected'])
+    state.mark_player(player, 'last_seen', 'is_connected')
 
-    session = player.session
-    # Для казино (бонусных игр) разрешаем обновление даже если основная игра не активна
-    is_minigame = request.data.get('is_minigame', False)
-    level = request.data.get('level')
-    is_casino = is_minigame or level == 'bonus' or level == 'slots'
-    
-    if not is_casino and session.status != 'active':
-        return Response(
-            {'error': 'Игра не активна'},
-            status=status.HTTP_400_BAD_REQUEST
-        )
-    
-    level = request.data.get('level')
-    score = request.data.get('score', 0)
-    time_spent_ms = request.data.get('time_spent_ms', 0)
-    details = request.data.get('details', {})
-    is_minigame = request.data.get('is_minigame', False)
+
+def _finish_if_done(state):
+    """Проверяем, завершена ли игра (все игроки прошли красный уровень) — по счётчику, без обхода игроков"""
+    if state.all_finished and state.session.status == 'active':
+        _finish_session_state(state)
+        return True
+    return False
+
+
+def _broadcast_progress(state, player, level_changed, session_finished):
+    """Обновления после результатов игрока — одни на запрос или на пакет"""
+    code = state.session.code
+    broadcast_player_update(code, player)
+    broadcast_players_list(code)  # Обновляем список игроков с актуальными очками
+    broadcast_leaderboard_update(code, snapshot_reason='level' if level_changed else None)
+    if session_finished:
+        _announce_session_finished(state, 'Все игроки завершили игру!')
+
+
+def perform_submit_progress(data):
+    """Отправка результата уровня или мини-игры"""
+    token = data.get('token')
+    if not token:
+        raise ActionError('Токен игрока обязателен', status.HTTP_400_BAD_REQUEST)
     
-    # Система баллов: зеленый 1б, желтый 5б, красный 10б, бонус 15б
-    level_points = {
-        'green': 1,
-        'yellow': 5,
-        'red': 10,
-    }
+    # Игрок и сессия — из состояния в памяти, запись в базу отложенная
+    state, player = state_engine.by_token(token)
+    if player is None:
+        raise ActionError('Неверный токен игрока', status.HTTP_401_UNAUTHORIZED)
     
-    if is_minigame or level == 'bonus':
-        # Мини-игра/бонусная игра: добавляем к бонусным очкам
-        player.bonus_score += score  # Используем переданный score
-        player.save()
-        # Отправляем обновления через WebSocket
-        broadcast_player_update(session.code, player)
-        broadcast_players_list(session.code)  # Обновляем список игроков с актуальными очками
-        broadcast_leaderboard_update(session.code)
-    else:
-        # Обычный уровень
-        if level not in ['green', 'yellow', 'red']:
-            return Response(
-                {'error': f'Неверный уровень: {level}. Ожидается green, yellow, red или bonus с is_minigame=true'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        progress, created = Progress.objects.get_or_create(
-            player=player,
-            level=level,
-            defaults={
-                'status': 'completed',
-                'score': score,
-                'time_spent_ms': time_spent_ms,
-                'details': details,
-                'completed_at': timezone.now(),
-            }
-        )
-        
-        if not created:
-            # Обновляем существующий прогресс (если игрок переиграл)
-            progress.score = score
-            progress.time_spent_ms = time_spent_ms
-            progress.details = details
-            progress.status = 'completed'
-            progress.completed_at = timezone.now()
-            progress.save()
-        
-        # Обновляем общий счёт и уровень игрока
-        # Используем систему баллов: базовые очки умножаем на коэффициент уровня
-        base_score = score  # Количество выполненных заданий
-        level_multiplier = level_points.get(level, 1)
-        final_score = base_score * level_multiplier
-        
-        progress.score = final_score
-        progress.save()
-        
-        # Пересчитываем общий счёт из всех завершённых уровней
-        player.total_score = sum(p.score for p in player.progresses.filter(status='completed'))
-        
-        # Переход на следующий уровень только если все игры уровня завершены
-        # Проверяем количество завершенных игр в details
-        game_number = details.get('game')
-        if game_number:
-            # Это одна из игр уровня, проверяем завершенность всего уровня
-            if level == 'green' and game_number == 3:
-                # Все 3 игры зеленого уровня завершены
-                player.current_level = 'yellow'
-            elif level == 'yellow' and game_number == 3:
-                # Все 3 игры желтого уровня завершены
-                player.current_level = 'red'
-            elif level == 'red' and game_number == 3:
-                # Все 3 игры красного уровня завершены
-                player.status = 'done'
-                player.current_level = 'red'
-        # Если game_number нет, не меняем уровень (старая логика для совместимости)
-        
-        player.save()
+    with state.lock:
+        _check_version(player, data)
+        now = timezone.now()
+        _touch_player(state, player, now)
+        changes = _ResultChanges(player)
+        _apply_result(state, player, data, now, changes)
+        level_changed = _commit_changes(state, player, changes)
+        session_finished = _finish_if_done(state)
+        player_payload = player_data(player)
     
     # Отправляем обновления через WebSocket
-    broadcast_player_update(session.code, player)
-    broadcast_players_list(session.code)  # Обновляем список игроков с актуальными очками
-    broadcast_leaderboard_update(session.code)
-    
-    # Проверяем, завершена ли игра (все игроки прошли красный уровень)
-    if all(p.status == 'done' or p.current_level == 'red' for p in session.players.all()):
-        session.status = 'finished'
-        session.ended_at = timezone.now()
-        session.save()
-        broadcast_session_state(session.code)
-        broadcast_game_event(session.code, 'game.finished', {
-            'message': 'Все игроки завершили игру!'
-        })
+    _broadcast_progress(state, player, level_changed, session_finished)
     
-    return Response({
+    return {
         'success': True,
-        'player': PlayerSerializer(player).data
-    })
+        'player': player_payload
+    }
+
+
+def perform_submit_progress_batch(data):
+    """
+    Пакет результатов одного игрока по порядку (например, накопленных без сети).
+
+    Все результаты применяются под одной блокировкой состояния и попадают в
+    одну отложенную запись; счёт игрока пересчитывается и рассылается один раз.
+    Ошибочный результат не прерывает пакет — у каждого свой статус в results.
+    Изменения применяются после разбора всего пакета: если он оборвался
+    исключением, состояние игрока не меняется.
+    """
+    token = data.get('token')
+    if not token:
+        raise ActionError('Токен игрока обязателен', status.HTTP_400_BAD_REQUEST)
+    items = data.get('results')
+    if not isinstance(items, list) or not items:
+        raise ActionError('results должен быть непустым списком', status.HTTP_400_BAD_REQUEST)
+    if len(items) > MAX_BATCH_RESULTS:
+        raise ActionError(f'Не больше {MAX_BATCH_RESULTS} результатов за раз', status.HTTP_400_BAD_REQUEST)
+
+    state, player = state_engine.by_token(token)
+    if player is None:
+        raise ActionError('Неверный токен игрока', status.HTTP_401_UNAUTHORIZED)
+
+    results = []
+    with state.lock:
+        _check_version(player, data)
+        now = timezone.now()
+        _touch_player(state, player, now)
+        changes = _ResultChanges(player)
+        for idx, item in enumerate(items):
+            if not isinstance(item, dict):
+                results.append({'index': idx, 'status': status.HTTP_400_BAD_REQUEST, 'error': 'Результат должен быть объектом'})
+                continue
+            try:
+                _apply_result(state, player, item, now, changes)
+            except ActionError as e:
+                results.append({'index': idx, 'status': e.status_code, 'error': e.message, **e.extra})
+            else:
+                results.append({'index': idx, 'status': status.HTTP_200_OK})
+        level_changed = _commit_changes(state, player, changes)
+        session_finished = _finish_if_done(state)
+        player_payload = player_data(player)
+
+    applied = sum(1 for result in results if result['status'] == status.HTTP_200_OK)
+    if applied:
+        _broadcast_progress(state, player, level_changed, session_finished)
+
+    return {
+        'success': True,
+        'applied': applied,
+        'results': results,
+        'player': player_payload,
+    }
+
+
+@api_view(['POST'])
+@idempotent('submit_progress')
+@rate_limited('action')
+def submit_progress(request):
+    """Отправка результата уровня или мини-игры"""
+    return _run_action(perform_submit_progress, request.data)
+
+
+@api_view(['POST'])
+@idempotent('submit_progress_batch')
+@rate_limited('action')
+def submit_progress_batch(request):
+    """Пакет результатов уровней и мини-игр одного игрока"""
+    return _run_action(perform_submit_progress_batch, request.data)
 
 
 @api_view(['POST'])
+@idempotent('upload_selfie')
+@rate_limited('action')
 def upload_selfie(request):
     """Загрузка селфи игрока"""
-    print("=" * 50)
-    print("📸 upload_selfie вызван!")
-    print(f"Method: {request.method}")
-    print(f"Path: {request.path}")
-    print(f"POST data keys: {list(request.POST.keys())}")
-    print(f"FILES keys: {list(request.FILES.keys())}")
-    print("=" * 50)
-    
     # Для FormData используем request.POST для текстовых данных
     token = request.POST.get('token') or request.data.get('token')
     if not token:
@@ -763,14 +1423,13 @@ def upload_selfie(request):
         )
     
     try:
-        player = Player.objects.get(token=token)
+        player = Player.objects.select_related('session').get(token=token)
     except Player.DoesNotExist:
         return Response(
             {'error': 'Неверный токен игрока'},
             status=status.HTTP_401_UNAUTHORIZED
         )
     
-    session = player.session
     task = request.POST.get('task', '') or request.data.get('task', '')
     image = request.FILES.get('image')
     
@@ -780,16 +1439,13 @@ def upload_selfie(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # Создаем запись о селфи (id будет сгенерирован автоматически)
-    selfie = Selfie(
-        player=player,
-        session=session,
-        task=task
-    )
-    selfie.id = uuid.uuid4()  # Генерируем ID заранее для использования в имени файла
-    selfie.image = image  # Присваиваем изображение (путь будет сгенерирован функцией selfie_upload_path)
-    selfie.save()
-    
+    # Файл хранится по хэшу содержимого: повтор того же файла возвращает существующее селфи
+    selfie, created = store_uploaded_selfie(player, task, image)
+    return Response(publish_selfie(request, selfie, player, created))
+
+
+def publish_selfie(request, selfie, player, created):
+    """Ответ на загрузку селфи; о новом селфи сразу сообщаем в группу сессии"""
     # Формируем полный URL для изображения
     # Используем host из запроса, который уже содержит правильный IP для локальной сети
     protocol = request.scheme or 'http'
@@ -804,29 +1460,31 @@ def upload_selfie(request):
             host = http_host
     
     image_url = f"{protocol}://{host}{selfie.image.url}"
-    print(f"📸 Сформирован URL для селфи: {image_url}")
+    log('upload', 'selfie.stored', session=player.session.code, player=player.id,
+        selfie_id=selfie.id, task=selfie.task, duplicate=not created)
     
-    # Отправляем событие через WebSocket СРАЗУ
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f'session_{session.code}',
-        {
-            'type': 'selfie_uploaded',
-            'payload': {
-                'player_id': str(player.id),
-                'player_name': player.name,
-                'task': task,
-                'image_url': image_url,
-                'selfie_id': str(selfie.id),
+    if created:
+        channel_layer = get_channel_layer()
+        async_to_sync(channel_layer.group_send)(
+            f'session_{player.session.code}',
+            {
+                'type': 'selfie_uploaded',
+                'payload': {
+                    'player_id': str(player.id),
+                    'player_name': player.name,
+                    'task': selfie.task,
+                    'image_url': image_url,
+                    'selfie_id': str(selfie.id),
+                }
             }
-        }
-    )
+        )
     
-    return Response({
+    return {
         'success': True,
         'selfie_id': str(selfie.id),
-        'image_url': image_url
-    })
+        'image_url': image_url,
+        'duplicate': not created,
+    }
 
 
 @api_view(['GET'])
@@ -880,166 +1538,127 @@ def get_audio_tracks(request):
 
 @api_view(['GET'])
 def get_crash_history(request, code):
-    """Получение истории игр Краш для сессии"""
-    try:
-        session = Session.objects.get(code=code)
-    except Session.DoesNotExist:
+    """Получение истории игр Краш для сессии (из буфера в памяти)"""
+    stats = crash_history.get(code)
+    if stats is None:
         return Response(
             {'error': 'Сессия не найдена'},
             status=status.HTTP_404_NOT_FOUND
         )
     
     try:
-        # Получаем последние 4 игры (только завершенные)
-        games = CrashGame.objects.filter(session=session, ended_at__isnull=False).order_by('-started_at')[:4]
-        
-        history = []
-        for game in games:
-            history.append({
-                'multiplier': game.multiplier,
-                'started_at': game.started_at.isoformat() if game.started_at else None
-            })
-        
-        return Response({
-            'history': history,
-            'count': len(history)
-        })
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
+        limit = int(request.GET.get('limit', 4))
+    except (TypeError, ValueError):
+        limit = 4
+    # Последние игры (только завершенные), по умолчанию 4
+    history = [
+        {'multiplier': item['multiplier'], 'started_at': item['started_at']}
+        for item in stats.history(max(0, min(limit, HISTORY_SIZE)))
+    ]
+    
+    return Response({
+        'history': history,
+        'count': len(history)
+    })
+
+
+@api_view(['GET'])
+def get_crash_stats(request, code):
+    """Статистика раундов Краш: медиана, распределение, серии"""
+    stats = crash_history.get(code)
+    if stats is None:
         return Response(
-            {'error': f'Ошибка получения истории: {str(e)}'},
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            {'error': 'Сессия не найдена'},
+            status=status.HTTP_404_NOT_FOUND
         )
+    return Response(stats.as_dict())
 
 
 @api_view(['GET'])
 def get_current_crash_game(request, code):
     """Получение текущей активной игры Краш"""
-    try:
-        session = Session.objects.get(code=code)
-    except Session.DoesNotExist:
+    state = state_engine.get(code)
+    if state is None:
         return Response(
             {'error': 'Сессия не найдена'},
             status=status.HTTP_404_NOT_FOUND
         )
     
-    try:
-        # Ищем активную игру (без ended_at)
-        game = CrashGame.objects.filter(session=session, ended_at__isnull=True).latest('started_at')
-        return Response({
-            'game_id': str(game.id),
-            'multiplier': game.multiplier,
-            'started_at': game.started_at.isoformat() if game.started_at else None,
-            'is_active': True,
-            'duration_seconds': game.duration_seconds if hasattr(game, 'duration_seconds') else 20,
-            'server_seed_hash': game.server_seed_hash if hasattr(game, 'server_seed_hash') else None,
-            'nonce': game.nonce if hasattr(game, 'nonce') else None
-        })
-    except CrashGame.DoesNotExist:
+    # Активная игра (без ended_at) хранится в состоянии сессии
+    game = state.crash_game
+    if game is None:
         return Response({
             'game_id': None,
             'multiplier': None,
             'is_active': False
         })
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return Response(
-            {'error': f'Ошибка получения текущей игры: {str(e)}'},
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+    return Response({
+        'game_id': str(game.id),
+        'multiplier': game.multiplier,
+        'started_at': game.started_at.isoformat() if game.started_at else None,
+        'is_active': True,
+        'duration_seconds': game.duration_seconds,
+        'server_seed_hash': game.server_seed_hash,
+        'nonce': game.nonce
+    })
 
 
 @api_view(['POST'])
 def create_crash_game(request, code):
     """Создание новой игры Краш с Provably Fair"""
-    import hashlib
-    
-    try:
-        session = Session.objects.get(code=code)
-    except Session.DoesNotExist:
+    state = state_engine.get(code)
+    if state is None:
         return Response(
             {'error': 'Сессия не найдена'},
             status=status.HTTP_404_NOT_FOUND
         )
+    session = state.session
     
-    # Проверяем, есть ли уже активная игра
-    active_game = CrashGame.objects.filter(
-        session=session,
-        ended_at__isnull=True
-    ).first()
-    
-    if active_game:
-        return Response({
-            'game_id': str(active_game.id),
-            'multiplier': active_game.multiplier,
-            'is_active': True,
-            'duration_seconds': active_game.duration_seconds,
-            'server_seed_hash': active_game.server_seed_hash,
-            'nonce': active_game.nonce
-        })
-    
-    # Provably Fair: генерируем серверный seed и его хэш
-    server_seed = secrets.token_hex(32)  # 64 символа
-    server_seed_hash = hashlib.sha256(server_seed.encode()).hexdigest()
-    
-    # Получаем последний nonce для этой сессии
-    last_game = CrashGame.objects.filter(session=session).order_by('-nonce').first()
-    nonce = (last_game.nonce + 1) if last_game and last_game.nonce else 1
-    
-    # Генерируем краш-коэффициент через SHA-256 для честности
-    # Используем server_seed + nonce для генерации
-    hmac_input = f"{server_seed}:{nonce}".encode()
-    hmac_hash = hashlib.sha256(hmac_input).hexdigest()
-    
-    # Преобразуем хэш в число от 0 до 1
-    hash_int = int(hmac_hash[:8], 16)  # Берем первые 8 символов
-    hash_float = hash_int / (16 ** 8)  # Нормализуем до 0-1
-
-    # Проверяем подкрутку (rig) перед расчётом случайного множителя
-    rig = RigOverride.objects.filter(session=session, consumed=False).order_by('-created_at').first()
-    multiplier = None
-    if rig:
-        multiplier = round(float(rig.value), 2)
-        if rig.apply_once:
-            rig.consumed = True
-            rig.save(update_fields=['consumed'])
-    else:
-        # Генерируем множитель с взвешенным распределением
-        # 70% низкие (1.00-2.0), 20% средние (2.0-4.0), 7% высокие (4.0-8.0), 2.5% очень высокие (8.0-15.0), 0.5% экстремальные (15.0-50.0)
-        if hash_float < 0.70:
-            # 70% вероятность: 1.00 - 2.0
-            multiplier = round(1.00 + (hash_float / 0.70) * 1.0, 2)
-        elif hash_float < 0.90:
-            # 20% вероятность: 2.0 - 4.0
-            multiplier = round(2.0 + ((hash_float - 0.70) / 0.20) * 2.0, 2)
-        elif hash_float < 0.97:
-            # 7% вероятность: 4.0 - 8.0
-            multiplier = round(4.0 + ((hash_float - 0.90) / 0.07) * 4.0, 2)
-        elif hash_float < 0.995:
-            # 2.5% вероятность: 8.0 - 15.0
-            multiplier = round(8.0 + ((hash_float - 0.97) / 0.025) * 7.0, 2)
+    with state.lock:
+        # Проверяем, есть ли уже активная игра (текущий раунд хранится в состоянии сессии)
+        active_game = state.crash_game
+        
+        if active_game:
+            return Response({
+                'game_id': str(active_game.id),
+                'multiplier': active_game.multiplier,
+                'is_active': True,
+                'duration_seconds': active_game.duration_seconds,
+                'server_seed_hash': active_game.server_seed_hash,
+                'nonce': active_game.nonce
+            })
+        
+        # Provably Fair: берём следующий заранее посчитанный seed из цепочки сессии
+        crash_round = chain_pool.pop(session)
+        server_seed = crash_round.server_seed
+        server_seed_hash = crash_round.server_seed_hash
+        nonce = crash_round.nonce
+
+        # Проверяем подкрутку (rig); без неё используем честный множитель из цепочки
+        rig = chain_pool.take_rig(session)
+        if rig:
+            multiplier = min(round(float(rig.value), 2), 50.0)
         else:
-            # 0.5% вероятность: 15.0 - 50.0
-            multiplier = round(15.0 + ((hash_float - 0.995) / 0.005) * 35.0, 2)
-    
-    # Ограничиваем максимум 50.0
-    multiplier = min(multiplier, 50.0)
-    
-    # Генерируем случайную длительность игры (20-40 секунд)
-    duration_seconds = random.randint(20, 40)
-    
-    game = CrashGame.objects.create(
-        session=session,
-        multiplier=multiplier,
-        duration_seconds=duration_seconds,
-        betting_phase_start=timezone.now(),
-        betting_phase_end=timezone.now() + timedelta(seconds=10),
-        server_seed=server_seed,
-        server_seed_hash=server_seed_hash,
-        nonce=nonce
-    )
+            multiplier = crash_round.multiplier
+        
+        # Генерируем случайную длительность игры (20-40 секунд)
+        duration_seconds = random.randint(20, 40)
+        
+        game = CrashGame.objects.create(
+            session=session,
+            multiplier=multiplier,
+            duration_seconds=duration_seconds,
+            betting_phase_start=timezone.now(),
+            betting_phase_end=timezone.now() + timedelta(seconds=10),
+            server_seed=server_seed,
+            server_seed_hash=server_seed_hash,
+            nonce=nonce,
+            chain_id=crash_round.chain_id
+        )
+        state.crash_game = game
+        schedule_crash_round(session.code, game)
+        log_event(session.id, 'crash.round_created', game_id=game.id, multiplier=multiplier, nonce=nonce,
+                  rigged=rig is not None)
     
     return Response({
         'game_id': str(game.id),
@@ -1052,38 +1671,70 @@ def create_crash_game(request, code):
     })
 
 
-@api_view(['POST'])
-def cashout_crash_bet(request):
-    """Вывод ставки во время игры (cashout)"""
-    try:
-        data = request.data
-        token = data.get('token')
-        bet_id = data.get('bet_id')
-        current_multiplier = float(data.get('current_multiplier', 1.0))
-        
-        if not token or not bet_id:
-            return Response(
-                {'error': 'Токен и ID ставки обязательны'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        player = get_object_or_404(Player, token=token)
-        bet = get_object_or_404(CrashBet, id=bet_id, player=player)
-        
+def _crash_chain_info(session):
+    """Опубликованные головы цепочек сессии"""
+    return [
+        {
+            'head_hash': chain.head_hash,
+            'length': chain.length,
+            'nonce_start': chain.nonce_start,
+            'created_at': chain.created_at.isoformat(),
+        }
+        for chain in session.crash_chains.order_by('nonce_start')
+    ]
+
+
+@api_view(['GET'])
+def get_crash_chain(request, code):
+    """Головы цепочек Provably Fair для сессии"""
+    session = get_object_or_404(Session, code=code)
+    return Response({'chains': _crash_chain_info(session)})
+
+
+@api_view(['GET'])
+def verify_crash_history(request, code):
+    """Проверка всей истории раундов Краш сессии за один запрос"""
+    session = get_object_or_404(Session, code=code)
+    return Response(verify_session_history(session))
+
+
+def perform_cashout_crash_bet(data, received_at=None):
+    """
+    Вывод ставки во время игры (cashout).
+
+    Множитель считает сервер по кривой раунда на момент received_at (время
+    прихода команды по WebSocket, для REST — вызова); current_multiplier от
+    клиента не используется.
+    """
+    if received_at is None:
+        received_at = timezone.now()
+    token = data.get('token')
+    bet_id = data.get('bet_id')
+
+    if not token or not bet_id:
+        raise ActionError('Токен и ID ставки обязательны', status.HTTP_400_BAD_REQUEST)
+
+    state, player = state_engine.by_token(token)
+    if player is None:
+        raise Http404
+
+    # Под блокировкой сессии: кэшаут не пересекается с завершением раунда
+    with state.lock:
+        bet = get_object_or_404(CrashBet.objects.select_related('crash_game'), id=bet_id, player_id=player.id)
+        bet.player = player
+
         # Проверяем, что ставка еще активна
         if bet.status != 'pending':
-            return Response(
-                {'error': 'Ставка уже обработана'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
+            raise ActionError('Ставка уже обработана', status.HTTP_400_BAD_REQUEST)
+
         # Проверяем, что игра еще не закончилась
         if bet.crash_game.ended_at:
-            return Response(
-                {'error': 'Игра уже завершена'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
+            raise ActionError('Игра уже завершена', status.HTTP_400_BAD_REQUEST)
+
+        current_multiplier = multiplier_at(bet.crash_game, received_at)
+        if current_multiplier is None:
+            raise ActionError('Раунд не идёт', status.HTTP_400_BAD_REQUEST)
+
         # Вычисляем выигрыш
         win_amount = int(bet.bet_amount * current_multiplier)
         bet.win_amount = win_amount
@@ -1091,98 +1742,85 @@ def cashout_crash_bet(request):
         bet.cashout_multiplier = current_multiplier
         bet.cashed_out_at = timezone.now()
         bet.save()
-        
+
         # Обновляем бонусные очки игрока (ставка возвращается + выигрыш)
-        bet.player.bonus_score += bet.bet_amount + win_amount
-        bet.player.save()
-        
-        return Response({
-            'bet_id': str(bet.id),
-            'cashout_multiplier': current_multiplier,
-            'win_amount': win_amount,
-            'total_payout': bet.bet_amount + win_amount,
-            'status': bet.status
-        })
-    except Exception as e:
-        return Response(
-            {'error': str(e)},
-            status=status.HTTP_400_BAD_REQUEST
-        )
+        player.bonus_score += bet.bet_amount + win_amount
+        state.mark_player(player, 'bonus_score')
+        record_settlement(bet, bet.bet_amount + win_amount)
+        log_event(player.session_id, 'crash.cashed_out', player.id, bet_id=bet.id, status=bet.status,
+                  amount=bet.bet_amount + win_amount, win_amount=win_amount,
+                  cashout_multiplier=current_multiplier)
+
+    return {
+        'bet_id': str(bet.id),
+        'cashout_multiplier': current_multiplier,
+        'win_amount': win_amount,
+        'total_payout': bet.bet_amount + win_amount,
+        'status': bet.status
+    }
 
 
 @api_view(['POST'])
-def place_crash_bet(request):
+@idempotent('cashout_crash_bet')
+@rate_limited('action')
+def cashout_crash_bet(request):
+    """Вывод ставки во время игры (cashout)"""
+    return _run_action(perform_cashout_crash_bet, request.data, unexpected_status=status.HTTP_400_BAD_REQUEST)
+
+
+def perform_place_crash_bet(data):
     """Размещение ставки в игре Краш"""
+    token = data.get('token')
+    if not token:
+        raise ActionError('Токен обязателен', status.HTTP_400_BAD_REQUEST)
+
+    state, player = state_engine.by_token(token)
+    if player is None:
+        raise Http404
+
+    game_id = data.get('game_id')
+    if not game_id:
+        raise ActionError('game_id обязателен', status.HTTP_400_BAD_REQUEST)
+
     try:
-        token = request.data.get('token')
-        if not token:
-            return Response(
-                {'error': 'Токен обязателен'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        player = get_object_or_404(Player, token=token)
-        
-        game_id = request.data.get('game_id')
-        if not game_id:
-            return Response(
-                {'error': 'game_id обязателен'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        try:
-            game = CrashGame.objects.get(id=game_id)
-        except CrashGame.DoesNotExist:
-            return Response(
-                {'error': 'Игра не найдена'},
-                status=status.HTTP_404_NOT_FOUND
-            )
-        
-        # Проверяем, что игра еще активна
-        if game.ended_at:
-            return Response(
-                {'error': 'Игра уже завершена'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Проверяем, не делал ли игрок уже ставку
-        if CrashBet.objects.filter(crash_game=game, player=player).exists():
-            return Response(
-                {'error': 'Вы уже сделали ставку в этом раунде'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        multiplier = request.data.get('multiplier')
-        if not multiplier:
-            return Response(
-                {'error': 'Множитель обязателен'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        try:
-            multiplier = float(multiplier)
-            if multiplier < 1.01 or multiplier > 50:
-                return Response(
-                    {'error': 'Множитель должен быть от 1.01 до 50'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-        except (ValueError, TypeError):
-            return Response(
-                {'error': 'Неверный формат множителя'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        bet_amount = request.data.get('bet_amount', 0)
-        try:
-            bet_amount = int(bet_amount)
-            if bet_amount < 0:
-                return Response(
-                    {'error': 'Ставка не может быть отрицательной'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-        except (ValueError, TypeError):
-            bet_amount = 0
-        
+        game = CrashGame.objects.get(id=game_id)
+    except CrashGame.DoesNotExist:
+        raise ActionError('Игра не найдена', status.HTTP_404_NOT_FOUND)
+
+    # Проверяем, что игра еще активна
+    if game.ended_at:
+        raise ActionError('Игра уже завершена', status.HTTP_400_BAD_REQUEST)
+    if game.betting_phase_end and timezone.now() >= game.betting_phase_end:
+        raise ActionError('Ставки принимаются только до начала игры', status.HTTP_400_BAD_REQUEST)
+
+    # Проверяем, не делал ли игрок уже ставку
+    if CrashBet.objects.filter(crash_game=game, player=player).exists():
+        raise ActionError('Вы уже сделали ставку в этом раунде', status.HTTP_400_BAD_REQUEST)
+
+    multiplier = data.get('multiplier')
+    if not multiplier:
+        raise ActionError('Множитель обязателен', status.HTTP_400_BAD_REQUEST)
+
+    try:
+        multiplier = float(multiplier)
+        if multiplier < 1.01 or multiplier > 50:
+            raise ActionError('Множитель должен быть от 1.01 до 50', status.HTTP_400_BAD_REQUEST)
+    except (ValueError, TypeError):
+        raise ActionError('Неверный формат множителя', status.HTTP_400_BAD_REQUEST)
+
+    bet_amount = data.get('bet_amount', 0)
+    try:
+        bet_amount = int(bet_amount)
+        if bet_amount < 0:
+            raise ActionError('Ставка не может быть отрицательной', status.HTTP_400_BAD_REQUEST)
+    except (ValueError, TypeError):
+        bet_amount = 0
+
+    # Под блокировкой сессии: баланс не пересекается с другими изменениями игрока
+    with state.lock:
+        if bet_amount > player.final_score:
+            raise ActionError('Недостаточно баллов для ставки', status.HTTP_400_BAD_REQUEST)
+
         # Создаем ставку
         bet = CrashBet.objects.create(
             crash_game=game,
@@ -1191,21 +1829,29 @@ def place_crash_bet(request):
             bet_amount=bet_amount,
             status='pending'
         )
-        
-        return Response({
-            'bet_id': str(bet.id),
-            'multiplier': bet.multiplier,
-            'bet_amount': bet.bet_amount,
-            'status': bet.status
-        })
-        
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return Response(
-            {'error': str(e)},
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+
+        # Ставка списывается сразу; выигрыш или кэшаут возвращают её вместе с выигрышем
+        if bet_amount:
+            player.bonus_score -= bet_amount
+            state.mark_player(player, 'bonus_score')
+        record_stake(bet)
+        log_event(game.session_id, 'crash.bet_placed', player.id, bet_id=bet.id, game_id=game.id,
+                  multiplier=multiplier, bet_amount=bet_amount, amount=-bet_amount)
+
+    return {
+        'bet_id': str(bet.id),
+        'multiplier': bet.multiplier,
+        'bet_amount': bet.bet_amount,
+        'status': bet.status
+    }
+
+
+@api_view(['POST'])
+@idempotent('place_crash_bet')
+@rate_limited('action')
+def place_crash_bet(request):
+    """Размещение ставки в игре Краш"""
+    return _run_action(perform_place_crash_bet, request.data, unexpected_status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 @api_view(['GET'])
@@ -1229,11 +1875,17 @@ def get_crash_bets(request, code):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        # Получаем последние ставки игрока
-        bets = CrashBet.objects.filter(
-            crash_game__session=session,
-            player=player
-        ).order_by('-created_at')[:20]
+        try:
+            limit = min(int(request.GET.get('limit', PAGE_SIZE)), MAX_PAGE_SIZE)
+        except (TypeError, ValueError):
+            limit = PAGE_SIZE
+        try:
+            bets, next_cursor = bets_page(player, cursor=request.GET.get('cursor'), limit=max(limit, 1))
+        except ValueError:
+            return Response(
+                {'error': 'Неверный курсор'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         bets_data = []
         for bet in bets:
@@ -1249,18 +1901,20 @@ def get_crash_bets(request, code):
                 'game_multiplier': game.multiplier if game.ended_at else None,
                 'created_at': bet.created_at.isoformat(),
                 'won': bet.status == 'won',
-                'balance_before': player.final_score - (bet.win_amount if bet.status == 'won' else 0) + bet.bet_amount,
-                'balance_after': player.final_score if bet.status == 'won' else player.final_score - bet.bet_amount,
+                # Из журнала: списание ставки и выплата (у проигрыша — только списание)
+                'balance_before': bet.balance_before,
+                'balance_after': bet.balance_after,
             })
         
         return Response({
             'bets': bets_data,
-            'total_bets': len(bets_data)
+            'total_bets': len(bets_data),
+            'next_cursor': next_cursor,
+            'stats': player_stats_cache.get(player),
         })
         
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        log_error('request', 'crash.bets_failed', session=code)
         return Response(
             {'error': str(e)},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -1273,67 +1927,81 @@ def finish_crash_game(request, game_id):
     try:
         game = get_object_or_404(CrashGame, id=game_id)
         
-        if game.ended_at:
-            return Response(
-                {'error': 'Игра уже завершена'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        state = state_engine.get_by_id(game.session_id)
         
-        from django.utils import timezone
-        game.ended_at = timezone.now()
-        game.save()
+        # Под блокировкой сессии: расчёт не пересекается с кэшаутами
+        with state.lock:
+            game.refresh_from_db(fields=['ended_at'])
+            if game.ended_at:
+                return Response(
+                    {'error': 'Игра уже завершена'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
         
-        # Подсчитываем выигрыши
-        bets = CrashBet.objects.filter(crash_game=game, status='pending')
-        winners = []
-        all_bets_info = []  # Информация о всех ставках для истории
+            game.ended_at = timezone.now()
+            game.save()
+            if state.crash_game is not None and state.crash_game.id == game.id:
+                state.crash_game = None
+            crash_history.record(state.session.code, game)
         
-        for bet in bets:
-            bet_info = {
-                'player_name': bet.player.name,
-                'multiplier': bet.multiplier,
-                'bet_amount': bet.bet_amount,
-                'won': False
-            }
+            # Подсчитываем выигрыши; игроки — из состояния сессии
+            bets = CrashBet.objects.filter(crash_game=game, status='pending')
+            winners = []
+            all_bets_info = []  # Информация о всех ставках для истории
+        
+            for bet in bets:
+                bet.player = state.players.get(bet.player_id) or bet.player
+                bet_info = {
+                    'player_name': bet.player.name,
+                    'multiplier': bet.multiplier,
+                    'bet_amount': bet.bet_amount,
+                    'won': False
+                }
             
-            if bet.multiplier <= game.multiplier:
-                # Игрок выиграл
-                # Возвращаем ставку + выигрыш (ставка * множитель ставки)
-                win_amount = int(bet.bet_amount * bet.multiplier)
-                total_payout = bet.bet_amount + win_amount  # Ставка + выигрыш
-                bet.win_amount = total_payout
-                bet.status = 'won'
-                bet.save()
+                if bet.multiplier <= game.multiplier:
+                    # Игрок выиграл
+                    # Возвращаем ставку + выигрыш (ставка * множитель ставки)
+                    win_amount = int(bet.bet_amount * bet.multiplier)
+                    total_payout = bet.bet_amount + win_amount  # Ставка + выигрыш
+                    bet.win_amount = total_payout
+                    bet.status = 'won'
+                    bet.save()
                 
-                # Начисляем выигрыш игроку (ставка возвращается + выигрыш)
-                player = bet.player
-                player.bonus_score += total_payout
-                player.save()
+                    # Начисляем выигрыш игроку (ставка возвращается + выигрыш)
+                    player = bet.player
+                    player.bonus_score += total_payout
+                    state.mark_player(player, 'bonus_score')
+                    record_settlement(bet, total_payout)
+                    log_event(game.session_id, 'crash.settled', player.id, bet_id=bet.id, status='won',
+                              amount=total_payout, win_amount=total_payout)
                 
-                bet_info['won'] = True
-                bet_info['win_amount'] = total_payout
-                bet_info['bet_returned'] = bet.bet_amount
-                bet_info['profit'] = win_amount
+                    bet_info['won'] = True
+                    bet_info['win_amount'] = total_payout
+                    bet_info['bet_returned'] = bet.bet_amount
+                    bet_info['profit'] = win_amount
                 
-                winners.append({
-                    'player_id': str(player.id),
-                    'player_name': player.name,
-                    'multiplier': bet.multiplier,
-                    'win_amount': total_payout,
-                    'bet_returned': bet.bet_amount,
-                    'profit': win_amount
-                })
-            else:
-                # Игрок проиграл
-                bet.status = 'lost'
-                bet.save()
+                    winners.append({
+                        'player_id': str(player.id),
+                        'player_name': player.name,
+                        'multiplier': bet.multiplier,
+                        'win_amount': total_payout,
+                        'bet_returned': bet.bet_amount,
+                        'profit': win_amount
+                    })
+                else:
+                    # Игрок проиграл
+                    bet.status = 'lost'
+                    bet.save()
+                    player_stats_cache.invalidate(bet.player_id)
+                    log_event(game.session_id, 'crash.settled', bet.player_id, bet_id=bet.id, status='lost', amount=0)
             
-            all_bets_info.append(bet_info)
+                all_bets_info.append(bet_info)
+            log_event(game.session_id, 'crash.round_finished', game_id=game.id, multiplier=game.multiplier)
         
         # Отправляем обновление через WebSocket
         channel_layer = get_channel_layer()
         async_to_sync(channel_layer.group_send)(
-            f'session_{game.session.code}',
+            f'session_{state.session.code}',
             {
                 'type': 'crash_game_finished',
                 'payload': {
@@ -1344,7 +2012,7 @@ def finish_crash_game(request, game_id):
             }
         )
         
-        broadcast_leaderboard_update(game.session.code)
+        broadcast_leaderboard_update(state.session.code)
         
         return Response({
             'game_id': str(game.id),
@@ -1356,9 +2024,10 @@ def finish_crash_game(request, game_id):
             'nonce': game.nonce
         })
         
+    except MisdirectedSession:
+        raise
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        log_error('request', 'crash.finish_failed', game_id=game_id)
         return Response(
             {'error': str(e)},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -1369,8 +2038,9 @@ def finish_crash_game(request, game_id):
 
 def broadcast_session_state(session_code):
     """Отправка состояния сессии всем подключённым клиентам"""
-    try:
-        session = Session.objects.get(code=session_code)
+    state = state_engine.get(session_code)
+    if state is not None:
+        session = state.session
         channel_layer = get_channel_layer()
         async_to_sync(channel_layer.group_send)(
             f'session_{session_code}',
@@ -1385,31 +2055,16 @@ def broadcast_session_state(session_code):
                 }
             }
         )
-    except Session.DoesNotExist:
-        pass
 
 
 def broadcast_players_list(session_code):
     """Отправка списка игроков"""
-    try:
-        session = Session.objects.get(code=session_code)
-        players = session.players.all()
-        players_data = [
-            {
-                'id': str(p.id),
-                'name': p.name,
-                'status': p.status,
-                'current_level': p.current_level,
-                'total_score': p.total_score,
-                'bonus_score': p.bonus_score,
-                'role': p.role,
-                'role_buff': p.role_buff,
-                'final_score': p.final_score,
-                'last_seen': p.last_seen.isoformat() if p.last_seen else None,
-                'is_connected': p.is_connected,
-            }
-            for p in players
-        ]
+    state = state_engine.get(session_code)
+    if state is not None:
+        session = state.session
+        with state.lock:
+            players = state.ordered_players()
+        players_data = [player_public_data(p) for p in players]
         channel_layer = get_channel_layer()
         async_to_sync(channel_layer.group_send)(
             f'session_{session_code}',
@@ -1421,8 +2076,6 @@ def broadcast_players_list(session_code):
                 }
             }
         )
-    except Session.DoesNotExist:
-        pass
 
 
 def broadcast_player_update(session_code, player):
@@ -1433,49 +2086,34 @@ def broadcast_player_update(session_code, player):
         {
             'type': 'player_update',
             'payload': {
-                'session_id': str(player.session.id),
-                'player': {
-                    'id': str(player.id),
-                    'name': player.name,
-                    'status': player.status,
-                    'current_level': player.current_level,
-                    'total_score': player.total_score,
-                    'bonus_score': player.bonus_score,
-                    'role': player.role,
-                    'role_buff': player.role_buff,
-                    'final_score': player.final_score,
-                    'last_seen': player.last_seen.isoformat() if player.last_seen else None,
-                    'is_connected': player.is_connected,
-                }
+                'session_id': str(player.session_id),
+                'player': player_public_data(player),
             }
         }
     )
 
 
-def broadcast_leaderboard_update(session_code):
-    """Отправка обновления лидерборда"""
-    try:
-        session = Session.objects.get(code=session_code)
-        # Сортируем по total_score + bonus_score (final_score - это property, не поле БД)
-        # Используем Python для сортировки по final_score, так как это вычисляемое свойство
-        players_list = list(session.players.all())
-        players_list.sort(key=lambda p: (p.total_score + p.bonus_score + p.role_buff, p.total_score, -p.created_at.timestamp()), reverse=True)
-        players = players_list
-        leaderboard = [
-            {
-                'rank': idx + 1,
-                'player_id': str(p.id),
-                'name': p.name,
-                'total_score': p.total_score,
-                'bonus_score': p.bonus_score,
-                'role': p.role,
-                'role_buff': p.role_buff,
-                'final_score': p.final_score,  # Используем property для отправки клиенту
-                'current_level': p.current_level,
-                'status': p.status,
-            }
-            for idx, p in enumerate(players)
-        ]
+def _build_leaderboard(state):
+    """Лидерборд сессии (из состояния в памяти), отсортированный по final_score"""
+    # Сортируем по total_score + bonus_score (final_score - это property, не поле БД)
+    # Используем Python для сортировки по final_score, так как это вычисляемое свойство
+    with state.lock:
+        players_list = list(state.players.values())
+    players_list.sort(key=lambda p: (p.total_score + p.bonus_score + p.role_buff, p.total_score, -p.created_at.timestamp()), reverse=True)
+    return [leaderboard_row(idx + 1, p) for idx, p in enumerate(players_list)]
+
+
+def broadcast_leaderboard_update(session_code, snapshot_reason=None):
+    """
+    Отправка обновления лидерборда.
+
+    Заодно отдаёт лидерборд в snapshot_recorder; snapshot_reason
+    (переход уровня, старт, финиш) форсирует запись снимка.
+    """
+    state = state_engine.get(session_code)
+    if state is not None:
+        session = state.session
+        leaderboard = _build_leaderboard(state)
         channel_layer = get_channel_layer()
         async_to_sync(channel_layer.group_send)(
             f'session_{session_code}',
@@ -1487,8 +2125,19 @@ def broadcast_leaderboard_update(session_code):
                 }
             }
         )
-    except Session.DoesNotExist:
-        pass
+        snapshot_recorder.observe(session.id, leaderboard, reason=snapshot_reason)
+
+
+def broadcast_timer_tick(session_code, payload):
+    """Обратный отсчёт уровня (timer.tick)"""
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(
+        f'session_{session_code}',
+        {
+            'type': 'timer_tick',
+            'payload': payload,
+        }
+    )
 
 
 def broadcast_game_event(session_code, event_kind, payload):
@@ -1506,40 +2155,39 @@ def broadcast_game_event(session_code, event_kind, payload):
     )
 
 
-@api_view(['POST'])
-def update_player_progress(request):
+def perform_update_player_progress(data):
     """Обновление прогресса игрока"""
-    try:
-        player_token = request.data.get('player_token')
-        if not player_token:
-            return Response({'error': 'player_token required'}, status=status.HTTP_400_BAD_REQUEST)
-
-        player = get_object_or_404(Player, token=player_token)
-
-        # Обновляем уровень и игры
-        if 'current_level' in request.data:
-            player.current_level = request.data['current_level']
-        if 'current_green_game' in request.data:
-            player.current_green_game = request.data['current_green_game']
-        if 'current_yellow_game' in request.data:
-            player.current_yellow_game = request.data['current_yellow_game']
-        if 'current_red_game' in request.data:
-            player.current_red_game = request.data['current_red_game']
-        if 'played_bonus_games' in request.data:
-            player.played_bonus_games = request.data['played_bonus_games']
-
-        player.save()
-
-        # Отправляем обновления
-        broadcast_players_list(player.session.code)
-        broadcast_leaderboard_update(player.session.code)
-
-        return Response({
-            'success': True,
-            'message': 'Прогресс обновлен'
-        })
+    player_token = data.get('player_token')
+    if not player_token:
+        raise ActionError('player_token required', status.HTTP_400_BAD_REQUEST)
+
+    state, player = state_engine.by_token(player_token)
+    if player is None:
+        raise Http404
+
+    with state.lock:
+        _check_version(player, data)
+        # Обновляем уровень и игры одним update_player — версия растёт один раз на запрос
+        changed = [field for field in PROGRESS_FIELDS if field in data]
+        if changed:
+            state.update_player(player, **{field: data[field] for field in changed})
+            log_event(player.session_id, 'player.progress_updated', player.id,
+                      **{field: getattr(player, field) for field in changed})
+        version = player.version
+
+    # Отправляем обновления
+    broadcast_players_list(player.session.code)
+    broadcast_leaderboard_update(player.session.code)
 
-    except Exception as e:
-        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    return {
+        'success': True,
+        'message': 'Прогресс обновлен',
+        'version': version,
+    }
 
 
+@api_view(['POST'])
+@rate_limited('action')
+def update_player_progress(request):
+    """Обновление прогресса игрока"""
+    return _run_action(perform_update_player_progress, request.data, unexpected_status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -20,8 +20,9 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'snowparty.settings')
 django_asgi_app = get_asgi_application()
 
 from game import routing
+from game.timers import timer_wheel
 
-application = ProtocolTypeRouter({
+router = ProtocolTypeRouter({
     "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
         URLRouter(routing.websocket_urlpatterns)
@@ -29,3 +30,9 @@ application = ProtocolTypeRouter({
 })
 
 
+async def application(scope, receive, send):
+    # Колесо серверных таймеров работает в цикле событий сервера
+    timer_wheel.start()
+    return await router(scope, receive, send)
+
+
@@ -5,6 +5,7 @@ Django settings for snowparty project.
 from pathlib import Path
 import os
 from dotenv import load_dotenv
+from corsheaders.defaults import default_headers
 
 load_dotenv()
 
@@ -140,6 +141,8 @@ CHANNEL_LAYERS = {
 # CORS settings for local network
 CORS_ALLOWED_ORIGINS = []
 CORS_ALLOW_ALL_ORIGINS = True  # For local development
+# Код сессии для роутера manage.py serve (game/serving.py), смещение загрузки селфи частями, Idempotency-Key
+CORS_ALLOW_HEADERS = (*default_headers, 'x-session-code', 'upload-offset', 'idempotency-key')
 
 # REST Framework
 REST_FRAMEWORK = {
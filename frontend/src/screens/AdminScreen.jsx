@@ -1,4 +1,4 @@
-import { useEffect, useState } from 'react'
+import { useEffect, useRef, useState } from 'react'
 import {
   adminLogin,
   adminGetPlayers,
@@ -146,6 +146,7 @@ function AdminScreen() {
   const [password, setPassword] = useState('disooloo')
   const [token, setToken] = useState(localStorage.getItem('admin_token') || '')
   const [players, setPlayers] = useState([])
+  const [nextCursor, setNextCursor] = useState(null)
   const [sessionFilter, setSessionFilter] = useState('')
   const [activeOnly, setActiveOnly] = useState(true)
   const [selectedPlayerId, setSelectedPlayerId] = useState(null)
@@ -168,12 +169,15 @@ function AdminScreen() {
   const [rigRoundNumber, setRigRoundNumber] = useState('1')
   const [showDeleteConfirm, setShowDeleteConfirm] = useState(false)
   const [playerToDelete, setPlayerToDelete] = useState(null)
+  // Номер последнего запроса списка: ответы на устаревшие запросы отбрасываются
+  const playersRequest = useRef(0)
 
   useEffect(() => {
-    if (token) {
-      loadPlayers()
-    }
-  }, [token, activeOnly, sessionFilter])
+    if (!token) return
+    // Поиск идёт на сервере — ждём паузы в наборе имени
+    const timer = setTimeout(() => loadPlayers(), nameFilter ? 300 : 0)
+    return () => clearTimeout(timer)
+  }, [token, activeOnly, sessionFilter, nameFilter])
 
   const showNotification = (message, type = 'success') => {
     setNotification({ message, type })
@@ -194,35 +198,37 @@ function AdminScreen() {
     }
   }
 
-  const loadPlayers = async (overrideToken) => {
+  // Первая страница списка или, с cursor, следующая — дописывается к уже загруженным
+  const loadPlayers = async (overrideToken, cursor) => {
     const useToken = overrideToken || token
     if (!useToken) return
+    const requestId = ++playersRequest.current
     setLoading(true)
     setError('')
     try {
       const res = await adminGetPlayers(useToken, {
         session: sessionFilter || undefined,
         active: activeOnly,
+        q: nameFilter.trim() || undefined,
+        cursor,
       })
-      setPlayers(res.players || [])
+      if (requestId !== playersRequest.current) return
+      const page = res.players || []
+      setPlayers(prev => (cursor ? [...prev, ...page] : page))
+      setNextCursor(res.next_cursor || null)
     } catch (err) {
-      setError(err.message)
+      if (requestId === playersRequest.current) setError(err.message)
     } finally {
-      setLoading(false)
+      if (requestId === playersRequest.current) setLoading(false)
     }
   }
 
-  // Фильтрация игроков по имени
-  const filteredPlayers = players.filter(player =>
-    player.name.toLowerCase().includes(nameFilter.toLowerCase())
-  )
-
-  const loadPlayerDetail = async (playerId) => {
+  const loadPlayerDetail = async (playerId, sessionCode) => {
     setSelectedPlayerId(playerId)
     setSelectedPlayer(null)
     setError('')
     try {
-      const data = await adminGetPlayer(token, playerId)
+      const data = await adminGetPlayer(token, playerId, sessionCode)
       setSelectedPlayer(data)
       setRigPlayerId(playerId)
       setNewScore(data.final_score?.toString() || '0')
@@ -240,13 +246,15 @@ function AdminScreen() {
     setError('')
     try {
       const pointsDelta = newScore !== '' ? Number(newScore) - selectedPlayer.final_score : Number(delta)
-      await adminAdjustPoints(token, selectedPlayerId, { delta: pointsDelta, reason, hidden })
+      await adminAdjustPoints(
+        token, selectedPlayerId, { delta: pointsDelta, reason, hidden }, selectedPlayer.session_code
+      )
       showNotification(`Баллы ${selectedPlayer.name} обновлены!`, 'success')
       setReason('')
       setDelta(0)
       setNewScore('')
       await loadPlayers()
-      await loadPlayerDetail(selectedPlayerId)
+      await loadPlayerDetail(selectedPlayerId, selectedPlayer.session_code)
     } catch (err) {
       setError(err.message)
     }
@@ -291,10 +299,10 @@ function AdminScreen() {
     }
   }
 
-  const handleDeletePlayer = async (playerId) => {
+  const handleDeletePlayer = async (playerId, sessionCode) => {
     setError('')
     try {
-      await adminDeletePlayer(token, playerId)
+      await adminDeletePlayer(token, playerId, sessionCode)
       showNotification('Игрок успешно удалён!', 'success')
       setShowDeleteConfirm(false)
       setPlayerToDelete(null)
@@ -557,7 +565,7 @@ function AdminScreen() {
                 Отмена
               </button>
               <button
-                onClick={() => handleDeletePlayer(playerToDelete.id)}
+                onClick={() => handleDeletePlayer(playerToDelete.id, playerToDelete.session_code)}
                 style={{
                   ...buttonPrimaryStyle,
                   flex: 1,
@@ -608,8 +616,8 @@ function AdminScreen() {
                   fontSize: '0.8rem',
                   fontWeight: '600'
                 }}>
-                  {filteredPlayers.length}
-                  {nameFilter && ` из ${players.length}`}
+                  {players.length}
+                  {nextCursor && '+'}
                 </span>
               </h2>
             </div>
@@ -720,7 +728,7 @@ function AdminScreen() {
             gridTemplateColumns: 'repeat(auto-fill, minmax(320px, 1fr))',
             gap: '1rem'
           }} className="players-grid">
-            {filteredPlayers.map((p) => (
+            {players.map((p) => (
               <div
                 key={p.id}
                 style={{
@@ -734,7 +742,7 @@ function AdminScreen() {
                     : 'rgba(30, 41, 59, 0.8)'
                 }}
                 className="player-card"
-                onClick={() => loadPlayerDetail(p.id)}
+                onClick={() => loadPlayerDetail(p.id, p.session_code)}
                 onMouseEnter={(e) => {
                   if (selectedPlayerId !== p.id) {
                     e.currentTarget.style.transform = 'translateY(-2px)'
@@ -835,7 +843,7 @@ function AdminScreen() {
                   <button
                     onClick={(e) => {
                       e.stopPropagation()
-                      loadPlayerDetail(p.id)
+                      loadPlayerDetail(p.id, p.session_code)
                     }}
                     style={{
                       ...buttonSecondaryStyle,
@@ -880,7 +888,7 @@ function AdminScreen() {
               </div>
             ))}
 
-            {filteredPlayers.length === 0 && (
+            {players.length === 0 && (
               <div style={{
                 ...cardStyle,
                 padding: '3rem',
@@ -911,6 +919,22 @@ function AdminScreen() {
             )}
           </div>
 
+          {nextCursor && (
+            <div style={{ display: 'flex', justifyContent: 'center' }}>
+              <button
+                onClick={() => loadPlayers(undefined, nextCursor)}
+                disabled={loading}
+                style={{
+                  ...buttonPrimaryStyle,
+                  opacity: loading ? 0.6 : 1,
+                  cursor: loading ? 'not-allowed' : 'pointer'
+                }}
+              >
+                {loading ? '⏳ Загрузка...' : '⬇️ Показать ещё'}
+              </button>
+            </div>
+          )}
+
           {selectedPlayer && (
             <div style={{
               ...cardStyle,
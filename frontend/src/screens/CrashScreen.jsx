@@ -327,7 +327,7 @@ function CrashScreen() {
         return
       }
       
-      const result = await finishCrashGame(currentGame.game_id)
+      const result = await finishCrashGame(currentGame.game_id, sessionCode)
       setGameResult(result)
       setBettingPhase(false)
       setCanBet(false)
@@ -432,7 +432,8 @@ function CrashScreen() {
         token,
         currentGame.game_id,
         multiplierValue,
-        betAmount
+        betAmount,
+        sessionCode
       )
       
       setMyBet({
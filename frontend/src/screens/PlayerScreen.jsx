@@ -413,6 +413,17 @@ function PlayerScreen() {
           })
         }
         break
+      case 'player.balance_bulk_update': {
+        // Массовое начисление: одно сообщение на сессию, ищем в нём себя
+        const update = player && (data.payload.updates || []).find(u => u.player_id === player.id)
+        if (update) {
+          pushBalanceNotice({
+            amount: update.amount,
+            reason: update.reason || 'Причина не указана',
+          })
+        }
+        break
+      }
       case 'game.event':
         console.log('Game event:', data.payload)
         break
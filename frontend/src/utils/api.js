@@ -1,6 +1,8 @@
 /**
  * API клиент для REST запросов
  */
+import { getSessionCode } from './storage'
+
 function getApiBase() {
   if (import.meta.env.VITE_API_BASE) {
     return import.meta.env.VITE_API_BASE
@@ -15,6 +17,56 @@ function getApiBase() {
 
 const API_BASE = getApiBase()
 
+// Код сессии для роутера `manage.py serve`: запросы по токену уходят в воркер своей сессии
+function sessionHeaders(code = getSessionCode()) {
+  return code ? { 'X-Session-Code': code } : {}
+}
+
+// Админка не состоит в сессии: код сессии игрока передаётся явно, чтобы роутер
+// отправил запрос в воркер, который держит её состояние
+function adminHeaders(token, sessionCode) {
+  return { Authorization: `Bearer ${token}`, ...(sessionCode ? sessionHeaders(sessionCode) : {}) }
+}
+
+// Повторы изменяющего запроса после обрыва сети — с тем же Idempotency-Key
+const IDEMPOTENT_RETRIES = 2
+
+function newIdempotencyKey() {
+  // crypto.randomUUID есть только в защищённом контексте (https, localhost)
+  if (window.crypto && window.crypto.randomUUID) {
+    return window.crypto.randomUUID()
+  }
+  return `${Date.now().toString(16)}-${Math.random().toString(16).slice(2)}${Math.random().toString(16).slice(2)}`
+}
+
+/**
+ * POST, который можно безопасно повторить: сервер по Idempotency-Key
+ * вернёт сохранённый ответ, если первый запрос дошёл, а ответ потерялся.
+ */
+async function postIdempotent(url, body, headers = {}) {
+  const key = newIdempotencyKey()
+  for (let attempt = 0; ; attempt++) {
+    try {
+      const response = await fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'Idempotency-Key': key, ...headers },
+        body: JSON.stringify(body),
+      })
+      // 409 без conflict — первый запрос с этим ключом ещё выполняется
+      if (response.status === 409 && response.headers.get('Retry-After') && attempt < IDEMPOTENT_RETRIES) {
+        await new Promise((resolve) => setTimeout(resolve, 1000 * Number(response.headers.get('Retry-After'))))
+        continue
+      }
+      return response
+    } catch (error) {
+      if (!(error instanceof TypeError) || attempt >= IDEMPOTENT_RETRIES) {
+        throw error
+      }
+      await new Promise((resolve) => setTimeout(resolve, 500 * 2 ** attempt))
+    }
+  }
+}
+
 export async function createSession(config = {}) {
   const response = await fetch(`${API_BASE}/session`, {
     method: 'POST',
@@ -79,20 +131,14 @@ export async function startSession(code) {
 }
 
 export async function submitProgress(token, level, score, timeSpentMs, details = {}, isMinigame = false) {
-  const response = await fetch(`${API_BASE}/progress`, {
-    method: 'POST',
-    headers: {
-      'Content-Type': 'application/json',
-    },
-    body: JSON.stringify({
-      token,
-      level,
-      score,
-      time_spent_ms: timeSpentMs,
-      details,
-      is_minigame: isMinigame,
-    }),
-  })
+  const response = await postIdempotent(`${API_BASE}/progress`, {
+    token,
+    level,
+    score,
+    time_spent_ms: timeSpentMs,
+    details,
+    is_minigame: isMinigame,
+  }, sessionHeaders())
   if (!response.ok) {
     const error = await response.json()
     throw new Error(error.error || `Failed to submit progress: ${response.statusText}`)
@@ -100,33 +146,117 @@ export async function submitProgress(token, level, score, timeSpentMs, details =
   return response.json()
 }
 
+/**
+ * Пакет результатов по порядку (например, накопленных без сети): одно
+ * применение и одна рассылка. results — [{ level, score, timeSpentMs, details, isMinigame }],
+ * в ответе у каждого результата свой status.
+ */
+export async function submitProgressBatch(token, results) {
+  const response = await postIdempotent(`${API_BASE}/progress/batch`, {
+    token,
+    results: results.map((result) => ({
+      level: result.level,
+      score: result.score,
+      time_spent_ms: result.timeSpentMs,
+      details: result.details || {},
+      is_minigame: result.isMinigame || false,
+    })),
+  }, sessionHeaders())
+  if (!response.ok) {
+    const error = await response.json()
+    throw new Error(error.error || `Failed to submit progress batch: ${response.statusText}`)
+  }
+  return response.json()
+}
+
+// Повторы одной части селфи при обрыве сети (между ними — сверка смещения с сервером)
+const UPLOAD_RETRIES = 5
+
+async function uploadError(response, fallback) {
+  const contentType = response.headers.get('content-type')
+  if (contentType && contentType.includes('application/json')) {
+    const error = await response.json()
+    return new Error(error.error || fallback)
+  }
+  return new Error(fallback)
+}
+
+// SHA-256 файла в hex; crypto.subtle есть только в защищённом контексте (https, localhost)
+async function fileSha256(file) {
+  if (!window.crypto || !window.crypto.subtle) {
+    return null
+  }
+  const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer())
+  return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, '0')).join('')
+}
+
+/**
+ * Загрузка селфи частями: init -> PUT частей с Upload-Offset -> finalize.
+ * После обрыва продолжает с того байта, который сервер уже принял.
+ * Тот же файл повторно не загружается: сервер узнаёт его по SHA-256.
+ */
 export async function uploadSelfie(token, imageFile, task) {
-  const formData = new FormData()
-  formData.append('token', token)
-  formData.append('image', imageFile)
-  formData.append('task', task)
-  
+  const sha256 = await fileSha256(imageFile)
   console.log('📤 Отправка селфи на сервер:', { token: token.substring(0, 10) + '...', task, fileSize: imageFile.size })
-  
-  const response = await fetch(`${API_BASE}/selfie/upload`, {
+
+  const initResponse = await fetch(`${API_BASE}/selfie/upload/init`, {
     method: 'POST',
-    body: formData,
-    // Не устанавливаем Content-Type - браузер сделает это автоматически с правильным boundary для FormData
+    headers: { 'Content-Type': 'application/json', ...sessionHeaders() },
+    body: JSON.stringify({ token, task, size: imageFile.size, filename: imageFile.name, sha256 }),
   })
-  
-  console.log('📥 Ответ сервера:', response.status, response.statusText)
-  
-  if (!response.ok) {
-    const contentType = response.headers.get('content-type')
-    let error
-    if (contentType && contentType.includes('application/json')) {
-      error = await response.json()
-    } else {
-      const text = await response.text()
-      console.error('❌ Ошибка (не JSON):', text.substring(0, 200))
-      throw new Error(`Failed to upload selfie: ${response.statusText}`)
+  if (!initResponse.ok) {
+    throw await uploadError(initResponse, `Failed to upload selfie: ${initResponse.statusText}`)
+  }
+  const init = await initResponse.json()
+  if (!init.upload_id) {
+    console.log('✅ Селфи уже загружено:', init)
+    return init
+  }
+
+  const uploadUrl = `${API_BASE}/selfie/upload/${init.upload_id}`
+  let offset = init.offset
+  let failures = 0
+  while (offset < imageFile.size) {
+    try {
+      const response = await fetch(uploadUrl, {
+        method: 'PUT',
+        headers: { 'Upload-Offset': String(offset), ...sessionHeaders() },
+        body: imageFile.slice(offset, offset + init.chunk_size),
+      })
+      if (response.status === 409) {
+        // Сервер принял другое число байт — продолжаем с его смещения
+        offset = (await response.json()).offset
+        continue
+      }
+      if (!response.ok) {
+        throw await uploadError(response, `Failed to upload selfie: ${response.statusText}`)
+      }
+      offset = (await response.json()).offset
+      failures = 0
+    } catch (error) {
+      if (!(error instanceof TypeError) || ++failures > UPLOAD_RETRIES) {
+        throw error
+      }
+      // Обрыв сети: ждём и сверяем, сколько байт дошло
+      await new Promise((resolve) => setTimeout(resolve, 1000 * 2 ** (failures - 1)))
+      try {
+        const status = await fetch(uploadUrl, { headers: sessionHeaders() })
+        if (status.ok) {
+          offset = (await status.json()).offset
+        }
+      } catch (e) {
+        // Сеть ещё не вернулась — повторим с прежнего смещения
+      }
     }
-    throw new Error(error.error || `Failed to upload selfie: ${response.statusText}`)
+  }
+
+  const response = await fetch(`${uploadUrl}/finalize`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', ...sessionHeaders() },
+    body: JSON.stringify({ token }),
+  })
+  if (!response.ok) {
+    throw await uploadError(response, `Failed to upload selfie: ${response.statusText}`)
   }
   const result = await response.json()
   console.log('✅ Селфи загружено успешно:', result)
@@ -184,19 +314,13 @@ export async function createCrashGame(code) {
   return response.json()
 }
 
-export async function placeCrashBet(token, gameId, multiplier, betAmount = 0) {
-  const response = await fetch(`${API_BASE}/crash/bet`, {
-    method: 'POST',
-    headers: {
-      'Content-Type': 'application/json',
-    },
-    body: JSON.stringify({
-      token,
-      game_id: gameId,
-      multiplier,
-      bet_amount: betAmount,
-    }),
-  })
+export async function placeCrashBet(token, gameId, multiplier, betAmount = 0, code) {
+  const response = await postIdempotent(`${API_BASE}/crash/bet`, {
+    token,
+    game_id: gameId,
+    multiplier,
+    bet_amount: betAmount,
+  }, sessionHeaders(code))
   if (!response.ok) {
     const error = await response.json().catch(() => ({ error: response.statusText }))
     throw new Error(error.error || `Failed to place bet: ${response.statusText}`)
@@ -204,11 +328,12 @@ export async function placeCrashBet(token, gameId, multiplier, betAmount = 0) {
   return response.json()
 }
 
-export async function finishCrashGame(gameId) {
+export async function finishCrashGame(gameId, code) {
   const response = await fetch(`${API_BASE}/crash/${gameId}/finish`, {
     method: 'POST',
     headers: {
       'Content-Type': 'application/json',
+      ...sessionHeaders(code),
     },
   })
   if (!response.ok) {
@@ -239,10 +364,15 @@ export async function adminLogin(username, password) {
   return response.json()
 }
 
-export async function adminGetPlayers(token, { session, active } = {}) {
+export async function adminGetPlayers(token, { session, active, q, sort, order, cursor, limit } = {}) {
   const params = new URLSearchParams()
   if (session) params.append('session', session)
   if (active) params.append('active', '1')
+  if (q) params.append('q', q)
+  if (sort) params.append('sort', sort)
+  if (order) params.append('order', order)
+  if (cursor) params.append('cursor', cursor)
+  if (limit) params.append('limit', String(limit))
   const response = await fetch(`${API_BASE}/admin/players?${params.toString()}`, {
     headers: { Authorization: `Bearer ${token}` },
   })
@@ -252,9 +382,9 @@ export async function adminGetPlayers(token, { session, active } = {}) {
   return response.json()
 }
 
-export async function adminGetPlayer(token, playerId) {
+export async function adminGetPlayer(token, playerId, sessionCode) {
   const response = await fetch(`${API_BASE}/admin/player/${playerId}`, {
-    headers: { Authorization: `Bearer ${token}` },
+    headers: adminHeaders(token, sessionCode),
   })
   if (!response.ok) {
     throw new Error('Failed to load player')
@@ -262,12 +392,12 @@ export async function adminGetPlayer(token, playerId) {
   return response.json()
 }
 
-export async function adminAdjustPoints(token, playerId, { delta, reason, hidden }) {
+export async function adminAdjustPoints(token, playerId, { delta, reason, hidden }, sessionCode) {
   const response = await fetch(`${API_BASE}/admin/player/${playerId}/points`, {
     method: 'POST',
     headers: {
       'Content-Type': 'application/json',
-      Authorization: `Bearer ${token}`,
+      ...adminHeaders(token, sessionCode),
     },
     body: JSON.stringify({ delta, reason, hidden }),
   })
@@ -278,12 +408,10 @@ export async function adminAdjustPoints(token, playerId, { delta, reason, hidden
   return response.json()
 }
 
-export async function adminDeletePlayer(token, playerId) {
+export async function adminDeletePlayer(token, playerId, sessionCode) {
   const response = await fetch(`${API_BASE}/admin/player/${playerId}/delete`, {
     method: 'DELETE',
-    headers: {
-      Authorization: `Bearer ${token}`,
-    },
+    headers: adminHeaders(token, sessionCode),
   })
   if (!response.ok) {
     const error = await response.json().catch(() => ({}))
@@ -292,14 +420,14 @@ export async function adminDeletePlayer(token, playerId) {
   return response.json()
 }
 
-export async function adminCreateRig(token, { session, value, player_id, apply_once = true }) {
+export async function adminCreateRig(token, { session, value, player_id, apply_once = true, rig_type, round_number }) {
   const response = await fetch(`${API_BASE}/admin/rig`, {
     method: 'POST',
     headers: {
       'Content-Type': 'application/json',
-      Authorization: `Bearer ${token}`,
+      ...adminHeaders(token, session),
     },
-    body: JSON.stringify({ session, value, player_id, apply_once }),
+    body: JSON.stringify({ session, value, player_id, apply_once, rig_type, round_number }),
   })
   if (!response.ok) {
     const error = await response.json().catch(() => ({}))
@@ -313,6 +441,7 @@ export async function updatePlayerProgress(playerToken, progressData) {
     method: 'POST',
     headers: {
       'Content-Type': 'application/json',
+      ...sessionHeaders(),
     },
     body: JSON.stringify({
       player_token: playerToken,
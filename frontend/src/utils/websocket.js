@@ -1,5 +1,10 @@
+// Сколько неудачных попыток подряд без единого открытия, прежде чем перейти на SSE
+const SSE_FALLBACK_AFTER = 3
+
 /**
- * WebSocket клиент для подключения к сессии
+ * WebSocket клиент для подключения к сессии.
+ * Если сокет не открывается (сеть площадки, старый телефон), переходит
+ * на Server-Sent Events с теми же сообщениями — вместо опроса состояния.
  */
 export class SessionWebSocket {
   constructor(sessionCode, onMessage, onError, onClose) {
@@ -12,6 +17,12 @@ export class SessionWebSocket {
     this.maxReconnectAttempts = 10
     this.reconnectDelay = 1000
     this.shouldReconnect = true
+    // Игровые команды по сокету: request_id -> { resolve, reject }
+    this.pendingActions = new Map()
+    this.nextRequestId = 1
+    this.playerToken = null
+    this.eventSource = null
+    this.everConnected = false
   }
 
   connect() {
@@ -40,6 +51,11 @@ export class SessionWebSocket {
       this.ws.onopen = () => {
         console.log('WebSocket connected to:', wsUrl)
         this.reconnectAttempts = 0
+        this.everConnected = true
+        // После переподключения сокет заново привязываем к игроку
+        if (this.playerToken) {
+          this.sendAction('auth', { token: this.playerToken }).catch((e) => console.error('WS auth failed:', e))
+        }
         // Уведомляем об успешном подключении
         if (this.onMessage) {
           this.onMessage({ type: 'ws.connected' })
@@ -54,6 +70,10 @@ export class SessionWebSocket {
       this.ws.onmessage = (event) => {
         try {
           const data = JSON.parse(event.data)
+          if (data.type === 'action.ack' || data.type === 'action.error') {
+            this.resolveAction(data)
+            return
+          }
           this.onMessage(data)
         } catch (error) {
           console.error('Error parsing WebSocket message:', error)
@@ -69,15 +89,25 @@ export class SessionWebSocket {
       
       this.ws.onclose = () => {
         console.log('WebSocket closed')
+        for (const { reject } of this.pendingActions.values()) {
+          reject(new Error('WebSocket закрыт'))
+        }
+        this.pendingActions.clear()
         if (this.onClose) {
           this.onClose()
         }
-        if (this.shouldReconnect && this.reconnectAttempts < this.maxReconnectAttempts) {
-          this.reconnectAttempts++
-          const delay = this.reconnectDelay * Math.pow(2, this.reconnectAttempts - 1)
-          console.log(`Reconnecting in ${delay}ms... (attempt ${this.reconnectAttempts})`)
-          setTimeout(() => this.connect(), delay)
+        if (!this.shouldReconnect) {
+          return
+        }
+        if (this.reconnectAttempts >= this.maxReconnectAttempts ||
+            (!this.everConnected && this.reconnectAttempts >= SSE_FALLBACK_AFTER)) {
+          this.connectEventStream()
+          return
         }
+        this.reconnectAttempts++
+        const delay = this.reconnectDelay * Math.pow(2, this.reconnectAttempts - 1)
+        console.log(`Reconnecting in ${delay}ms... (attempt ${this.reconnectAttempts})`)
+        setTimeout(() => this.connect(), delay)
       }
     } catch (error) {
       console.error('Error creating WebSocket:', error)
@@ -87,17 +117,99 @@ export class SessionWebSocket {
     }
   }
 
+  /**
+   * Запасной канал: SSE /api/session/<code>/events. EventSource сам
+   * переподключается и продолжает с Last-Event-ID. Только приём: игровые
+   * команды в этом режиме идут через REST.
+   */
+  connectEventStream() {
+    if (this.eventSource) {
+      return
+    }
+    const host = window.location.hostname || 'localhost'
+    const url = `${window.location.protocol}//${host}:8000/api/session/${this.sessionCode}/events`
+    console.log('WebSocket unavailable, falling back to SSE:', url)
+    this.eventSource = new EventSource(url)
+    this.eventSource.onopen = () => {
+      if (this.onMessage) {
+        this.onMessage({ type: 'ws.connected', transport: 'sse' })
+      }
+    }
+    this.eventSource.onmessage = (event) => {
+      try {
+        this.onMessage(JSON.parse(event.data))
+      } catch (error) {
+        console.error('Error parsing SSE message:', error)
+      }
+    }
+    this.eventSource.onerror = (error) => {
+      console.error('SSE error:', error)
+      if (this.onError) {
+        this.onError(error)
+      }
+    }
+  }
+
   send(data) {
     if (this.ws && this.ws.readyState === WebSocket.OPEN) {
       this.ws.send(JSON.stringify(data))
     }
   }
 
+  /**
+   * Привязать сокет к игроку: после этого доступны игровые команды
+   * (crash.bet, crash.cashout, progress.submit, progress.batch, player.progress).
+   */
+  authenticate(token) {
+    this.playerToken = token
+    return this.sendAction('auth', { token })
+  }
+
+  /**
+   * Игровая команда по сокету. Promise с result из action.ack
+   * или ошибкой из action.error ({ status, message }).
+   */
+  sendAction(type, payload = {}, timeoutMs = 10000) {
+    if (!this.ws || this.ws.readyState !== WebSocket.OPEN) {
+      return Promise.reject(new Error('WebSocket не подключён'))
+    }
+    const requestId = this.nextRequestId++
+    return new Promise((resolve, reject) => {
+      const timer = setTimeout(() => {
+        this.pendingActions.delete(requestId)
+        reject(new Error(`Нет ответа на ${type}`))
+      }, timeoutMs)
+      this.pendingActions.set(requestId, {
+        resolve: (result) => { clearTimeout(timer); resolve(result) },
+        reject: (error) => { clearTimeout(timer); reject(error) },
+      })
+      this.ws.send(JSON.stringify({ type, payload: { ...payload, request_id: requestId } }))
+    })
+  }
+
+  resolveAction(data) {
+    const { request_id: requestId } = data.payload || {}
+    const pending = this.pendingActions.get(requestId)
+    if (!pending) return
+    this.pendingActions.delete(requestId)
+    if (data.type === 'action.ack') {
+      pending.resolve(data.payload.result)
+    } else {
+      const error = new Error(data.payload.message)
+      error.status = data.payload.status
+      pending.reject(error)
+    }
+  }
+
   disconnect() {
     this.shouldReconnect = false
     if (this.ws) {
       this.ws.close()
     }
+    if (this.eventSource) {
+      this.eventSource.close()
+      this.eventSource = null
+    }
   }
 }
 